@@ -31,9 +31,18 @@ ANDROID_PRODUCT_OUT=out/target/product/vsoc_arm64 \
     ./development/gsi/repack_super_image/mix_ssi_with_device_image.py \
     --ssi-files out/target/product/ssi/IMAGES/ \
     --output-dir ./output
+
+--device-image-files and --ssi-files can be repeated to mix every SSI with
+every device image in one run. Each mixed image is then written to
+{output_dir}/{device image name}+{SSI name}/, where inputs with the same name
+are told apart by their parent directories. With --cache-dir, the images
+extracted from the SSI and OTA tools zips are kept across runs, keyed by the
+SHA-256 of the zips.
 """
 
 import argparse
+import concurrent.futures
+import hashlib
 import os
 import shutil
 import subprocess
@@ -47,16 +56,17 @@ SSI_PARTITIONS = ["system", "system_ext", "product"]
 
 
 def add_arguments(parser):
-  parser.add_argument("--device-image-files",
-                      default=os.getenv("ANDROID_PRODUCT_OUT"),
+  parser.add_argument("--device-image-files", action="append",
                       help="The path to the img zip or directory containing "
                            "device images to be mixed with the given SSI. "
                            "Caution: If this is a directory, super.img and "
                            "vbmeta.img under this directory will be modified. "
+                           "Can be repeated. "
                            "Default: $ANDROID_PRODUCT_OUT")
-  parser.add_argument("--ssi-files", required=True,
+  parser.add_argument("--ssi-files", required=True, action="append",
                       help="The path to the target_files zip or directory "
-                           "containing shared system images for mixing.")
+                           "containing shared system images for mixing. "
+                           "Can be repeated.")
   parser.add_argument("--ota-tools",
                       default=os.getenv("ANDROID_HOST_OUT"),
                       help="The path to the device OTA tools zip or directory "
@@ -68,6 +78,13 @@ def add_arguments(parser):
   parser.add_argument("--output-dir",
                       help="The output directory for the mixed image. "
                            "Default: {args.device_image_files}.")
+  parser.add_argument("--cache-dir",
+                      help="The directory where images extracted from the "
+                           "SSI and OTA tools zips are cached across runs. "
+                           "Default: extract to temporary directories.")
+  parser.add_argument("--jobs", type=int, default=1,
+                      help="The number of mixed images built concurrently. "
+                           "Default: 1")
 
 
 def unzip_ssi_images(ssi_target_files, output_dir):
@@ -83,6 +100,13 @@ def unzip_ssi_images(ssi_target_files, output_dir):
   return os.path.join(output_dir, "IMAGES")
 
 
+def unzip_ota_tools(ota_tools, output_dir):
+  """Unzip the OTA tools zipfile."""
+  with zipfile.ZipFile(ota_tools) as ota_tools_zip:
+    repack_super_image.unzip_ota_tools(ota_tools_zip, output_dir)
+  return output_dir
+
+
 def unzip_super_images(device_img_artifact, output_dir):
   """Unzip super.img from the device image artifact zipfile."""
   if not os.path.exists(device_img_artifact):
@@ -109,65 +133,221 @@ def collect_ssi(ssi_dir):
   return ssi_imgs
 
 
+def file_sha256(path):
+  """Returns the hex SHA-256 digest of a file."""
+  digest = hashlib.sha256()
+  with open(path, "rb") as f:
+    for block in iter(lambda: f.read(1024 * 1024), b""):
+      digest.update(block)
+  return digest.hexdigest()
+
+
+def cached_unzip(zip_path, unzip_func, kind, cache_dir, temp_dirs):
+  """Calls unzip_func(zip_path, output_dir) unless the result is cached.
+
+  Without cache_dir, output_dir is a new temporary directory. Otherwise it is
+  {cache_dir}/{kind}/{SHA-256 of zip_path}, which is only reused once the
+  extraction completed.
+
+  Returns:
+    The path returned by unzip_func.
+  """
+  if not os.path.exists(zip_path):
+    raise FileNotFoundError(f"{zip_path} does not exist.")
+  if not cache_dir:
+    temp_dir = tempfile.mkdtemp(prefix=kind + "_")
+    temp_dirs.append(temp_dir)
+    return unzip_func(zip_path, temp_dir)
+
+  entry_dir = os.path.join(os.path.abspath(cache_dir), kind,
+                           file_sha256(zip_path))
+  # The stamp file holds the unzip_func result relative to entry_dir.
+  stamp = os.path.join(entry_dir, ".complete")
+  if not os.path.exists(stamp):
+    print(f"Extract {zip_path} to cache.")
+    os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix=kind + "_",
+                                dir=os.path.dirname(entry_dir))
+    try:
+      result = os.path.relpath(unzip_func(zip_path, temp_dir), temp_dir)
+      with open(os.path.join(temp_dir, ".complete"), "w") as stamp_file:
+        stamp_file.write(result)
+      os.rename(temp_dir, entry_dir)
+    except OSError:
+      # Another run may have filled the entry in the meantime.
+      if not os.path.exists(stamp):
+        raise
+    finally:
+      shutil.rmtree(temp_dir, ignore_errors=True)
+  else:
+    print(f"Use cached {zip_path}.")
+  with open(stamp) as stamp_file:
+    return os.path.normpath(os.path.join(entry_dir, stamp_file.read()))
+
+
+def prepare_device(device_image_files, misc_info, output_dir):
+  """Returns the paths to the super.img and misc_info.txt of a device."""
+  if os.path.isdir(device_image_files):
+    super_img = os.path.join(device_image_files, "super.img")
+    if not misc_info:
+      misc_info = os.path.join(device_image_files, "misc_info.txt")
+  else:
+    super_img = unzip_super_images(device_image_files, output_dir)
+
+  if not misc_info or not os.path.exists(misc_info):
+    raise FileNotFoundError(f"misc_info {misc_info} does not exist.")
+  if not os.path.exists(super_img):
+    raise FileNotFoundError(f"{super_img} does not exist.")
+  return super_img, misc_info
+
+
+def mix(ota_tools_dir, device, ssi_dir, output_dir):
+  """Mixes SSI images with a device super.img and disables vbmeta."""
+  super_img, device_misc_info = device
+  mix_part_imgs = collect_ssi(ssi_dir)
+  output_super_img = os.path.join(output_dir, "super.img")
+  repack_super_image.repack_super_image(ota_tools_dir, device_misc_info,
+                                        super_img, mix_part_imgs,
+                                        output_super_img)
+  print(f"Created mixed super.img at {output_super_img}")
+
+  avbtool_path = os.path.join(ota_tools_dir, "bin", "avbtool")
+  vbmeta_img = os.path.join(output_dir, "vbmeta.img")
+  subprocess.check_call([avbtool_path, "make_vbmeta_image",
+                         "--flag", "2", "--output", vbmeta_img])
+  print(f"Created vbmeta.img at {vbmeta_img}")
+
+
+def input_name(path):
+  """Returns the name of an input zip or directory for output paths."""
+  name = os.path.basename(os.path.normpath(path))
+  return name[:-len(".zip")] if name.endswith(".zip") else name
+
+
+def input_names(paths):
+  """Returns a distinct name for each input zip or directory.
+
+  Inputs with the same name are told apart by prefixing the names of their
+  parent directories, e.g. a/ssi.zip and b/ssi.zip are named a_ssi and b_ssi.
+
+  Raises:
+    ValueError if an input is given twice, or if two inputs cannot be told
+    apart by their paths.
+  """
+  abs_paths = [os.path.abspath(path) for path in paths]
+  for path in abs_paths:
+    if abs_paths.count(path) > 1:
+      raise ValueError(f"{path} is given more than once.")
+
+  names = [input_name(path) for path in abs_paths]
+  parents = [os.path.dirname(path) for path in abs_paths]
+  while True:
+    duplicates = {name for name in names if names.count(name) > 1}
+    if not duplicates:
+      return names
+    renamed = False
+    for i, name in enumerate(names):
+      if name in duplicates and os.path.dirname(parents[i]) != parents[i]:
+        names[i] = f"{os.path.basename(parents[i])}_{name}"
+        parents[i] = os.path.dirname(parents[i])
+        renamed = True
+    if not renamed:
+      raise ValueError(
+          f"inputs named {', '.join(sorted(duplicates))} cannot be told "
+          "apart.")
+
+
+def get_mixes(device_image_files, ssi_files, output_dir):
+  """Returns a (device index, SSI index, output directory) for each mix.
+
+  A single mix is written to output_dir itself. Otherwise each mix is written
+  to {output_dir}/{device image name}+{SSI name}.
+  """
+  if len(device_image_files) == 1 and len(ssi_files) == 1:
+    return [(0, 0, output_dir)]
+  device_names = input_names(device_image_files)
+  ssi_names = input_names(ssi_files)
+  return [(device_index, ssi_index,
+           os.path.join(output_dir, f"{device_name}+{ssi_name}"))
+          for device_index, device_name in enumerate(device_names)
+          for ssi_index, ssi_name in enumerate(ssi_names)]
+
+
 def main():
   parser = argparse.ArgumentParser()
   add_arguments(parser)
   args = parser.parse_args()
 
-  if not args.device_image_files:
+  device_image_files = args.device_image_files
+  if not device_image_files and os.getenv("ANDROID_PRODUCT_OUT"):
+    device_image_files = [os.getenv("ANDROID_PRODUCT_OUT")]
+  if not device_image_files:
     raise ValueError("device image path is not set.")
+  single_mix = len(device_image_files) == 1 and len(args.ssi_files) == 1
+  if not single_mix and not args.output_dir:
+    raise ValueError("--output-dir is required to mix more than one image.")
 
-  output_dir = args.output_dir if args.output_dir else args.device_image_files
+  output_dir = args.output_dir if args.output_dir else device_image_files[0]
   if not os.path.isdir(output_dir):
     raise ValueError(f"output directory {output_dir} is not valid.")
   print(f"Output directory {output_dir}")
 
+  mixes = get_mixes(device_image_files, args.ssi_files, output_dir)
+  for _, _, mix_dir in mixes:
+    os.makedirs(mix_dir, exist_ok=True)
+
+  if not args.ota_tools or not os.path.exists(args.ota_tools):
+    raise FileNotFoundError(f"otatools {args.ota_tools} does not exist.")
+
   temp_dirs = []
   try:
-    if os.path.isdir(args.ssi_files):
-      ssi_dir = args.ssi_files
-    else:
-      temp_dir = tempfile.mkdtemp(prefix="ssi_")
-      temp_dirs.append(temp_dir)
-      ssi_dir = unzip_ssi_images(args.ssi_files, temp_dir)
-
-    device_misc_info = args.misc_info
-    if os.path.isdir(args.device_image_files):
-      device_image_dir = args.device_image_files
-      super_img = os.path.join(device_image_dir, "super.img")
-      if not device_misc_info:
-        device_misc_info = os.path.join(device_image_dir, "misc_info.txt")
-    else:
-      super_img = unzip_super_images(args.device_image_files, output_dir)
+    # Extract the independent inputs concurrently. Each zip is only
+    # extracted once, however many mixes share it.
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=2 + len(device_image_files)) as executor:
+      if os.path.isdir(args.ota_tools):
+        ota_tools_future = None
+        ota_tools_dir = args.ota_tools
+      else:
+        print("Unzip OTA tools.")
+        ota_tools_future = executor.submit(
+            cached_unzip, args.ota_tools, unzip_ota_tools, "ota_tools",
+            args.cache_dir, temp_dirs)
 
-    if not device_misc_info or not os.path.exists(device_misc_info):
-      raise FileNotFoundError(f"misc_info {device_misc_info} does not exist.")
-    if not os.path.exists(super_img):
-      raise FileNotFoundError(f"{super_img} does not exist.")
+      # SSI directories are used as they are; only zips are extracted.
+      ssi_dirs = list(args.ssi_files)
+      ssi_futures = {}
+      for ssi_index, ssi in enumerate(args.ssi_files):
+        if not os.path.isdir(ssi):
+          ssi_futures[ssi_index] = executor.submit(
+              cached_unzip, ssi, unzip_ssi_images, "ssi", args.cache_dir,
+              temp_dirs)
 
-    if not args.ota_tools or not os.path.exists(args.ota_tools):
-      raise FileNotFoundError(f"otatools {args.ota_tools} does not exist.")
-    if os.path.isdir(args.ota_tools):
-      ota_tools_dir = args.ota_tools
-    else:
-      print("Unzip OTA tools.")
-      ota_tools_dir = tempfile.mkdtemp(prefix="ota_tools")
-      temp_dirs.append(ota_tools_dir)
-      with zipfile.ZipFile(args.ota_tools) as ota_tools_zip:
-        repack_super_image.unzip_ota_tools(ota_tools_zip, ota_tools_dir)
-
-    mix_part_imgs = collect_ssi(ssi_dir)
-    output_super_img = os.path.join(output_dir, "super.img")
-    repack_super_image.repack_super_image(ota_tools_dir, device_misc_info,
-                                          super_img, mix_part_imgs,
-                                          output_super_img)
-    print(f"Created mixed super.img at {output_super_img}")
-
-    avbtool_path = os.path.join(ota_tools_dir, "bin", "avbtool")
-    vbmeta_img = os.path.join(output_dir, "vbmeta.img")
-    subprocess.check_call([avbtool_path, "make_vbmeta_image",
-                           "--flag", "2", "--output", vbmeta_img])
-    print(f"Created vbmeta.img at {vbmeta_img}")
+      device_futures = []
+      for device_index, device in enumerate(device_image_files):
+        # super.img is extracted next to its output if it is used once.
+        device_mixes = [m for m in mixes if m[0] == device_index]
+        if os.path.isdir(device) or len(device_mixes) == 1:
+          extract_dir = device_mixes[0][2]
+        else:
+          extract_dir = tempfile.mkdtemp(prefix="device_")
+          temp_dirs.append(extract_dir)
+        device_futures.append(executor.submit(
+            prepare_device, device, args.misc_info, extract_dir))
+
+      if ota_tools_future:
+        ota_tools_dir = ota_tools_future.result()
+      for ssi_index, future in ssi_futures.items():
+        ssi_dirs[ssi_index] = future.result()
+      devices = [future.result() for future in device_futures]
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, args.jobs)) as executor:
+      futures = [executor.submit(mix, ota_tools_dir, devices[device_index],
+                                 ssi_dirs[ssi_index], mix_dir)
+                 for device_index, ssi_index, mix_dir in mixes]
+      for future in futures:
+        future.result()
   finally:
     for temp_dir in temp_dirs:
       shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 - The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+import mix_ssi_with_device_image
+
+
+class InputNamesTest(unittest.TestCase):
+
+  def test_unique_names(self):
+    self.assertEqual(
+        mix_ssi_with_device_image.input_names(
+            ["out/a/ssi.zip", "out/b/IMAGES/", "gsi.zip"]),
+        ["ssi", "IMAGES", "gsi"])
+
+  def test_same_names(self):
+    self.assertEqual(
+        mix_ssi_with_device_image.input_names(
+            ["a/ssi.zip", "b/ssi.zip", "c/x/ssi", "d/x/ssi.zip", "ssi2"]),
+        ["a_ssi", "b_ssi", "c_x_ssi", "d_x_ssi", "ssi2"])
+
+  def test_same_path(self):
+    with self.assertRaises(ValueError):
+      mix_ssi_with_device_image.input_names(["a/ssi.zip", "./a/ssi.zip"])
+    with self.assertRaises(ValueError):
+      mix_ssi_with_device_image.input_names(["a/ssi.zip", "a/ssi"])
+
+  def test_get_mixes(self):
+    self.assertEqual(
+        mix_ssi_with_device_image.get_mixes(["dev.zip"], ["ssi.zip"], "out"),
+        [(0, 0, "out")])
+    self.assertEqual(
+        mix_ssi_with_device_image.get_mixes(
+            ["dev.zip"], ["a/ssi.zip", "b/ssi.zip"], "out"),
+        [(0, 0, os.path.join("out", "dev+a_ssi")),
+         (0, 1, os.path.join("out", "dev+b_ssi"))])
+
+
+class MainTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.temp_dir.cleanup)
+
+  def write_file(self, path, content=b""):
+    path = os.path.join(self.temp_dir.name, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+      f.write(content)
+    return path
+
+  def test_mix_same_names(self):
+    device_dir = os.path.dirname(self.write_file("device/super.img"))
+    self.write_file("device/misc_info.txt")
+    ota_tools_dir = os.path.dirname(self.write_file("otatools/bin/avbtool"))
+    ssi_dirs = [os.path.dirname(self.write_file(f"{name}/IMAGES/system.img"))
+                for name in ["a", "b"]]
+    ssi_zip = self.write_file("c/IMAGES.zip")
+    with zipfile.ZipFile(ssi_zip, "w") as f:
+      f.writestr("IMAGES/system.img", b"")
+    output_dir = os.path.join(self.temp_dir.name, "output")
+    os.mkdir(output_dir)
+
+    argv = ["mix_ssi_with_device_image.py", "--device-image-files", device_dir,
+            "--ota-tools", ota_tools_dir, "--output-dir", output_dir]
+    for ssi in ssi_dirs + [ssi_zip]:
+      argv += ["--ssi-files", ssi]
+    with mock.patch.object(sys, "argv", argv), \
+         mock.patch.object(mix_ssi_with_device_image, "mix") as mix, \
+         contextlib.redirect_stdout(io.StringIO()):
+      mix_ssi_with_device_image.main()
+
+    self.assertEqual(sorted(os.listdir(output_dir)),
+                     ["device+a_IMAGES", "device+b_IMAGES", "device+c_IMAGES"])
+    calls = {args[3]: args[2] for args, _ in mix.call_args_list}
+    # SSI directories are mixed in place.
+    self.assertEqual(calls[os.path.join(output_dir, "device+a_IMAGES")],
+                     ssi_dirs[0])
+    self.assertEqual(calls[os.path.join(output_dir, "device+b_IMAGES")],
+                     ssi_dirs[1])
+    # SSI zips are extracted.
+    self.assertNotEqual(calls[os.path.join(output_dir, "device+c_IMAGES")],
+                        ssi_zip)
+    self.assertEqual(len(mix.call_args_list), 3)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -24,6 +24,8 @@ import subprocess
 import tempfile
 import zipfile
 
+import super_image
+
 
 # The file extension of the unpacked images.
 IMG_FILE_EXT = ".img"
@@ -62,10 +64,28 @@ def unzip_ota_tools(ota_tools_zip, output_dir):
       os.chmod(file_path, file_stat.st_mode | permissions)
 
 
-def is_sparse_image(image_path):
-  """Checks whether a file is a sparse image."""
-  with open(image_path, "rb") as image_file:
-    return image_file.read(4) == b"\x3a\xff\x26\xed"
+class UnpackedPartitionImages(object):
+  """Partition images of a super image, copied out on first lookup.
+
+  Only the partitions that are looked up, i.e. the ones reused in the
+  repacked super image, are written to unpack_dir.
+  """
+
+  def __init__(self, super_img, unpack_dir):
+    self._super_img = super_img
+    self._unpack_dir = unpack_dir
+    self._paths = dict()
+
+  def get(self, part, default=None):
+    """Returns the path to the image of part, or default if there is none."""
+    if part not in self._super_img.partitions:
+      return default
+    if part not in self._paths:
+      print("Unpack " + part + " partition.")
+      path = os.path.join(self._unpack_dir, part + IMG_FILE_EXT)
+      self._super_img.copy_partition(part, path)
+      self._paths[part] = path
+    return self._paths[part]
 
 
 def rewrite_misc_info(args_part_imgs, unpacked_part_imgs, lpmake_path,
@@ -76,8 +96,8 @@ def rewrite_misc_info(args_part_imgs, unpacked_part_imgs, lpmake_path,
     args_part_imgs: A dict of {partition_name: image_path} that the user
                     intends to substitute. The partition_names must not have
                     slot suffixes.
-    unpacked_part_imgs: A dict of {partition_name: image_path} unpacked from
-                        the input super image. The partition_names must have
+    unpacked_part_imgs: A dict-like {partition_name: image_path} unpacked
+                        from the input super image. The partition_names must have
                         slot suffixes if the misc info enables virtual_ab.
     lpmake_path: The path to the lpmake binary.
     input_file: The input misc info file object.
@@ -122,30 +142,16 @@ def repack_super_image(ota_tools_dir, misc_info_path, super_img_path,
   temp_dirs = []
   temp_files = []
 
+  super_img = None
+
   try:
-    if not is_sparse_image(super_img_path):
-      raw_super_img = super_img_path
-    else:
-      print("Convert to unsparsed super image.")
-      simg2img_path = os.path.join(ota_tools_dir, BIN_DIR_NAME, "simg2img")
-      with tempfile.NamedTemporaryFile(
-          mode="wb", prefix="super", suffix=".img",
-          delete=False) as raw_super_img_file:
-        temp_files.append(raw_super_img_file.name)
-        raw_super_img = raw_super_img_file.name
-        subprocess.check_call([
-            simg2img_path, super_img_path, raw_super_img])
-
-    print("Unpack super image.")
-    unpacked_part_imgs = dict()
-    lpunpack_path = os.path.join(ota_tools_dir, BIN_DIR_NAME, "lpunpack")
+    # The super image is read in place, sparse or not, and only the
+    # partitions that are not replaced are copied out of it.
+    print("Read super image metadata.")
+    super_img = super_image.SuperImage(super_img_path)
     unpack_dir = tempfile.mkdtemp(prefix="lpunpack")
     temp_dirs.append(unpack_dir)
-    subprocess.check_call([lpunpack_path, raw_super_img, unpack_dir])
-    for file_name in os.listdir(unpack_dir):
-      if file_name.endswith(IMG_FILE_EXT):
-        part = file_name[:-len(IMG_FILE_EXT)]
-        unpacked_part_imgs[part] = os.path.join(unpack_dir, file_name)
+    unpacked_part_imgs = UnpackedPartitionImages(super_img, unpack_dir)
 
     print("Create temporary misc info.")
     lpmake_path = os.path.join(ota_tools_dir, BIN_DIR_NAME, "lpmake")
@@ -164,12 +170,18 @@ def repack_super_image(ota_tools_dir, misc_info_path, super_img_path,
       raise ValueError("Cannot find partitions in misc info: " +
                        " ".join(parts_not_found))
 
+    # build_super_image may overwrite the input super image.
+    super_img.close()
+    super_img = None
+
     print("Build super image.")
     build_super_image_path = os.path.join(ota_tools_dir, BIN_DIR_NAME,
                                           "build_super_image")
     subprocess.check_call([build_super_image_path, misc_info_file_path,
                            output_path])
   finally:
+    if super_img:
+      super_img.close()
     for temp_dir in temp_dirs:
       shutil.rmtree(temp_dir, ignore_errors=True)
     for temp_file in temp_files:
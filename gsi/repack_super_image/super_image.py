@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 - The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reads Android sparse images and the partitions of super images.
+
+This module replaces `simg2img` followed by `lpunpack`. A super image, sparse
+or not, is opened in place; its liblp metadata is parsed to enumerate the
+logical partitions, and each partition can be read as a seekable stream or
+copied to a raw image file without writing the unused parts of the image.
+"""
+
+import bisect
+import collections
+import io
+import os
+import struct
+
+
+SPARSE_HEADER_MAGIC = 0xed26ff3a
+SPARSE_HEADER_FORMAT = "<IHHHHIIII"
+SPARSE_CHUNK_HEADER_FORMAT = "<HHII"
+CHUNK_TYPE_RAW = 0xcac1
+CHUNK_TYPE_FILL = 0xcac2
+CHUNK_TYPE_DONT_CARE = 0xcac3
+CHUNK_TYPE_CRC32 = 0xcac4
+
+# See system/core/fs_mgr/liblp/include/liblp/metadata_format.h
+LP_SECTOR_SIZE = 512
+LP_PARTITION_RESERVED_BYTES = 4096
+LP_METADATA_GEOMETRY_MAGIC = 0x616c4467
+LP_METADATA_GEOMETRY_SIZE = 4096
+LP_METADATA_HEADER_MAGIC = 0x414c5030
+LP_METADATA_MAJOR_VERSION = 10
+LP_TARGET_TYPE_LINEAR = 0
+LP_TARGET_TYPE_ZERO = 1
+LP_PARTITION_NAME_SIZE = 36
+
+GEOMETRY_FORMAT = "<II32sIII"
+HEADER_FORMAT = "<IHHI32sI32s"
+TABLE_DESCRIPTOR_FORMAT = "<III"
+PARTITION_FORMAT = "<36sIIII"
+EXTENT_FORMAT = "<QIQI"
+
+# The kinds of extents yielded by Image.extents().
+EXTENT_DATA = "data"
+EXTENT_FILL = "fill"
+EXTENT_ZERO = "zero"
+
+# Size of the buffer used to copy data extents.
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class ImageFormatError(ValueError):
+  """Raised when an image is not a valid sparse or super image."""
+
+
+def _read_exactly(image_file, offset, size):
+  """Reads size bytes at offset, or raises ImageFormatError."""
+  image_file.seek(offset)
+  data = image_file.read(size)
+  if len(data) != size:
+    raise ImageFormatError("Unexpected end of %s at offset %d." %
+                           (image_file.name, offset))
+  return data
+
+
+def _c_string(data):
+  """Decodes a NUL-padded char array."""
+  return data.split(b"\0", 1)[0].decode("utf-8")
+
+
+class Image(object):
+  """A random access view of an unsparsed image.
+
+  Attributes:
+    file: The underlying image file object.
+    size: The size of the unsparsed image in bytes.
+  """
+
+  def __init__(self, image_file, size):
+    self.file = image_file
+    self.size = size
+
+  def close(self):
+    self.file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def read_at(self, offset, size):
+    """Returns up to size bytes of the unsparsed image at offset."""
+    size = max(0, min(size, self.size - offset))
+    chunks = []
+    for extent_offset, length, kind, value in self.extents(offset, size):
+      if kind == EXTENT_DATA:
+        chunks.append(_read_exactly(self.file, value, length))
+      elif kind == EXTENT_FILL:
+        chunks.append((value * (length // 4 + 1))[:length])
+      else:
+        chunks.append(bytes(length))
+    return b"".join(chunks)
+
+  def extents(self, offset, size):
+    """Yields (offset, length, kind, value) covering [offset, offset+size).
+
+    kind is EXTENT_DATA with value being the offset in the image file,
+    EXTENT_FILL with value being the 4-byte fill pattern starting at the
+    extent's offset, or EXTENT_ZERO.
+    """
+    if size > 0:
+      yield offset, size, EXTENT_DATA, offset
+
+
+class SparseImage(Image):
+  """A random access view of an Android sparse image, without unsparsing it.
+
+  Only the chunk headers are read when the image is opened; data is read
+  from the chunks on demand.
+  """
+
+  def __init__(self, image_file):
+    header = _read_exactly(image_file, 0,
+                           struct.calcsize(SPARSE_HEADER_FORMAT))
+    (magic, major_version, _, file_header_size, chunk_header_size,
+     block_size, total_blocks, total_chunks,
+     _) = struct.unpack(SPARSE_HEADER_FORMAT, header)
+    if magic != SPARSE_HEADER_MAGIC or major_version != 1:
+      raise ImageFormatError(image_file.name + " is not a sparse image.")
+    super().__init__(image_file, total_blocks * block_size)
+
+    # Sorted output offsets of the chunks and their (kind, value).
+    self._offsets = []
+    self._chunks = []
+    chunk_format_size = struct.calcsize(SPARSE_CHUNK_HEADER_FORMAT)
+    file_offset = file_header_size
+    output_offset = 0
+    for _ in range(total_chunks):
+      chunk_type, _, chunk_blocks, total_size = struct.unpack(
+          SPARSE_CHUNK_HEADER_FORMAT,
+          _read_exactly(image_file, file_offset, chunk_format_size))
+      data_offset = file_offset + chunk_header_size
+      length = chunk_blocks * block_size
+      if chunk_type == CHUNK_TYPE_RAW:
+        if total_size - chunk_header_size != length:
+          raise ImageFormatError("Bad raw chunk size in " + image_file.name)
+        chunk = (EXTENT_DATA, data_offset)
+      elif chunk_type == CHUNK_TYPE_FILL:
+        fill = _read_exactly(image_file, data_offset, 4)
+        chunk = ((EXTENT_ZERO, None) if fill == bytes(4) else
+                 (EXTENT_FILL, fill))
+      elif chunk_type == CHUNK_TYPE_DONT_CARE:
+        chunk = (EXTENT_ZERO, None)
+      elif chunk_type == CHUNK_TYPE_CRC32:
+        chunk = None
+      else:
+        raise ImageFormatError("Unknown chunk type 0x%x in %s" %
+                               (chunk_type, image_file.name))
+      if chunk and length:
+        self._offsets.append(output_offset)
+        self._chunks.append((length,) + chunk)
+      output_offset += length
+      file_offset += total_size
+    if output_offset != self.size:
+      raise ImageFormatError("Chunks of %s do not add up to its size." %
+                             image_file.name)
+
+  def extents(self, offset, size):
+    end = offset + size
+    index = bisect.bisect_right(self._offsets, offset) - 1
+    while offset < end and 0 <= index < len(self._offsets):
+      chunk_offset = self._offsets[index]
+      length, kind, value = self._chunks[index]
+      skip = offset - chunk_offset
+      length = min(length - skip, end - offset)
+      if kind == EXTENT_DATA:
+        value += skip
+      elif kind == EXTENT_FILL and skip % 4:
+        value = value[skip % 4:] + value[:skip % 4]
+      yield offset, length, kind, value
+      offset += length
+      index += 1
+
+
+def open_image(path):
+  """Opens a raw or sparse image for random access.
+
+  Returns:
+    A SparseImage if path is a sparse image, otherwise an Image.
+  """
+  image_file = open(path, "rb")
+  try:
+    magic = image_file.read(4)
+    if magic == struct.pack("<I", SPARSE_HEADER_MAGIC):
+      return SparseImage(image_file)
+    return Image(image_file, os.fstat(image_file.fileno()).st_size)
+  except:
+    image_file.close()
+    raise
+
+
+Extent = collections.namedtuple(
+    "Extent", ["logical_offset", "size", "target_type", "physical_offset"])
+
+
+class Partition(object):
+  """A logical partition in a super image.
+
+  Attributes:
+    name: The partition name, with its slot suffix if any.
+    group: The name of the partition group.
+    size: The size of the partition in bytes.
+    extents: The list of Extent of the partition, in logical order.
+  """
+
+  def __init__(self, name, group, extents):
+    self.name = name
+    self.group = group
+    self.extents = extents
+    self.size = sum(extent.size for extent in extents)
+    self._offsets = [extent.logical_offset for extent in extents]
+
+  def map(self, offset, size):
+    """Yields (extent, skip, length) covering [offset, offset+size)."""
+    end = min(offset + size, self.size)
+    index = bisect.bisect_right(self._offsets, offset) - 1
+    while offset < end:
+      extent = self.extents[index]
+      skip = offset - extent.logical_offset
+      length = min(extent.size - skip, end - offset)
+      yield extent, skip, length
+      offset += length
+      index += 1
+
+
+class PartitionStream(io.RawIOBase):
+  """A seekable read-only stream over the extents of a partition."""
+
+  def __init__(self, image, partition):
+    super().__init__()
+    self._image = image
+    self._partition = partition
+    self._position = 0
+
+  def readable(self):
+    return True
+
+  def seekable(self):
+    return True
+
+  def seek(self, offset, whence=io.SEEK_SET):
+    if whence == io.SEEK_CUR:
+      offset += self._position
+    elif whence == io.SEEK_END:
+      offset += self._partition.size
+    if offset < 0:
+      raise ValueError("Negative seek position %d" % offset)
+    self._position = offset
+    return offset
+
+  def tell(self):
+    return self._position
+
+  def readinto(self, buffer):
+    data = self.read(len(buffer))
+    buffer[:len(data)] = data
+    return len(data)
+
+  def read(self, size=-1):
+    if size is None or size < 0:
+      size = self._partition.size - self._position
+    chunks = []
+    for extent, skip, length in self._partition.map(self._position, size):
+      if extent.target_type == LP_TARGET_TYPE_LINEAR:
+        chunks.append(self._image.read_at(extent.physical_offset + skip,
+                                          length))
+      else:
+        chunks.append(bytes(length))
+    data = b"".join(chunks)
+    self._position += len(data)
+    return data
+
+
+class SuperImage(object):
+  """The logical partitions of a raw or sparse super image.
+
+  Attributes:
+    image: The Image the super image is read from.
+    partitions: A dict of {partition_name: Partition}.
+  """
+
+  def __init__(self, path, slot=0):
+    self.image = open_image(path)
+    try:
+      self.partitions = self._read_partitions(slot)
+    except:
+      self.image.close()
+      raise
+
+  def close(self):
+    self.image.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def _read_partitions(self, slot):
+    geometry_size = struct.calcsize(GEOMETRY_FORMAT)
+    (magic, _, _, metadata_max_size, metadata_slot_count,
+     _) = struct.unpack(GEOMETRY_FORMAT, self.image.read_at(
+         LP_PARTITION_RESERVED_BYTES, geometry_size))
+    if magic != LP_METADATA_GEOMETRY_MAGIC:
+      raise ImageFormatError("Cannot find liblp geometry in super image.")
+    if slot >= metadata_slot_count:
+      raise ImageFormatError("Super image has no metadata slot %d." % slot)
+
+    # The primary metadata follows the primary and backup geometry.
+    metadata_offset = (LP_PARTITION_RESERVED_BYTES +
+                       LP_METADATA_GEOMETRY_SIZE * 2 +
+                       metadata_max_size * slot)
+    header_format_size = struct.calcsize(HEADER_FORMAT)
+    descriptor_size = struct.calcsize(TABLE_DESCRIPTOR_FORMAT)
+    header = self.image.read_at(metadata_offset,
+                                header_format_size + descriptor_size * 4)
+    (magic, major_version, _, header_size, _, tables_size,
+     _) = struct.unpack_from(HEADER_FORMAT, header)
+    if magic != LP_METADATA_HEADER_MAGIC:
+      raise ImageFormatError("Cannot find liblp metadata in super image.")
+    if major_version != LP_METADATA_MAJOR_VERSION:
+      raise ImageFormatError("Unsupported liblp metadata version %d." %
+                             major_version)
+    tables = self.image.read_at(metadata_offset + header_size, tables_size)
+
+    def table(index, entry_format):
+      offset, num_entries, entry_size = struct.unpack_from(
+          TABLE_DESCRIPTOR_FORMAT, header,
+          header_format_size + descriptor_size * index)
+      return [struct.unpack_from(entry_format, tables,
+                                 offset + entry_size * i)
+              for i in range(num_entries)]
+
+    partition_table = table(0, PARTITION_FORMAT)
+    extent_table = table(1, EXTENT_FORMAT)
+    # Only the group name, at the start of each entry, is needed.
+    group_names = [_c_string(entry[0])
+                   for entry in table(2, "<%ds" % LP_PARTITION_NAME_SIZE)]
+
+    partitions = dict()
+    for (name, _, first_extent, num_extents,
+         group_index) in partition_table:
+      name = _c_string(name)
+      extents = []
+      logical_offset = 0
+      for (num_sectors, target_type, target_data,
+           target_source) in extent_table[first_extent:
+                                          first_extent + num_extents]:
+        if target_type == LP_TARGET_TYPE_LINEAR and target_source != 0:
+          raise ImageFormatError(
+              "Partition %s is on another block device; retrofit super "
+              "images are not supported." % name)
+        size = num_sectors * LP_SECTOR_SIZE
+        extents.append(Extent(logical_offset, size, target_type,
+                              target_data * LP_SECTOR_SIZE))
+        logical_offset += size
+      partitions[name] = Partition(name, group_names[group_index], extents)
+    return partitions
+
+  def open(self, name):
+    """Returns a seekable PartitionStream of a partition."""
+    return PartitionStream(self.image, self.partitions[name])
+
+  def extents(self, name):
+    """Yields (offset, length, kind, value) of a partition's contents.
+
+    The offsets are relative to the partition. See Image.extents().
+    """
+    for extent, _, length in self.partitions[name].map(0, float("inf")):
+      if extent.target_type != LP_TARGET_TYPE_LINEAR:
+        yield extent.logical_offset, length, EXTENT_ZERO, None
+        continue
+      for offset, length, kind, value in self.image.extents(
+          extent.physical_offset, extent.size):
+        yield (offset - extent.physical_offset + extent.logical_offset,
+               length, kind, value)
+
+  def copy_partition(self, name, output_path):
+    """Writes a partition to a raw image file.
+
+    Zero extents, i.e. don't-care chunks, zero fills and zero targets, are
+    skipped rather than written, so the output is a sparse file on file
+    systems that support it.
+    """
+    image_file = self.image.file
+    with open(output_path, "wb") as output_file:
+      for offset, length, kind, value in self.extents(name):
+        if kind == EXTENT_ZERO:
+          continue
+        output_file.seek(offset)
+        if kind == EXTENT_FILL:
+          pattern = value * (COPY_BUFFER_SIZE // 4)
+          while length > 0:
+            output_file.write(pattern[:length])
+            length -= len(pattern)
+          continue
+        image_file.seek(value)
+        while length > 0:
+          data = image_file.read(min(length, COPY_BUFFER_SIZE))
+          if not data:
+            raise ImageFormatError("Unexpected end of " + image_file.name)
+          output_file.write(data)
+          length -= len(data)
+      output_file.truncate(self.partitions[name].size)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 - The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import struct
+import tempfile
+import unittest
+
+import super_image
+
+
+BLOCK_SIZE = 4096
+METADATA_MAX_SIZE = 65536
+
+
+def build_super_image(partitions, image_size):
+  """Builds a raw super image with liblp metadata in slot 0.
+
+  Args:
+    partitions: A list of (name, [(target_type, num_sectors, sector)]).
+    image_size: The size of the image in bytes.
+
+  Returns:
+    A bytearray of the image.
+  """
+  partition_table = b""
+  extent_table = b""
+  num_extents = 0
+  for name, extents in partitions:
+    partition_table += struct.pack(super_image.PARTITION_FORMAT,
+                                   name.encode(), 0, num_extents,
+                                   len(extents), 1)
+    for target_type, num_sectors, sector in extents:
+      extent_table += struct.pack(super_image.EXTENT_FORMAT, num_sectors,
+                                  target_type, sector, 0)
+    num_extents += len(extents)
+  group_table = (struct.pack("<36sIQ", b"default", 0, 0) +
+                 struct.pack("<36sIQ", b"group_a", 0, 0))
+  tables = partition_table + extent_table + group_table
+  descriptors = struct.pack(
+      "<IIIIIIIIIIII",
+      0, len(partitions), 52,
+      len(partition_table), num_extents, 24,
+      len(partition_table) + len(extent_table), 2, 48,
+      len(tables), 0, 64)
+  header_size = struct.calcsize(super_image.HEADER_FORMAT) + len(descriptors)
+  header = struct.pack(super_image.HEADER_FORMAT,
+                       super_image.LP_METADATA_HEADER_MAGIC,
+                       super_image.LP_METADATA_MAJOR_VERSION, 0,
+                       header_size, bytes(32), len(tables), bytes(32))
+  geometry = struct.pack(super_image.GEOMETRY_FORMAT,
+                         super_image.LP_METADATA_GEOMETRY_MAGIC, 52,
+                         bytes(32), METADATA_MAX_SIZE, 2, BLOCK_SIZE)
+
+  image = bytearray(image_size)
+  offset = super_image.LP_PARTITION_RESERVED_BYTES
+  image[offset:offset + len(geometry)] = geometry
+  offset += super_image.LP_METADATA_GEOMETRY_SIZE * 2
+  metadata = header + descriptors + tables
+  image[offset:offset + len(metadata)] = metadata
+  return image
+
+
+def build_sparse_image(data, chunks):
+  """Encodes data as a sparse image.
+
+  Args:
+    data: The unsparsed image, a multiple of BLOCK_SIZE bytes.
+    chunks: A list of (chunk_type, num_blocks) covering data. Fill chunks
+            use the first 4 bytes of their blocks as the pattern.
+  """
+  body = b""
+  offset = 0
+  for chunk_type, num_blocks in chunks:
+    length = num_blocks * BLOCK_SIZE
+    if chunk_type == super_image.CHUNK_TYPE_RAW:
+      payload = bytes(data[offset:offset + length])
+    elif chunk_type == super_image.CHUNK_TYPE_FILL:
+      payload = bytes(data[offset:offset + 4])
+    else:
+      payload = b""
+    body += struct.pack(super_image.SPARSE_CHUNK_HEADER_FORMAT, chunk_type,
+                        0, num_blocks, 12 + len(payload)) + payload
+    offset += length
+  # A trailing CRC32 chunk, which covers no blocks.
+  body += struct.pack(super_image.SPARSE_CHUNK_HEADER_FORMAT,
+                      super_image.CHUNK_TYPE_CRC32, 0, 0, 16) + bytes(4)
+  header = struct.pack(super_image.SPARSE_HEADER_FORMAT,
+                       super_image.SPARSE_HEADER_MAGIC, 1, 0, 28, 12,
+                       BLOCK_SIZE, len(data) // BLOCK_SIZE, len(chunks) + 1,
+                       0)
+  return header + body
+
+
+class SuperImageTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.temp_dir.cleanup)
+
+    # system_a has two linear extents in reverse physical order, vendor_a
+    # has a zero extent between two linear extents.
+    partitions = [
+        ("system_a", [(super_image.LP_TARGET_TYPE_LINEAR, 16, 384),
+                      (super_image.LP_TARGET_TYPE_LINEAR, 8, 256)]),
+        ("vendor_a", [(super_image.LP_TARGET_TYPE_LINEAR, 8, 264),
+                      (super_image.LP_TARGET_TYPE_ZERO, 8, 0),
+                      (super_image.LP_TARGET_TYPE_LINEAR, 4, 400)]),
+        ("product_a", []),
+    ]
+    self.raw = build_super_image(partitions, 64 * BLOCK_SIZE)
+    # Block 32 and 33 (sectors 256-271) hold distinct bytes, block 48-49
+    # (sectors 384-399) a fill pattern, block 50 (sector 400) more bytes.
+    for i in range(32 * BLOCK_SIZE, 34 * BLOCK_SIZE):
+      self.raw[i] = (i * 7) % 251
+    self.raw[48 * BLOCK_SIZE:50 * BLOCK_SIZE] = b"\x01\x02\x03\x04" * 2048
+    for i in range(50 * BLOCK_SIZE, 51 * BLOCK_SIZE):
+      self.raw[i] = (i * 13) % 241
+
+    self.raw_path = os.path.join(self.temp_dir.name, "super.img")
+    with open(self.raw_path, "wb") as f:
+      f.write(self.raw)
+    self.sparse_path = os.path.join(self.temp_dir.name, "super_sparse.img")
+    with open(self.sparse_path, "wb") as f:
+      f.write(build_sparse_image(self.raw, [
+          (super_image.CHUNK_TYPE_RAW, 4),
+          (super_image.CHUNK_TYPE_DONT_CARE, 28),
+          (super_image.CHUNK_TYPE_RAW, 2),
+          (super_image.CHUNK_TYPE_DONT_CARE, 14),
+          (super_image.CHUNK_TYPE_FILL, 2),
+          (super_image.CHUNK_TYPE_RAW, 1),
+          (super_image.CHUNK_TYPE_DONT_CARE, 13),
+      ]))
+
+  def expected_partition(self, name):
+    raw = bytes(self.raw)
+    if name == "system_a":
+      return raw[384 * 512:400 * 512] + raw[256 * 512:264 * 512]
+    if name == "vendor_a":
+      return raw[264 * 512:272 * 512] + bytes(8 * 512) + raw[400 * 512:
+                                                              404 * 512]
+    return b""
+
+  def test_sparse_image(self):
+    with super_image.open_image(self.sparse_path) as image:
+      self.assertIsInstance(image, super_image.SparseImage)
+      self.assertEqual(image.size, len(self.raw))
+      self.assertEqual(image.read_at(0, image.size), bytes(self.raw))
+      # Reads that start within a chunk, and span chunks.
+      for offset, size in [(5, 3), (48 * BLOCK_SIZE + 3, 9),
+                           (33 * BLOCK_SIZE - 10, BLOCK_SIZE * 20)]:
+        self.assertEqual(image.read_at(offset, size),
+                         bytes(self.raw[offset:offset + size]))
+
+  def test_partitions(self):
+    for path in (self.raw_path, self.sparse_path):
+      with super_image.SuperImage(path) as image:
+        self.assertEqual(sorted(image.partitions),
+                         ["product_a", "system_a", "vendor_a"])
+        self.assertEqual(image.partitions["system_a"].size, 24 * 512)
+        self.assertEqual(image.partitions["system_a"].group, "group_a")
+        for name in image.partitions:
+          self.assertEqual(image.open(name).read(),
+                           self.expected_partition(name))
+
+  def test_partition_stream(self):
+    expected = self.expected_partition("system_a")
+    with super_image.SuperImage(self.sparse_path) as image:
+      stream = io.BufferedReader(image.open("system_a"), 1000)
+      stream.seek(16 * 512 - 100)
+      self.assertEqual(stream.read(200),
+                       expected[16 * 512 - 100:16 * 512 + 100])
+      stream.seek(-10, io.SEEK_END)
+      self.assertEqual(stream.read(), expected[-10:])
+      self.assertEqual(stream.read(), b"")
+
+  def test_copy_partition(self):
+    for path in (self.raw_path, self.sparse_path):
+      with super_image.SuperImage(path) as image:
+        for name in image.partitions:
+          output_path = os.path.join(self.temp_dir.name, name + ".img")
+          image.copy_partition(name, output_path)
+          with open(output_path, "rb") as f:
+            self.assertEqual(f.read(), self.expected_partition(name))
+
+  def test_not_super_image(self):
+    with self.assertRaises(super_image.ImageFormatError):
+      super_image.SuperImage(os.path.join(os.path.dirname(__file__),
+                                          "super_image.py"))
+
+
+if __name__ == "__main__":
+  unittest.main()
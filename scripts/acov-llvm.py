@@ -36,14 +36,20 @@
 # 4. Pull coverage from device and generate coverage report
 #   $ acov-llvm.py report -s <one-or-more-source-paths-in-$ANDROID_BUILD_TOP> \
 #                         -b <one-or-more-binaries-in-$OUT> \
+#                         [-o <report-dir>]
 # E.g.:
 # acov-llvm.py report \
 #         -s bionic \
 #         -b \
 #         $OUT/symbols/apex/com.android.runtime/lib/bionic/libc.so \
 #         $OUT/symbols/apex/com.android.runtime/lib/bionic/libm.so
+#
+# With -o, the .profraw files and merged.profdata are kept in <report-dir>, and
+# later reports only pull and merge the .profraw files that are new on the
+# device.
 
 import argparse
+import json
 import logging
 import os
 import re
@@ -54,6 +60,7 @@ import tempfile
 from pathlib import Path
 
 FLUSH_SLEEP = 60
+DEVICE_TRACE_DIR = '/data/misc/trace'
 
 
 def android_build_top():
@@ -96,37 +103,48 @@ def adb_shell(cmd, *args, **kwargs):
     return adb(['shell'] + cmd, *args, **kwargs)
 
 
+def _read_sigcgt(pids=None):
+    """Returns {pid: SigCgt} of pids, or of all processes if pids is None.
+
+    The status of all processes is read in a single 'adb shell' invocation.
+    The SigCgt of a process without a 'SigCgt:' line is None, and processes
+    which are no longer active are left out.
+    """
+    pid_list = ' '.join(pids) if pids else '$(ls /proc | grep -E "^[0-9]+$")'
+    script = (f'for pid in {pid_list}; do '
+              f'if [ -r /proc/$pid/status ]; then '
+              f'echo "$pid $(grep "^SigCgt:" /proc/$pid/status)"; '
+              f'fi; done')
+    output = adb_shell([script], text=True, stderr=subprocess.DEVNULL)
+
+    sigcgts = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        sigcgts[fields[0]] = int(fields[2], base=16) if len(fields) > 2 else None
+    return sigcgts
+
+
 def send_flush_signal(pids=None):
+    sigcgts = _read_sigcgt(pids)
 
     def _has_handler_sig37(pid):
-        try:
-            status = adb_shell(['cat', f'/proc/{pid}/status'],
-                               text=True,
-                               stderr=subprocess.DEVNULL)
-        except subprocess.CalledProcessError:
+        if pid not in sigcgts:
             logging.warning(f'Process {pid} is no longer active')
             return False
-
-        status = status.split('\n')
-        sigcgt = [
-            line.split(':\t')[1] for line in status if line.startswith('SigCgt')
-        ]
-        if not sigcgt:
+        if sigcgts[pid] is None:
             logging.warning(f'Cannot find \'SigCgt:\' in /proc/{pid}/status')
             return False
-        return int(sigcgt[0], base=16) & (1 << 36)
+        return sigcgts[pid] & (1 << 36)
 
-    if not pids:
-        output = adb_shell(['ps', '-eo', 'pid'], text=True)
-        pids = [pid.strip() for pid in output.split()]
-        pids = pids[1:]  # ignore the column header
-    pids = [pid for pid in pids if _has_handler_sig37(pid)]
+    pids = [pid for pid in (pids or sigcgts) if _has_handler_sig37(pid)]
 
     if not pids:
         logging.warning(
             f'couldn\'t find any process with handler for signal 37')
 
-    # Some processes may have exited after we run `ps` command above - ignore failures when
+    # Some processes may have exited after we read their status above - ignore failures when
     # sending flush signal.
     # We rely on kill(1) sending the signal to all pids on the command line even if some don't
     # exist.  This is true of toybox and "probably implied" by POSIX, even if not explicitly called 
@@ -171,27 +189,111 @@ def do_flush(args):
     time.sleep(FLUSH_SLEEP)
 
 
+def _list_device_profraws():
+    """Returns {name: (size, mtime)} of the .profraw files on the device."""
+    output = adb_shell([
+        f'cd {DEVICE_TRACE_DIR} && for f in *.profraw; do '
+        f'if [ -f "$f" ]; then stat -c "%s %Y %n" "$f"; fi; done'
+    ], text=True)
+
+    profraws = {}
+    for line in output.splitlines():
+        fields = line.split(' ', 2)
+        if len(fields) == 3:
+            profraws[fields[2]] = (int(fields[0]), int(fields[1]))
+    return profraws
+
+
+def _pull_profraws(names, trace_dir):
+    """Pulls .profraw files from the device through a single tar stream."""
+    if not names:
+        return
+    compressed = adb_shell(['tar', '-czf', '-', '-C', DEVICE_TRACE_DIR] +
+                           sorted(names))
+    check_output(['tar', 'zxvf', '-', '-C', trace_dir], input=compressed)
+
+
+def _merge_profraws(profdata, profraws, jobs, base_profdata=None):
+    """Merges .profraw files, and optionally a .profdata, into profdata."""
+    # Write to a temporary file so that profdata stays valid if merging fails.
+    tmp_profdata = profdata + '.tmp'
+    inputs = ([base_profdata] if base_profdata else []) + profraws
+    check_output([
+        str(LLVM_PROFDATA_PATH), 'merge', '--failure-mode=all',
+        f'--num-threads={jobs}', f'--output={tmp_profdata}'
+    ] + inputs)
+    os.replace(tmp_profdata, profdata)
+
+
+def update_profdata(report_dir, jobs):
+    """Pulls new .profraw files and merges them into merged.profdata.
+
+    The .profraw files merged so far are recorded in merged.json. Only new
+    .profraw files are merged into the existing merged.profdata. If a merged
+    .profraw file changed or was deleted on the device, merged.profdata is
+    rebuilt from all of them, since its counters must not be added twice.
+
+    Returns:
+        The path to merged.profdata.
+    """
+    trace_dir = os.path.join(report_dir, 'trace')
+    profdata = os.path.join(report_dir, 'merged.profdata')
+    record_path = os.path.join(report_dir, 'merged.json')
+    os.makedirs(trace_dir, exist_ok=True)
+
+    merged = {}
+    if os.path.exists(record_path) and os.path.exists(profdata):
+        with open(record_path) as f:
+            merged = {name: tuple(stat) for name, stat in json.load(f).items()}
+
+    profraws = _list_device_profraws()
+    if not profraws:
+        raise RuntimeError(f'no .profraw files in {DEVICE_TRACE_DIR}')
+    stale = [name for name, stat in merged.items() if profraws.get(name) != stat]
+    if stale:
+        logging.info(f'{len(stale)} merged .profraw files changed on device, '
+                     'merging all .profraw files again')
+        merged = {}
+        for name in stale:
+            if os.path.exists(os.path.join(trace_dir, name)):
+                os.remove(os.path.join(trace_dir, name))
+
+    new = [name for name in profraws if name not in merged]
+    _pull_profraws(new, trace_dir)
+    if new:
+        logging.info(f'merging {len(new)} new .profraw files')
+        _merge_profraws(profdata,
+                        [os.path.join(trace_dir, name) for name in sorted(new)],
+                        jobs,
+                        profdata if merged else None)
+    else:
+        logging.info('no new .profraw files to merge')
+
+    with open(record_path, 'w') as f:
+        json.dump({name: profraws[name] for name in sorted(profraws)}, f,
+                  indent=2)
+    return profdata
+
+
 def do_report(args):
     adb_root()
 
-    temp_dir = tempfile.mkdtemp(
-        prefix='covreport-', dir=os.environ.get('ANDROID_BUILD_TOP', None))
-    logging.info(f'generating coverage report in {temp_dir}')
-
-    # Pull coverage files from /data/misc/trace on the device
-    compressed = adb_shell(['tar', '-czf', '-', '-C', '/data/misc', 'trace'])
-    check_output(['tar', 'zxvf', '-', '-C', temp_dir], input=compressed)
+    if args.output_dir:
+        report_dir = args.output_dir
+        os.makedirs(report_dir, exist_ok=True)
+    else:
+        report_dir = tempfile.mkdtemp(
+            prefix='covreport-', dir=os.environ.get('ANDROID_BUILD_TOP', None))
+    logging.info(f'generating coverage report in {report_dir}')
 
-    # Call llvm-profdata followed by llvm-cov
-    profdata = f'{temp_dir}/merged.profdata'
-    check_output(
-        f'{LLVM_PROFDATA_PATH} merge --failure-mode=all --output={profdata} {temp_dir}/trace/*.profraw',
-        shell=True)
+    # Pull coverage files from /data/misc/trace on the device, then call
+    # llvm-profdata followed by llvm-cov
+    profdata = update_profdata(report_dir, args.jobs)
 
     object_flags = [args.binary[0]] + ['--object=' + b for b in args.binary[1:]]
     source_dirs = ['/proc/self/cwd/' + s for s in args.source_dir]
 
-    output_dir = f'{temp_dir}/html'
+    output_dir = f'{report_dir}/html'
 
     check_output([
         str(LLVM_COV_PATH), 'show', f'--instr-profile={profdata}',
@@ -199,7 +301,7 @@ def do_report(args):
         '--show-region-summary=false'
     ] + object_flags + source_dirs)
 
-    check_output(['chmod', '+rx', temp_dir])
+    check_output(['chmod', '+rx', report_dir])
 
     print(f'Coverage report data written in {output_dir}')
 
@@ -253,6 +355,18 @@ def parse_args():
         metavar='PATH',
         required=True,
         help='generate coverage report for source files in PATH')
+    report.add_argument(
+        '-o',
+        '--output-dir',
+        metavar='DIR',
+        help='keep coverage data in DIR and only merge new .profraw files '
+        'into it on later reports (default: a new temporary directory)')
+    report.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=os.cpu_count(),
+        help='number of threads for llvm-profdata merge')
     report.set_defaults(func=do_report)
     return parser.parse_args()
 
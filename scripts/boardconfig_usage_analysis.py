@@ -3,6 +3,7 @@
 import argparse
 import fnmatch
 import json
+import multiprocessing
 import os
 import re
 import sys
@@ -45,28 +46,57 @@ white_list = [
 ]
 
 
+# walk one folder, without following symbolic links like os.walk()
+def walk_folder(folder, patterns):
+  ret = []
+
+  for root, dirs, files in os.walk(folder, topdown=True):
+    dirs[:] = [d for d in dirs if not d[0] == '.']
+    for file in files:
+      if any(fnmatch.fnmatch(file, pattern) for pattern in patterns):
+        ret.append(os.path.join(root, file))
+
+  return ret
+
 # used by find_board_configs_mks() and find_makefiles()
-def find_files(folders, filter):
+#
+# The subfolders of each folder are walked in parallel, and the results are
+# concatenated in the order a single os.walk() would have returned them.
+def find_files(folders, patterns, pool):
   ret = []
 
   for folder in folders:
-    for root, dirs, files in os.walk(os.path.join(TOP, folder), topdown=True):
-      dirs[:] = [d for d in dirs if not d[0] == '.']
-      for file in files:
-        if filter(file):
-          ret.append(os.path.join(root, file))
+    top = os.path.join(TOP, folder)
+    try:
+      entries = list(os.scandir(top))
+    except OSError:
+      continue
+
+    subfolders = []
+    for entry in entries:
+      try:
+        is_dir = entry.is_dir()
+      except OSError:
+        is_dir = False
+      if not is_dir:
+        if any(fnmatch.fnmatch(entry.name, pattern) for pattern in patterns):
+          ret.append(os.path.join(top, entry.name))
+      elif not entry.name[0] == '.' and not entry.is_symlink():
+        subfolders.append(os.path.join(top, entry.name))
+
+    for files in pool.starmap(walk_folder,
+                              [(subfolder, patterns) for subfolder in subfolders]):
+      ret.extend(files)
 
   return ret
 
 # find board configs (BoardConfig*.mk)
-def find_board_config_mks(folders = ['build', 'device', 'vendor', 'hardware']):
-  return find_files(folders, lambda x:
-                    fnmatch.fnmatch(x, 'BoardConfig*.mk'))
+def find_board_config_mks(pool, folders = ['build', 'device', 'vendor', 'hardware']):
+  return find_files(folders, ['BoardConfig*.mk'], pool)
 
 # find makefiles (*.mk or Makefile) under specific folders
-def find_makefiles(folders = ['system', 'frameworks', 'external']):
-  return find_files(folders, lambda x:
-                    fnmatch.fnmatch(x, '*.mk') or fnmatch.fnmatch(x, 'Makefile'))
+def find_makefiles(pool, folders = ['system', 'frameworks', 'external']):
+  return find_files(folders, ['*.mk', 'Makefile'], pool)
 
 # read module-info.json and find makefiles of modules in system image
 def find_system_module_makefiles():
@@ -115,39 +145,57 @@ def find_defined_variables(board_config_mks):
 
   return variables
 
-# count variable usage in makefiles
-def find_usage(variable, makefiles):
-  re_usage = re.compile('\$\(' + variable + '\)')
-  usage = set()
+re_usage = re.compile(r'\$\((\w*)\)')
 
-  for makefile in makefiles:
-    if not os.path.isfile(makefile):
-      # TODO: support bp
-      continue
+# find the variables referenced as $(VARIABLE) in a makefile
+def scan_makefile(makefile):
+  if not os.path.isfile(makefile):
+    # TODO: support bp
+    return makefile, set()
+
+  with open(makefile, encoding='latin1') as mk_file:
+    mk_str = mk_file.read()
+
+  return makefile, set(re_usage.findall(mk_str))
+
+# read each makefile once and index the makefiles by the variables they use
+def index_usage(makefiles, pool):
+  index = dict()
 
-    with open(makefile, encoding='latin1') as mk_file:
-      mk_str = mk_file.read()
+  for makefile, variables in pool.imap_unordered(
+      scan_makefile, sorted(set(makefiles)), chunksize=64):
+    for variable in variables:
+      if variable not in index:
+        index[variable] = set()
 
-    if re_usage.search(mk_str) is not None:
-      usage.add(makefile[len(TOP) + 1:])
+      index[variable].add(makefile)
 
-  return usage
+  return index
+
+# count variable usage in makefiles
+def find_usage(variable, makefiles, index):
+  return set(makefile[len(TOP) + 1:]
+             for makefile in index.get(variable, ()) if makefile in makefiles)
 
 def main():
   parser = argparse.ArgumentParser(description=HELP_MSG)
   parser.add_argument("-v", "--verbose",
                       help="print definition and usage locations",
                       action="store_true")
+  parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                      help="number of processes to walk folders and read makefiles with")
   args = parser.parse_args()
 
   print('TOP : ' + TOP)
   print('OUT : ' + OUT)
   print()
 
-  sfe_makefiles = find_makefiles()
-  system_module_makefiles = find_system_module_makefiles()
-  board_config_mks = find_board_config_mks()
-  variables = find_defined_variables(board_config_mks)
+  with multiprocessing.Pool(args.jobs) as pool:
+    sfe_makefiles = find_makefiles(pool)
+    system_module_makefiles = find_system_module_makefiles()
+    board_config_mks = find_board_config_mks(pool)
+    variables = find_defined_variables(board_config_mks)
+    index = index_usage(sfe_makefiles + system_module_makefiles, pool)
 
   if args.verbose:
     print('sfe_makefiles', len(sfe_makefiles))
@@ -171,9 +219,12 @@ def main():
   csv_string = (
       'variable name,definition count,usage in SFE,usage in system image\n')
 
+  sfe_makefiles = set(sfe_makefiles)
+  system_module_makefiles = set(system_module_makefiles)
+
   for variable, locations in sorted(variables.items()):
-    usage_in_sfe = find_usage(variable, sfe_makefiles)
-    usage_of_system_modules = find_usage(variable, system_module_makefiles)
+    usage_in_sfe = find_usage(variable, sfe_makefiles, index)
+    usage_of_system_modules = find_usage(variable, system_module_makefiles, index)
     usage = usage_in_sfe | usage_of_system_modules
 
     if len(usage) == 0:
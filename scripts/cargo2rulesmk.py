@@ -24,10 +24,16 @@ for the host without test crates.
 
 If there are rustc warning messages, this script will add a warning comment to
 the owner crate module in rules.mk.
+
+With "--batch dir1 dir2 ...", the script runs itself once in each of the
+given crate directories, several at a time (see --jobs), and reports the
+crates whose generation failed.
 """
 
 import argparse
+import concurrent.futures
 import glob
+import hashlib
 import json
 import os
 import os.path
@@ -76,6 +82,11 @@ ERRORS_LINE = "Errors in " + CARGO_OUT + ":"
 
 TARGET_TMP = "target.tmp"  # Name of temporary output directory.
 
+# Default directory of cached `cargo metadata --no-deps` outputs.
+METADATA_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "cargo2rulesmk", "metadata"
+)
+
 # Message to be displayed when this script is called without the --run flag.
 DRY_RUN_NOTE = (
     "Dry-run: This script uses ./"
@@ -248,27 +259,16 @@ class Crate(object):
 
     def get_dependencies(self):
         """Use output from cargo metadata to determine crate dependencies"""
-        cargo_metadata = subprocess.run(
-            [
-                self.runner.cargo_path,
-                "metadata",
-                "--no-deps",
-                "--format-version",
-                "1",
-            ],
-            cwd=os.path.abspath(self.cargo_dir),
-            stdout=subprocess.PIPE,
-            check=False,
+        returncode, packages = self.runner.metadata_cache.get(
+            self.runner.cargo_path, self.cargo_dir
         )
-        if cargo_metadata.returncode:
+        if returncode:
             self.errors += (
                 "ERROR: unable to get cargo metadata to determine "
-                f"dependencies; return code {cargo_metadata.returncode}\n"
+                f"dependencies; return code {returncode}\n"
             )
         else:
-            metadata_json = json.loads(cargo_metadata.stdout)
-
-            for package in metadata_json["packages"]:
+            for package in packages:
                 # package names containing '-' are changed to '_' in crate_name
                 if package["name"].replace("-", "_") == self.crate_name:
                     self.dependencies = package["dependencies"]
@@ -674,6 +674,112 @@ class Crate(object):
                 )
 
 
+class MetadataCache(object):
+    """Memoized `cargo metadata --no-deps` packages, keyed by the manifests.
+
+    Many crates parsed from one cargo.out share a cargo_dir, and vendored
+    crates rarely change between runs, so results are kept in memory and,
+    unless cache_dir is None, in one JSON file per manifests content hash.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.packages = {}  # manifests hash => list of package dicts
+
+    def key(self, cargo_path, cargo_dir):
+        """Hash of the manifests cargo reads in cargo_dir, and of cargo.
+
+        The hashed files are cargo_dir/Cargo.toml and Cargo.lock, and those
+        of the enclosing workspace root, if any.
+        Returns None if a manifest cannot be read.
+        """
+        digest = hashlib.sha256(cargo_path.encode("utf-8"))
+        try:
+            for path in self.manifest_paths(cargo_dir):
+                digest.update(path.encode("utf-8") + b"\0")
+                if os.path.exists(path):
+                    with open(path, "rb") as f:
+                        digest.update(f.read())
+        except OSError:
+            return None
+        return digest.hexdigest()
+
+    @staticmethod
+    def manifest_paths(cargo_dir):
+        """Cargo.toml and Cargo.lock of cargo_dir and its workspace root."""
+        cargo_dir = os.path.abspath(cargo_dir)
+        paths = [
+            os.path.join(cargo_dir, "Cargo.toml"),
+            os.path.join(cargo_dir, "Cargo.lock"),
+        ]
+        # Like cargo, the workspace root is the nearest parent directory
+        # whose Cargo.toml has a [workspace] section.
+        parent = os.path.dirname(cargo_dir)
+        while parent != os.path.dirname(parent):
+            cargo_toml = os.path.join(parent, "Cargo.toml")
+            if os.path.isfile(cargo_toml):
+                with open(
+                    cargo_toml, "r", encoding="utf-8", errors="replace"
+                ) as f:
+                    if any(line.strip() == "[workspace]" for line in f):
+                        paths.append(cargo_toml)
+                        paths.append(os.path.join(parent, "Cargo.lock"))
+                        break
+            parent = os.path.dirname(parent)
+        return paths
+
+    def get(self, cargo_path, cargo_dir):
+        """Returns (returncode, packages) of cargo metadata in cargo_dir."""
+        key = self.key(cargo_path, cargo_dir)
+        if key is None:
+            # Let cargo report the unreadable manifest, without the cache.
+            return self.run_cargo_metadata(cargo_path, cargo_dir)
+        if key in self.packages:
+            return 0, self.packages[key]
+        cache_file = None
+        if self.cache_dir:
+            cache_file = os.path.join(self.cache_dir, key + ".json")
+            try:
+                with open(cache_file, "r", encoding="utf-8") as f:
+                    self.packages[key] = json.load(f)
+                return 0, self.packages[key]
+            except (OSError, ValueError):
+                pass
+        returncode, packages = self.run_cargo_metadata(cargo_path, cargo_dir)
+        if returncode:
+            return returncode, []
+        self.packages[key] = packages
+        if cache_file:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(packages, f)
+            os.replace(tmp_file, cache_file)
+        return 0, packages
+
+    @staticmethod
+    def run_cargo_metadata(cargo_path, cargo_dir):
+        """Returns (returncode, packages) of running cargo metadata."""
+        cargo_metadata = subprocess.run(
+            [cargo_path, "metadata", "--no-deps", "--format-version", "1"],
+            cwd=os.path.abspath(cargo_dir),
+            stdout=subprocess.PIPE,
+            check=False,
+        )
+        if cargo_metadata.returncode:
+            return cargo_metadata.returncode, []
+        # Only keep what Crate.get_dependencies needs.
+        packages = [
+            {
+                "name": package["name"],
+                "dependencies": package["dependencies"],
+                "features": package["features"],
+            }
+            for package in json.loads(cargo_metadata.stdout)["packages"]
+        ]
+        return 0, packages
+
+
 class Runner(object):
     """Main class to parse cargo -v output and print Trusty makefile modules."""
 
@@ -685,6 +791,9 @@ class Runner(object):
         self.dry_run = not args.run
         self.skip_cargo = args.skipcargo
         self.cargo_path = "./cargo"  # path to cargo, will be set later
+        self.metadata_cache = MetadataCache(
+            None if args.no_metadata_cache else args.metadata_cache_dir
+        )
         self.checked_out_files = False  # to check only once
         self.build_out_files = []  # output files generated by build.rs
         self.crates: List[Crate] = []
@@ -1255,6 +1364,37 @@ def get_parser():
         default=False,
         help="run cargo with -vv instead of default -v",
     )
+    parser.add_argument(
+        "--metadata-cache-dir",
+        type=str,
+        default=METADATA_CACHE_DIR,
+        help=(
+            "directory of cached cargo metadata outputs, keyed by the hash "
+            + "of Cargo.toml; default is ~/.cache/cargo2rulesmk/metadata"
+        ),
+    )
+    parser.add_argument(
+        "--no-metadata-cache",
+        action="store_true",
+        default=False,
+        help="always run cargo metadata, and do not save its output",
+    )
+    parser.add_argument(
+        "--batch",
+        nargs="+",
+        metavar="crate_dir",
+        help=(
+            "run this script with the other given flags in each crate_dir, "
+            + "--jobs at a time, and report the crates that failed"
+        ),
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="number of crates to process concurrently with --batch",
+    )
     parser.add_argument(
         "--dump-config-and-exit",
         type=str,
@@ -1300,6 +1440,8 @@ def dump_config(parser, args):
             and arg != "dump_config_and_exit"
             and arg != "config"
             and arg != "cargo_bin"
+            and arg != "batch"
+            and arg != "jobs"
         ):
             non_default_args[arg.replace("_", "-")] = args_dict[arg]
     # Write to the specified file.
@@ -1307,9 +1449,85 @@ def dump_config(parser, args):
         json.dump(non_default_args, f, indent=2, sort_keys=True)
 
 
+def strip_batch_args(argv):
+    """Returns argv without the --batch and --jobs flags and their values."""
+    result = []
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == "--batch":
+            i += 1
+            while i < len(argv) and not argv[i].startswith("-"):
+                i += 1
+            continue
+        if arg in ("-j", "--jobs"):
+            i += 2
+            continue
+        if not arg.startswith(("--batch=", "--jobs=")):
+            result.append(arg)
+        i += 1
+    return result
+
+
+def run_one_crate(crate_dir, argv):
+    """Runs this script in crate_dir, returns (crate_dir, errors, output).
+
+    Each crate is built in its own crate_dir/target.tmp, so concurrent runs
+    do not share a cargo target directory.
+    """
+    try:
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__)] + argv,
+            cwd=crate_dir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            check=False,
+        )
+    except OSError as e:
+        return crate_dir, [f"cannot run in {crate_dir}: {e.strerror}"], ""
+    output = proc.stdout.decode("utf-8", errors="replace")
+    errors = []
+    if proc.returncode:
+        errors.append(f"exited with status {proc.returncode}")
+    rules_mk = os.path.join(crate_dir, "rules.mk")
+    if os.path.exists(rules_mk):
+        with open(rules_mk, "r", encoding="utf-8") as f:
+            if any(line.startswith(ERRORS_LINE) for line in f):
+                errors.append(f"{ERRORS_LINE[:-1]} rules.mk")
+    return crate_dir, errors, output
+
+
+def run_batch(args):
+    """Runs this script in every --batch directory, returns the exit code."""
+    argv = strip_batch_args(sys.argv[1:])
+    failed = {}
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, args.jobs)
+    ) as executor:
+        futures = [
+            executor.submit(run_one_crate, crate_dir, argv)
+            for crate_dir in args.batch
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            crate_dir, errors, output = future.result()
+            print(f"### {crate_dir}")
+            if args.verbose or errors:
+                print(output, end="")
+            if errors:
+                failed[crate_dir] = errors
+    print(
+        f"### Processed {len(args.batch)} crates, {len(failed)} with errors"
+    )
+    for crate_dir in sorted(failed):
+        print(f"ERROR: {crate_dir}: " + "; ".join(failed[crate_dir]))
+    return 1 if failed else 0
+
+
 def main():
     parser = get_parser()
     args = parse_args(parser)
+    if args.batch and not args.dump_config_and_exit:
+        sys.exit(run_batch(args))
     if not args.run:  # default is dry-run
         print(DRY_RUN_NOTE)
     if args.dump_config_and_exit:
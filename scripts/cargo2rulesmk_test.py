@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the metadata cache and the --batch mode of cargo2rulesmk."""
+
+import contextlib
+import io
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+import cargo2rulesmk
+
+# Prints the package of ./Cargo.toml and counts its runs in ./metadata.count.
+FAKE_CARGO = """#!/bin/sh
+echo x >> metadata.count
+name=$(sed -n 's/^name = "\\(.*\\)"$/\\1/p' Cargo.toml) || exit 101
+echo '{"packages": [{"name": "'$name'", "dependencies": [], "features": {}, "version": "1.0"}]}'
+"""
+
+
+class CargoTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.cargo_bin = os.path.join(self.temp_dir, "bin")
+        self.cargo_path = os.path.join(self.cargo_bin, "cargo")
+        self.write_file(self.cargo_path, FAKE_CARGO)
+        os.chmod(self.cargo_path, os.stat(self.cargo_path).st_mode | stat.S_IEXEC)
+
+    def write_file(self, path, content):
+        path = os.path.join(self.temp_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def write_crate(self, crate_dir, name):
+        self.write_file(
+            os.path.join(crate_dir, "Cargo.toml"),
+            f'[package]\nname = "{name}"\n',
+        )
+        return os.path.join(self.temp_dir, crate_dir)
+
+
+class MetadataCacheTest(CargoTestCase):
+
+    def runs(self, crate_dir):
+        """Returns the number of times cargo metadata ran in crate_dir."""
+        count_file = os.path.join(crate_dir, "metadata.count")
+        if not os.path.exists(count_file):
+            return 0
+        with open(count_file, "r", encoding="utf-8") as f:
+            return len(f.readlines())
+
+    def test_hit_and_miss(self):
+        crate_dir = self.write_crate("ws/foo", "foo")
+        cache_dir = os.path.join(self.temp_dir, "cache")
+        packages = [{"name": "foo", "dependencies": [], "features": {}}]
+
+        cache = cargo2rulesmk.MetadataCache(cache_dir)
+        self.assertEqual(cache.get(self.cargo_path, crate_dir), (0, packages))
+        self.assertEqual(cache.get(self.cargo_path, crate_dir), (0, packages))
+        self.assertEqual(self.runs(crate_dir), 1)
+
+        # Another run reads the cache file.
+        cache = cargo2rulesmk.MetadataCache(cache_dir)
+        self.assertEqual(cache.get(self.cargo_path, crate_dir), (0, packages))
+        self.assertEqual(self.runs(crate_dir), 1)
+
+        # Changing a manifest of the crate or of its workspace root is a miss.
+        self.write_crate("ws/foo", "bar")
+        self.assertEqual(cache.get(self.cargo_path, crate_dir)[1][0]["name"],
+                         "bar")
+        self.assertEqual(self.runs(crate_dir), 2)
+        self.write_file("ws/Cargo.toml", '[workspace]\nmembers = ["foo"]\n')
+        cache.get(self.cargo_path, crate_dir)
+        self.assertEqual(self.runs(crate_dir), 3)
+        self.write_file("ws/Cargo.lock", "version = 3\n")
+        cache.get(self.cargo_path, crate_dir)
+        self.assertEqual(self.runs(crate_dir), 4)
+        cache.get(self.cargo_path, crate_dir)
+        self.assertEqual(self.runs(crate_dir), 4)
+
+        # A parent Cargo.toml without [workspace] is not hashed.
+        self.write_file("Cargo.toml", '[package]\nname = "top"\n')
+        cache.get(self.cargo_path, crate_dir)
+        self.assertEqual(self.runs(crate_dir), 4)
+
+    def test_no_cache_dir(self):
+        crate_dir = self.write_crate("foo", "foo")
+        cache = cargo2rulesmk.MetadataCache(None)
+        cache.get(self.cargo_path, crate_dir)
+        self.assertEqual(cache.get(self.cargo_path, crate_dir)[0], 0)
+        self.assertEqual(self.runs(crate_dir), 1)
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ["bin", "foo"])
+
+    def test_unreadable_manifest(self):
+        crate_dir = self.write_crate("foo", "foo")
+        cache = cargo2rulesmk.MetadataCache(os.path.join(self.temp_dir, "c"))
+        with mock.patch("builtins.open", side_effect=PermissionError):
+            self.assertIsNone(cache.key(self.cargo_path, crate_dir))
+        # cargo runs without the cache and reports the failure.
+        os.remove(os.path.join(crate_dir, "Cargo.toml"))
+        os.mkdir(os.path.join(crate_dir, "Cargo.toml"))
+        self.assertEqual(cache.get(self.cargo_path, crate_dir), (101, []))
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, "c")))
+
+
+class BatchTest(CargoTestCase):
+
+    def run_batch(self, argv):
+        output = io.StringIO()
+        with mock.patch("sys.argv", ["cargo2rulesmk.py"] + argv):
+            args = cargo2rulesmk.parse_args(cargo2rulesmk.get_parser())
+            with contextlib.redirect_stdout(output):
+                returncode = cargo2rulesmk.run_batch(args)
+        return returncode, output.getvalue()
+
+    def test_strip_batch_args(self):
+        self.assertEqual(
+            cargo2rulesmk.strip_batch_args(
+                ["--run", "--batch", "a", "b", "-j", "4", "--tests",
+                 "--batch=c", "--jobs=2", "--verbose"]),
+            ["--run", "--tests", "--verbose"])
+
+    def test_batch(self):
+        crate_dirs = [self.write_crate(f"crate{i}", f"crate{i}")
+                      for i in range(4)]
+        self.write_file(
+            "crate2/rules.mk", "\n" + cargo2rulesmk.ERRORS_LINE + "\nerror\n")
+
+        returncode, output = self.run_batch(
+            ["--cargo_bin", self.cargo_bin, "-j", "2", "--batch"] + crate_dirs)
+        self.assertEqual(returncode, 1)
+        self.assertIn("### Processed 4 crates, 1 with errors", output)
+        self.assertIn(f"ERROR: {crate_dirs[2]}: {cargo2rulesmk.ERRORS_LINE[:-1]}"
+                      " rules.mk", output)
+        for crate_dir in crate_dirs:
+            self.assertIn(f"### {crate_dir}\n", output)
+
+        shutil.rmtree(crate_dirs[2])
+        returncode, output = self.run_batch(
+            ["--cargo_bin", self.cargo_bin, "--batch", crate_dirs[0],
+             crate_dirs[1], os.path.join(self.temp_dir, "missing")])
+        self.assertEqual(returncode, 1)
+        self.assertIn("### Processed 3 crates, 1 with errors", output)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -22,14 +22,71 @@ The reports must be based on the same build fingerprint.
 """
 
 import argparse
+import concurrent.futures
 import os
-import tempfile
-import zipfile
 
 import constant
 import parse_cts_report
 
 
+def parse_shard(report_file, selected_abis, ignore_abi):
+  """Parse one report into its own CtsReport, without printing anything."""
+
+  with parse_cts_report.open_test_result(report_file) as xml_file:
+    reader = parse_cts_report.TestResultReader(xml_file, report_file)
+    report = parse_cts_report.CtsReport(reader.info, selected_abis)
+    report.read_test_results(reader.tests(), ignore_abi)
+  return report
+
+
+def aggregate_cts_reports_parallel(report_files,
+                                   selected_abis=constant.ALL_TEST_ABIS,
+                                   ignore_abi=False,
+                                   jobs=None):
+  """Aggregate report files, parsing them in worker processes.
+
+  Each report is parsed into a partial CtsReport by a worker process. The
+  partial reports are then merged in the order of report_files, so the result
+  is identical to aggregate_cts_reports().
+
+  Args:
+    report_files: A list of paths to cts reports.
+    ignore_abi: Same as aggregate_cts_reports().
+    jobs: The number of worker processes. Defaults to the number of CPUs.
+
+  Raises:
+    UserWarning: Report files not compatible.
+
+  Returns:
+    A CtsReport object.
+  """
+
+  first_report_file = report_files[0]
+
+  with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+    futures = [executor.submit(parse_shard, report_file, selected_abis,
+                               ignore_abi)
+               for report_file in report_files]
+
+    report = futures[0].result()
+
+    print(f'Parsing {selected_abis} test results from: ')
+    parse_cts_report.print_test_info(report.info)
+
+    for report_file, future in zip(report_files[1:], futures[1:]):
+      shard = future.result()
+
+      if not report.is_compatible(shard.info):
+        for f in futures:
+          f.cancel()
+        msg = (f'{report_file} is incompatible to {first_report_file}.')
+        raise UserWarning(msg)
+
+      report.merge_report(shard)
+
+  return report
+
+
 def aggregate_cts_reports(report_files,
                           selected_abis=constant.ALL_TEST_ABIS,
                           ignore_abi=False):
@@ -57,21 +114,15 @@ def aggregate_cts_reports(report_files,
   report = parse_cts_report.parse_report_file(
       first_report_file, selected_abis, ignore_abi)
 
-  with tempfile.TemporaryDirectory() as temp_dir:
-
-    for report_file in report_files[1:]:
-      xml_path = (
-          parse_cts_report.extract_test_result_from_zip(report_file, temp_dir)
-          if zipfile.is_zipfile(report_file)
-          else report_file)
-
-      test_info = parse_cts_report.get_test_info_xml(xml_path)
+  for report_file in report_files[1:]:
+    with parse_cts_report.open_test_result(report_file) as xml_file:
+      reader = parse_cts_report.TestResultReader(xml_file, report_file)
 
-      if not report.is_compatible(test_info):
+      if not report.is_compatible(reader.info):
         msg = (f'{report_file} is incompatible to {first_report_file}.')
         raise UserWarning(msg)
 
-      report.read_test_result_xml(xml_path, ignore_abi)
+      report.read_test_results(reader.tests(), ignore_abi)
 
   return report
 
@@ -89,6 +140,9 @@ def main():
   parser.add_argument('--abi', choices=constant.ALL_TEST_ABIS, nargs='*',
                       default=constant.ALL_TEST_ABIS,
                       help='Selected test ABIs to be aggregated.')
+  parser.add_argument('-j', '--jobs', type=int, default=1,
+                      help=('Number of reports to parse in parallel. '
+                            '0 means the number of CPUs.'))
 
   args = parser.parse_args()
 
@@ -98,7 +152,11 @@ def main():
   if not os.path.exists(output_dir):
     raise FileNotFoundError(f'Output directory {output_dir} does not exist.')
 
-  report = aggregate_cts_reports(report_files, args.abi, args.ignore_abi)
+  if args.jobs == 1:
+    report = aggregate_cts_reports(report_files, args.abi, args.ignore_abi)
+  else:
+    report = aggregate_cts_reports_parallel(report_files, args.abi,
+                                            args.ignore_abi, args.jobs or None)
   report.output_files(output_dir)
 
 
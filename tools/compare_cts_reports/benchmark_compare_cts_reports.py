@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+#
+"""Benchmark the comparison modes on large synthetic reports.
+
+Usage example:
+  ./benchmark_compare_cts_reports.py --tests 3000000 [--compact]
+"""
+
+import argparse
+import os
+import random
+import resource
+import tempfile
+import time
+
+import compact_cts_report
+import compare_cts_reports
+import constant
+import parse_cts_report
+
+
+def gen_report(device, num_tests, seed, compact=False):
+  """Generate a report with about num_tests tests."""
+
+  rand = random.Random(seed)
+  info = {'build_device': device}
+  if compact:
+    report = compact_cts_report.CompactCtsReport(info)
+    add = report.add_test_status
+  else:
+    report = parse_cts_report.CtsReport(info)
+    add = report.set_test_status
+
+  abis = [constant.ABI_ARM_V8A, constant.ABI_ARM_V7A]
+  statuses = parse_cts_report.CtsReport.STATUS_ORDER
+  weights = [90, 3, 3, 2, 1, 1]
+  tests_per_class = 50
+  classes_per_module = 40
+
+  for i in range(num_tests):
+    if rand.random() < 0.01:
+      # Some tests are only in one of the reports.
+      continue
+    class_index = i // tests_per_class
+    module_index = class_index // classes_per_module
+    add(f'CtsModule{module_index}Tests', abis[module_index % 2],
+        f'android.module{module_index}.cts.Class{class_index}',
+        f'test{i % tests_per_class}',
+        rand.choices(statuses, weights)[0])
+
+  if compact:
+    len(report)  # sort it now rather than in the first comparison
+
+  return report
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--tests', type=int, default=1000000,
+                      help='Number of tests in each report.')
+  parser.add_argument('--compact', action='store_true',
+                      help='Use CompactCtsReport instead of CtsReport.')
+  args = parser.parse_args()
+
+  start = time.time()
+  reports = [
+      gen_report('a', args.tests, 1, args.compact),
+      gen_report('b', args.tests, 2, args.compact),
+  ]
+  print(f'Generated 2 reports of {args.tests} tests in '
+        f'{time.time() - start:.1f}s')
+
+  with tempfile.TemporaryDirectory() as temp_dir:
+    for mode, compare in [
+        ('one-way', compare_cts_reports.one_way_compare),
+        ('two-way', compare_cts_reports.two_way_compare),
+        ('n-way', compare_cts_reports.n_way_compare),
+    ]:
+      diff_csv = os.path.join(temp_dir, f'{mode}.csv')
+      start = time.time()
+      compare(reports, diff_csv)
+      print(f'{mode}: {time.time() - start:.1f}s, '
+            f'{os.path.getsize(diff_csv)} bytes of csv')
+
+  max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  print(f'Peak RSS: {max_rss // 1024} MB')
+
+
+if __name__ == '__main__':
+  main()
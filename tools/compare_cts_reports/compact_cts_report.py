@@ -0,0 +1,425 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+#
+"""Compact storage for the test results of a cts report.
+
+CtsReport keeps its results in a four-level nested dict of strings, which
+takes several GB for a report with millions of tests. CompactCtsReport stores
+the same results as flat arrays of interned name ids and integer status codes,
+sorted by (module_name, abi, class_name, test_name). It offers the read-only
+part of the CtsReport interface, so the comparison and output code can run on
+either of them.
+"""
+
+import array
+import bisect
+import csv
+import heapq
+import itertools
+import json
+import os
+
+import constant
+import parse_cts_report
+
+
+STATUS_ORDER = parse_cts_report.CtsReport.STATUS_ORDER
+STATUS_CODES = {status: code for code, status in enumerate(STATUS_ORDER)}
+
+
+class NameTable:
+  """Interns the strings of one key level and gives them integer ids."""
+
+  def __init__(self):
+    self.names = []
+    self.ids = {}
+    self.ranks = array.array('I')
+
+  def intern(self, name):
+    name_id = self.ids.get(name)
+    if name_id is None:
+      name_id = len(self.names)
+      self.ids[name] = name_id
+      self.names.append(name)
+    return name_id
+
+  def update_ranks(self):
+    """Compute the position of each name in sorted order."""
+    self.ranks = array.array('I', bytes(4 * len(self.names)))
+    for rank, name_id in enumerate(
+        sorted(range(len(self.names)), key=self.names.__getitem__)):
+      self.ranks[name_id] = rank
+
+
+class CompactCtsReport:
+  """Class to record the test result of a cts report in flat arrays.
+
+  Tests are added with read_test_results() or load_from_csv(). Before the
+  results are queried, they are sorted and duplicated tests are merged with
+  the same priority rules as CtsReport.set_test_status(), and module summaries
+  are counted. Results can't be changed afterwards, but more tests can be
+  added, which triggers the sort again.
+  """
+
+  def __init__(self, info, selected_abis=constant.ALL_TEST_ABIS):
+    self.info = info
+    self.selected_abis = selected_abis
+
+    self._names = [NameTable() for _ in range(4)]
+
+    # One entry per test, sorted by the (module, abi, class, test) names.
+    self._columns = [array.array('I') for _ in range(4)]
+    self._status = array.array('b')
+    # Indices into the columns, in the order a nested dict would iterate them.
+    self._order = array.array('I')
+    # The sort key of each row, when the keys fit into 64 bits.
+    self._keys = None
+
+    self._sorted = True
+    self._module_summaries = {}
+
+  is_fail = staticmethod(parse_cts_report.CtsReport.is_fail)
+
+  @property
+  def module_summaries(self):
+    self._sort()
+    return self._module_summaries
+
+  def __len__(self):
+    self._sort()
+    return len(self._status)
+
+  def is_compatible(self, info):
+    return self.info['build_fingerprint'] == info['build_fingerprint']
+
+  def add_test_status(self, module_name, abi, class_name, test_name,
+                      test_status):
+    """Add the status of one test."""
+
+    key = (module_name, abi, class_name, test_name)
+    for names, column, name in zip(self._names, self._columns, key):
+      column.append(names.intern(name))
+    self._status.append(STATUS_CODES[test_status])
+    self._sorted = False
+
+  def read_test_result_xml(self, test_result_path, ignore_abi=False):
+    """Read the result from test_result.xml."""
+
+    with open(test_result_path, 'rb') as xml_file:
+      reader = parse_cts_report.TestResultReader(xml_file, test_result_path)
+      self.read_test_results(reader.tests(), ignore_abi)
+
+  def read_test_results(self, tests, ignore_abi=False):
+    """Read (module_name, abi, class_name, test_name, result) tuples."""
+
+    for module_name, abi, class_name, test_name, result in tests:
+      if abi not in self.selected_abis:
+        continue
+      if ignore_abi:
+        abi = constant.ABI_IGNORED
+      self.add_test_status(module_name, abi, class_name, test_name, result)
+
+  def load_from_csv(self, result_csvfile, ignore_abi=False):
+    """Read the information of the report from result.csv."""
+
+    result_reader = csv.reader(result_csvfile)
+
+    try:
+      next(result_reader)  # skip the header of csv file
+    except StopIteration:
+      print(f'Empty file: {result_csvfile.name}')
+      return
+
+    self.read_test_results(result_reader, ignore_abi)
+
+  def _row_key(self, row):
+    """Sort key of a row, which orders rows by their names."""
+
+    key = 0
+    for names, column in zip(self._names, self._columns):
+      key = key * len(names.names) + names.ranks[column[row]]
+    return key
+
+  def _row_key_function(self):
+    """A faster _row_key(), for when the ranks are up to date."""
+
+    (module_ranks, abi_ranks, class_ranks,
+     test_ranks) = [names.ranks for names in self._names]
+    _, num_abis, num_classes, num_tests = [
+        len(names.names) for names in self._names]
+    module_column, abi_column, class_column, test_column = self._columns
+
+    def row_key(row):
+      return (((module_ranks[module_column[row]] * num_abis
+                + abi_ranks[abi_column[row]]) * num_classes
+               + class_ranks[class_column[row]]) * num_tests
+              + test_ranks[test_column[row]])
+
+    return row_key
+
+  def _sort(self):
+    """Sort the rows, merge duplicated tests and count the summaries."""
+
+    if self._sorted:
+      return
+
+    for names in self._names:
+      names.update_ranks()
+
+    # The position of each row in insertion order. Rows sorted by a previous
+    # call come first, in the order of self._order.
+    size = len(self._status)
+    position = array.array('I', bytes(4 * size))
+    for i, row in enumerate(itertools.chain(
+        self._order, range(len(self._order), size))):
+      position[row] = i
+
+    # Rows of the same test are adjacent once sorted by name. Keep one row per
+    # test, with the highest priority status, at the first position it was
+    # added, like CtsReport.set_test_status() does.
+    row_keys = list(map(self._row_key_function(), range(size)))
+    rows = array.array('I')
+    first = array.array('I')
+    keys = []
+    status = self._status
+    for row in sorted(range(size), key=row_keys.__getitem__):
+      key = row_keys[row]
+      if keys and key == keys[-1]:
+        kept = rows[-1]
+        if status[row] < status[kept]:
+          status[kept] = status[row]
+        if position[row] < first[-1]:
+          first[-1] = position[row]
+        continue
+      rows.append(row)
+      first.append(position[row])
+      keys.append(key)
+    del position, row_keys
+
+    self._columns = [array.array('I', map(old.__getitem__, rows))
+                     for old in self._columns]
+    self._status = array.array('b', map(status.__getitem__, rows))
+    del rows
+
+    self._keys = None
+    if not keys or keys[-1] < 1 << 64:
+      self._keys = array.array('Q', keys)
+    del keys
+
+    # A nested dict orders modules, abis and classes by the first position of
+    # any test in them. Those groups are contiguous runs of rows now.
+    count = len(first)
+    starts = {0} if count else set()
+    group_firsts = []
+    for column in self._columns[:3]:
+      starts.update(i for i in range(1, count) if column[i] != column[i - 1])
+      ordered = sorted(starts)
+      firsts = array.array('I', bytes(4 * count))
+      for start, end in zip(ordered, ordered[1:] + [count]):
+        smallest = array.array('I', [min(first[start:end])])
+        firsts[start:end] = smallest * (end - start)
+      group_firsts.append(firsts)
+    module_first, abi_first, class_first = group_firsts
+
+    def nested_key(i):
+      return (((module_first[i] * size + abi_first[i]) * size
+               + class_first[i]) * size + first[i])
+
+    self._order = array.array('I', sorted(range(count), key=nested_key))
+
+    self._sorted = True
+    self._count_summaries()
+
+  def _count_summaries(self):
+    summaries = {}
+    modules, abis, _, _ = self._names
+    module_column, abi_column, _, _ = self._columns
+    for row in self._order:
+      module_name = modules.names[module_column[row]]
+      abi = abis.names[abi_column[row]]
+      module_summary = summaries.setdefault(module_name, {})
+      summary = module_summary.get(abi)
+      if summary is None:
+        summary = parse_cts_report.CtsReport.ModuleSummary()
+        module_summary[abi] = summary
+      summary.counter[STATUS_ORDER[self._status[row]]] += 1
+    self._module_summaries = summaries
+
+  def _find(self, module_name, abi, class_name, test_name):
+    """Return the row of a test, or None."""
+
+    self._sort()
+    modules, abis, classes, tests = self._names
+    try:
+      key = (((modules.ranks[modules.ids[module_name]] * len(abis.names)
+               + abis.ranks[abis.ids[abi]]) * len(classes.names)
+              + classes.ranks[classes.ids[class_name]]) * len(tests.names)
+             + tests.ranks[tests.ids[test_name]])
+    except KeyError:
+      return None
+    size = len(self._status)
+    if self._keys is not None:
+      row = bisect.bisect_left(self._keys, key)
+      if row < size and self._keys[row] == key:
+        return row
+      return None
+    row = bisect.bisect_left(range(size), key, key=self._row_key)
+    if row < size and self._row_key(row) == key:
+      return row
+    return None
+
+  def get_test_status(self, module_name, abi, class_name, test_name):
+    """Get test status from the CompactCtsReport object."""
+
+    row = self._find(module_name, abi, class_name, test_name)
+    if row is None:
+      return constant.NO_DATA
+    return STATUS_ORDER[self._status[row]]
+
+  def iter_tests(self, sort_by_name=False):
+    """Yield (module_name, abi, class_name, test_name, result) tuples.
+
+    Args:
+      sort_by_name: If True, tests are sorted by their names. Otherwise they
+                    are in the order that CtsReport.result_tree would have.
+    """
+
+    self._sort()
+    rows = range(len(self._status)) if sort_by_name else self._order
+    modules, abis, classes, tests = [names.names for names in self._names]
+    module_column, abi_column, class_column, test_column = self._columns
+    status = self._status
+    for row in rows:
+      yield (modules[module_column[row]], abis[abi_column[row]],
+             classes[class_column[row]], tests[test_column[row]],
+             STATUS_ORDER[status[row]])
+
+  def gen_keys_list(self):
+    """Generate a 2D-list of keys."""
+
+    return [list(test[:4]) for test in self.iter_tests()]
+
+  def write_to_csv(self, result_csvfile, summary_csvfile):
+    """Write the information of the report to the csv files.
+
+    The files are the same as CtsReport.write_to_csv() would write.
+
+    Args:
+      result_csvfile: path to result.csv
+      summary_csvfile: path to summary.csv
+    """
+
+    summary_writer = csv.writer(summary_csvfile)
+    summary_writer.writerow(['module_name', 'abi'] + STATUS_ORDER)
+
+    result_writer = csv.writer(result_csvfile)
+    result_writer.writerow(
+        ['module_name', 'abi', 'class_name', 'test_name', 'result']
+    )
+
+    module_summaries = self.module_summaries
+    previous = None
+
+    for test in self.iter_tests():
+      module_name, abi = test[:2]
+      if (module_name, abi) != previous:
+        summary = module_summaries[module_name][abi].summary_list()
+        summary_writer.writerow([module_name, abi] + summary)
+        previous = (module_name, abi)
+      result_writer.writerow(test)
+
+  def output_files(self, output_dir):
+    """Produce output files into the directory."""
+
+    parsed_info_path = os.path.join(output_dir, 'info.json')
+    parsed_result_path = os.path.join(output_dir, 'result.csv')
+    parsed_summary_path = os.path.join(output_dir, 'summary.csv')
+
+    files = [parsed_info_path, parsed_result_path, parsed_summary_path]
+
+    for f in files:
+      if os.path.exists(f):
+        raise FileExistsError(f'Output file {f} already exists.')
+
+    with open(parsed_info_path, 'w') as info_file:
+      info_file.write(json.dumps(self.info, indent=2))
+
+    with (
+        open(parsed_result_path, 'w') as result_csvfile,
+        open(parsed_summary_path, 'w') as summary_csvfile,
+    ):
+      self.write_to_csv(result_csvfile, summary_csvfile)
+
+    for f in files:
+      print(f'Parsed output {f}')
+
+    return files
+
+
+def merge_join(reports):
+  """Join the tests of several reports by their names.
+
+  Args:
+    reports: list of CompactCtsReport objects
+
+  Yields:
+    ((module_name, abi, class_name, test_name), results) for every test in
+    any of the reports, sorted by name, where results has the status of the
+    test in each report, or constant.NO_DATA.
+  """
+
+  def stream(i, report):
+    for test in report.iter_tests(sort_by_name=True):
+      yield test[:4], i, test[4]
+
+  merged = heapq.merge(*[stream(i, report) for i, report in enumerate(reports)])
+  for key, group in itertools.groupby(merged, key=lambda entry: entry[0]):
+    results = [constant.NO_DATA] * len(reports)
+    for _, i, result in group:
+      results[i] = result
+    yield key, results
+
+
+def parse_report_files(report_files,
+                       selected_abis=constant.ALL_TEST_ABIS,
+                       ignore_abi=False):
+  """Aggregate cts reports into one CompactCtsReport.
+
+  This follows aggregate_cts_reports.aggregate_cts_reports(), but the results
+  are kept in a CompactCtsReport.
+
+  Raises:
+    UserWarning: Report files not compatible.
+  """
+
+  report = None
+  first_report_file = report_files[0]
+
+  for report_file in report_files:
+    with parse_cts_report.open_test_result(report_file) as xml_file:
+      reader = parse_cts_report.TestResultReader(xml_file, report_file)
+
+      if report is None:
+        print(f'Parsing {selected_abis} test results from: ')
+        parse_cts_report.print_test_info(reader.info)
+        report = CompactCtsReport(reader.info, selected_abis)
+      elif not report.is_compatible(reader.info):
+        msg = (f'{report_file} is incompatible to {first_report_file}.')
+        raise UserWarning(msg)
+
+      report.read_test_results(reader.tests(), ignore_abi)
+
+  return report
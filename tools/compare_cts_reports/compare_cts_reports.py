@@ -40,12 +40,14 @@ Usage example:
 
 import argparse
 import csv
+import heapq
 import json
 import os
 import re
 import tempfile
 
 import aggregate_cts_reports
+import compact_cts_report
 import parse_cts_report
 import constant
 
@@ -69,11 +71,8 @@ def one_way_compare(reports, diff_csv):
     diff_writer.writerow(['module_name', 'abi', 'class_name', 'test_name',
                           'result in A', 'result in B'])
 
-    for keys in report_a.gen_keys_list():
-      module_name, abi, class_name, test_name = keys
-      result_in_a = report_a.get_test_status(
-          module_name, abi, class_name, test_name
-      )
+    for test in report_a.iter_tests():
+      module_name, abi, class_name, test_name, result_in_a = test
 
       if parse_cts_report.CtsReport.is_fail(result_in_a):
         result_in_b = report_b.get_test_status(
@@ -85,6 +84,61 @@ def one_way_compare(reports, diff_csv):
         )
 
 
+def iter_two_way_diff(report_a, report_b):
+  """Yield the tests which have different results in two reports.
+
+  The tests are merged in a stream instead of being collected into a new
+  tree. They come out in the order of report A, with the tests only in report
+  B placed after the tests of A in the same class, and classes, abis and
+  modules only in B placed after those of A in the same way. This is the order
+  of a nested dict filled with the tests of A and then of B.
+
+  Args:
+    report_a: CtsReport or CompactCtsReport object
+    report_b: CtsReport or CompactCtsReport object
+
+  Yields:
+    [module_name, abi, class_name, test_name, result in A, result in B]
+  """
+
+  # Position of the first test of each module, (module, abi) and
+  # (module, abi, class) of report A.
+  group_positions = {}
+  for position, test in enumerate(report_a.iter_tests()):
+    for level in range(1, 4):
+      group_positions.setdefault(test[:level], position)
+
+  # Tests only in report B, with a sort key that puts them where they belong
+  # among the tests of A.
+  b_only = []
+  b_group_positions = {}
+  for position, test in enumerate(report_b.iter_tests()):
+    if report_a.get_test_status(*test[:4]) != constant.NO_DATA:
+      continue
+    key = []
+    for level in range(1, 4):
+      prefix = test[:level]
+      if prefix in group_positions:
+        key.append((0, group_positions[prefix]))
+      else:
+        key.append((1, b_group_positions.setdefault(prefix, position)))
+    key.append((1, position))
+    b_only.append((key, list(test[:4]) + [constant.NO_DATA, test[4]]))
+  b_only.sort(key=lambda entry: entry[0])
+  del b_group_positions
+
+  def iter_a():
+    for position, test in enumerate(report_a.iter_tests()):
+      result_in_b = report_b.get_test_status(*test[:4])
+      if test[4] != result_in_b:
+        key = [(0, group_positions[test[:level]]) for level in range(1, 4)]
+        key.append((0, position))
+        yield key, list(test) + [result_in_b]
+
+  for _, row in heapq.merge(iter_a(), b_only, key=lambda entry: entry[0]):
+    yield row
+
+
 def two_way_compare(reports, diff_csv):
   """Compare two reports in Two-way Mode.
 
@@ -97,35 +151,56 @@ def two_way_compare(reports, diff_csv):
     diff_csv: path to csv which stores comparison results
   """
 
-  diff = {}
+  with open(diff_csv, 'w') as diff_csvfile:
+    diff_writer = csv.writer(diff_csvfile)
+    diff_writer.writerow(['module_name', 'abi', 'class_name', 'test_name',
+                          'result in A', 'result in B'])
 
-  for i, report in enumerate(reports):
-    for keys in report.gen_keys_list():
-      module_name, abi, class_name, test_name = keys
+    diff_writer.writerows(iter_two_way_diff(reports[0], reports[1]))
 
-      abis = diff.setdefault(module_name, {})
-      test_classes = abis.setdefault(abi, {})
-      tests = test_classes.setdefault(class_name, {})
 
-      result = report.get_test_status(module_name, abi, class_name, test_name)
+def gen_summary_rows(reports, module_name, abi, items):
+  """Generate the rows of diff.csv for one module.
 
-      if test_name not in tests:
-        tests[test_name] = [constant.NO_DATA, constant.NO_DATA]
+  Args:
+    reports: list of CtsReport object
+    module_name: name of the module
+    abi: abi of the module
+    items: the attributes to find in each report
 
-      tests[test_name][i] = result
+  Returns:
+    rows: list of rows, one per item, with the value of each report
+  """
 
-  with open(diff_csv, 'w') as diff_csvfile:
-    diff_writer = csv.writer(diff_csvfile)
-    diff_writer.writerow(['module_name', 'abi', 'class_name', 'test_name',
-                          'result in A', 'result in B'])
+  rows = [[] for _ in items]
+
+  for report in reports:
+    summary = report.module_summaries.get(module_name, {}).get(abi)
+
+    for item, row in zip(items, rows):
+      if not summary:
+        row.append(0.0 if item == constant.PASS_RATE else 0)
+      elif item == constant.TESTED_ITEMS:
+        row.append(summary.tested_items)
+      elif item == constant.PASS_RATE:
+        row.append(summary.pass_rate)
+      elif item in parse_cts_report.CtsReport.STATUS_ORDER:
+        row.append(summary.counter[item])
+      else:
+        raise ValueError(f"Invalid value '{item}' for argument 'item'")
 
-    for module_name, abis in diff.items():
-      for abi, test_classes in abis.items():
-        for class_name, tests in test_classes.items():
-          for test_name, results in tests.items():
-            if results[0] != results[1]:
-              row = [module_name, abi, class_name, test_name] + results
-              diff_writer.writerow(row)
+  return rows
+
+
+def split_module_with_abi(module_with_abi):
+  """Split module_name[abi] into module_name and abi."""
+
+  abi_with_bracket = re.findall(r'\[[^\[^\]]+\]$', module_with_abi)[0]
+
+  module_name = module_with_abi.removesuffix(abi_with_bracket)
+  abi = abi_with_bracket[1:-1]
+
+  return module_name, abi
 
 
 def gen_summary_row(reports, module_with_abi, item):
@@ -143,34 +218,9 @@ def gen_summary_row(reports, module_with_abi, item):
     row: list to write into output file
   """
 
-  row = []
-
-  abi_with_bracket = re.findall(r'\[[^\[^\]]+\]$', module_with_abi)[0]
-
-  module_name = module_with_abi.removesuffix(abi_with_bracket)
-  abi = abi_with_bracket[1:-1]
-
-  for report in reports:
-    module_summary = (
-        report.module_summaries[module_name]
-        if module_name in report.module_summaries
-        else {}
-    )
-
-    summary = module_summary[abi] if abi in module_summary else None
-
-    if not summary:
-      row.append(0.0 if item == constant.PASS_RATE else 0)
-    elif item == constant.TESTED_ITEMS:
-      row.append(summary.tested_items)
-    elif item == constant.PASS_RATE:
-      row.append(summary.pass_rate)
-    elif item in parse_cts_report.CtsReport.STATUS_ORDER:
-      row.append(summary.counter[item])
-    else:
-      raise ValueError(f"Invalid value '{item}' for argument 'item'")
+  module_name, abi = split_module_with_abi(module_with_abi)
 
-  return row
+  return gen_summary_rows(reports, module_name, abi, [item])[0]
 
 
 def n_way_compare(reports, diff_csv):
@@ -186,6 +236,7 @@ def n_way_compare(reports, diff_csv):
   """
 
   modules_min_rate = {}
+  module_keys = {}
   report_titles = []
 
   for i, report in enumerate(reports):
@@ -199,6 +250,7 @@ def n_way_compare(reports, diff_csv):
     for module_name, abis in report.module_summaries.items():
       for abi, summary in abis.items():
         module_with_abi = f'{module_name}[{abi}]'
+        module_keys[module_with_abi] = (module_name, abi)
 
         pass_rate = summary.pass_rate
 
@@ -222,13 +274,17 @@ def n_way_compare(reports, diff_csv):
     diff_writer.writerow(['module_with_abi', 'item'] + report_titles)
 
     for module_with_abi in module_order:
-      for item in items:
-        row = gen_summary_row(reports, module_with_abi, item)
+      module_name, abi = module_keys[module_with_abi]
+      rows = gen_summary_rows(reports, module_name, abi, items)
+      for item, row in zip(items, rows):
         diff_writer.writerow([module_with_abi, item] + row)
 
 
-def load_parsed_report(report_dir, ignore_abi=False):
-  """Load CtsReport() from a directory that stores a parsed report."""
+def load_parsed_report(report_dir, ignore_abi=False, compact=False):
+  """Load CtsReport() from a directory that stores a parsed report.
+
+  If compact is True, load it into a CompactCtsReport() instead.
+  """
 
   if not os.path.isdir(report_dir):
     raise FileNotFoundError(f'{report_dir} is not a directory')
@@ -243,7 +299,10 @@ def load_parsed_report(report_dir, ignore_abi=False):
   with open(info_path, 'r') as info_jsonfile:
     info = json.load(info_jsonfile)
 
-  report = parse_cts_report.CtsReport(info)
+  if compact:
+    report = compact_cts_report.CompactCtsReport(info)
+  else:
+    report = parse_cts_report.CtsReport(info)
 
   with open(result_path, 'r') as result_csvfile:
     report.load_from_csv(result_csvfile, ignore_abi)
@@ -272,6 +331,12 @@ def main():
                       help='Output parsed csv files.')
   parser.add_argument('--ignore-abi', action='store_true',
                       help='Ignore the tests ABI while comparing.')
+  parser.add_argument('-j', '--jobs', type=int, default=1,
+                      help=('Number of reports in a group to parse in '
+                            'parallel. 0 means the number of CPUs.'))
+  parser.add_argument('--compact', action='store_true',
+                      help=('Keep the test results in compact arrays, which '
+                            'uses much less memory for large reports.'))
 
   args = parser.parse_args()
 
@@ -282,6 +347,9 @@ def main():
     msg = 'Two sets of reports are required for one-way and two-way mode.'
     raise UserWarning(msg)
 
+  if args.compact and args.jobs != 1:
+    raise UserWarning('--compact cannot be used together with --jobs.')
+
   output_dir = args.output_dir
   if not os.path.exists(output_dir):
     raise FileNotFoundError(f'Output directory {output_dir} does not exist.')
@@ -294,11 +362,17 @@ def main():
     # path(s) from the `--report` flag is a list
     is_report_files = isinstance(report_path, list)
 
-    if is_report_files:
+    if is_report_files and args.compact:
+      report = compact_cts_report.parse_report_files(
+          report_path, constant.ALL_TEST_ABIS, ignore_abi)
+    elif is_report_files and args.jobs != 1:
+      report = aggregate_cts_reports.aggregate_cts_reports_parallel(
+          report_path, constant.ALL_TEST_ABIS, ignore_abi, args.jobs or None)
+    elif is_report_files:
       report = aggregate_cts_reports.aggregate_cts_reports(
           report_path, constant.ALL_TEST_ABIS, ignore_abi)
     else:
-      report = load_parsed_report(report_path, ignore_abi)
+      report = load_parsed_report(report_path, ignore_abi, args.compact)
 
     if is_report_files and args.output_files:
       device_name = report.info['build_device']
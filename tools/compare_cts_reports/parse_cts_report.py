@@ -21,11 +21,11 @@ turns them into three files: info.json, result.csv, and summary.csv.
 """
 
 import argparse
+import contextlib
 import csv
 import json
 import os
 import shutil
-import tempfile
 import xml.etree.ElementTree as ET
 import zipfile
 import constant
@@ -76,6 +76,15 @@ class CtsReport:
 
     return keys_list
 
+  def iter_tests(self):
+    """Yield (module_name, abi, class_name, test_name, result) tuples."""
+
+    for module_name, abis in self.result_tree.items():
+      for abi, test_classes in abis.items():
+        for class_name, tests in test_classes.items():
+          for test_name, result in tests.items():
+            yield (module_name, abi, class_name, test_name, result)
+
   def is_compatible(self, info):
     return self.info['build_fingerprint'] == info['build_fingerprint']
 
@@ -127,27 +136,49 @@ class CtsReport:
       summary.counter[previous] -= 1
       summary.counter[test_status] += 1
 
+  def merge_report(self, other):
+    """Merge the test results of another CtsReport into this one.
+
+    The results are merged through set_test_status(), so a test keeps the
+    result with the higher priority in STATUS_ORDER.
+    """
+
+    for module_name, abis in other.result_tree.items():
+      for abi, test_classes in abis.items():
+        if abi not in self.result_tree.get(module_name, {}):
+          # Shards usually split a run by module, so most (module, abi) pairs
+          # are only in one report and can be copied as a whole.
+          self.result_tree.setdefault(module_name, {})[abi] = {
+              class_name: dict(tests)
+              for class_name, tests in test_classes.items()
+          }
+          other_summary = other.module_summaries[module_name][abi]
+          summary = self.ModuleSummary()
+          summary.counter.update(other_summary.counter)
+          self.module_summaries.setdefault(module_name, {})[abi] = summary
+          continue
+
+        for class_name, tests in test_classes.items():
+          for test_name, result in tests.items():
+            self.set_test_status(module_name, abi, class_name, test_name,
+                                 result)
+
   def read_test_result_xml(self, test_result_path, ignore_abi=False):
     """Read the result from test_result.xml into a CtsReport object."""
 
-    tree = ET.parse(test_result_path)
-    root = tree.getroot()
+    with open(test_result_path, 'rb') as xml_file:
+      reader = TestResultReader(xml_file, test_result_path)
+      self.read_test_results(reader.tests(), ignore_abi)
+
+  def read_test_results(self, tests, ignore_abi=False):
+    """Read (module_name, abi, class_name, test_name, result) tuples."""
 
-    for module in root.iter('Module'):
-      module_name = module.attrib['name']
-      abi = module.attrib['abi']
+    for module_name, abi, class_name, test_name, result in tests:
       if abi not in self.selected_abis:
         continue
       if ignore_abi:
         abi = constant.ABI_IGNORED
-
-      for testcase in module.iter('TestCase'):
-        class_name = testcase.attrib['name']
-
-        for test in testcase.iter('Test'):
-          test_name = test.attrib['name']
-          result = test.attrib['result']
-          self.set_test_status(module_name, abi, class_name, test_name, result)
+      self.set_test_status(module_name, abi, class_name, test_name, result)
 
   def load_from_csv(self, result_csvfile, ignore_abi=False):
     """Read the information of the report from the csv files.
@@ -293,31 +324,128 @@ def parse_attrib_path(attrib_path):
   return tags, attr_name
 
 
-def get_test_info_xml(test_result_path):
-  """Get test info from xml file."""
+class TestResultReader:
+  """Read a test_result.xml in a single streaming pass.
 
-  tree = ET.parse(test_result_path)
-  root = tree.getroot()
+  The test info is collected from the attributes of the Result and Build
+  elements when the reader is created, which only parses the head of the file.
+  Then tests() continues the same parse and detaches each element from its
+  parent once it has been read, so the memory used doesn't grow with the size
+  of the report.
+  """
 
-  test_info = {
-      'tool_version': constant.VERSION,
-      'source_path': test_result_path,
-  }
+  def __init__(self, xml_file, source_path):
+    """Parse the head of the xml file.
 
-  for attrib_path in ATTRS_TO_SHOW:
-    tags, attr_name = parse_attrib_path(attrib_path)
-    node = root
+    Args:
+      xml_file: path or seekable binary file object of test_result.xml
+      source_path: the path of the report, recorded in the test info
+    """
 
-    while True:
-      tags = tags[1:]
-      if tags:
-        node = node.find(tags[0])
-      else:
+    self._xml_file = xml_file
+    self._start = xml_file.tell() if hasattr(xml_file, 'read') else None
+    self._events = ET.iterparse(xml_file, events=('start', 'end'))
+    self._pending = []
+
+    wanted = {}
+    for attrib_path in ATTRS_TO_SHOW:
+      tags, attr_name = parse_attrib_path(attrib_path)
+      wanted.setdefault(tuple(tags), []).append(attr_name)
+
+    found = {}
+    stack = []
+    for event, elem in self._events:
+      self._pending.append((event, elem))
+      if event == 'end':
+        stack.pop()
+        continue
+      stack.append(elem.tag)
+      path = tuple(stack)
+      if path in wanted and path not in found:
+        found[path] = dict(elem.attrib)
+      if len(found) == len(wanted) or elem.tag == 'Module':
         break
 
-    test_info[attr_name] = node.attrib[attr_name]
+    if len(found) < len(wanted):
+      # The info elements come after the modules. Look them up in a separate
+      # pass that keeps nothing, then restart the parse from the beginning.
+      self._find_info(wanted, found)
+
+    self.info = {
+        'tool_version': constant.VERSION,
+        'source_path': source_path,
+    }
+    for attrib_path in ATTRS_TO_SHOW:
+      tags, attr_name = parse_attrib_path(attrib_path)
+      attrs = found.get(tuple(tags), {})
+      if attr_name not in attrs:
+        raise ValueError(f'{attrib_path} is not found in {source_path}')
+      self.info[attr_name] = attrs[attr_name]
+
+  def _restart(self):
+    """Restart the parse from the beginning of the file."""
+
+    if self._start is not None:
+      self._xml_file.seek(self._start)
+    self._events = ET.iterparse(self._xml_file, events=('start', 'end'))
+    self._pending = []
+
+  def _find_info(self, wanted, found):
+    """Scan the whole file for the attributes in wanted."""
+
+    self._restart()
+    parents = []
+    for event, elem in self._events:
+      if event == 'end':
+        parents.pop()
+        if parents:
+          parents[-1].remove(elem)
+        continue
+      parents.append(elem)
+      path = tuple(parent.tag for parent in parents)
+      if path in wanted and path not in found:
+        found[path] = dict(elem.attrib)
+        if len(found) == len(wanted):
+          break
+    self._restart()
+
+  def tests(self):
+    """Yield (module_name, abi, class_name, test_name, result) for each test."""
+
+    module_name = abi = class_name = None
+    parents = []
+
+    for event, elem in self._iter_events():
+      tag = elem.tag
+      if event == 'start':
+        if tag == 'Module':
+          module_name = elem.attrib['name']
+          abi = elem.attrib['abi']
+        elif tag == 'TestCase':
+          class_name = elem.attrib['name']
+        parents.append(elem)
+        continue
+
+      parents.pop()
+      if tag == 'Test':
+        yield (module_name, abi, class_name, elem.attrib['name'],
+               elem.attrib['result'])
+      if parents:
+        # The finished element is always the only child left in its parent,
+        # so detaching it is cheap and nothing read stays in the tree.
+        parents[-1].remove(elem)
+
+  def _iter_events(self):
+    pending, self._pending = self._pending, []
+    yield from pending
+    yield from self._events
+
+
+def get_test_info_xml(test_result_path):
+  """Get test info from xml file."""
 
-  return test_info
+  with open(test_result_path, 'rb') as xml_file:
+    return TestResultReader(xml_file, test_result_path).info
 
 
 def print_test_info(info):
@@ -336,39 +464,60 @@ def print_test_info(info):
   print()
 
 
+def find_test_result_in_zip(myzip, zip_file_path):
+  """Find the name of test_result.xml in the zip file."""
+
+  result_name = 'test_result.xml'
+  result_list = [f for f in myzip.namelist() if result_name in f]
+  if len(result_list) != 1:
+    raise RuntimeError(f'Cannot extract {result_name} from {zip_file_path}, '
+                       f'matched files: {" ".join(result_list)}')
+  return result_list[0]
+
+
 def extract_test_result_from_zip(zip_file_path, dest_dir):
   """Extract test_result.xml from the zip file."""
 
-  result_name = 'test_result.xml'
-  extracted = os.path.join(dest_dir, result_name)
+  extracted = os.path.join(dest_dir, 'test_result.xml')
   with zipfile.ZipFile(zip_file_path) as myzip:
-    result_list = [f for f in myzip.namelist() if result_name in f]
-    if len(result_list) != 1:
-      raise RuntimeError(f'Cannot extract {result_name} from {zip_file_path}, '
-                         f'matched files: {" ".join(result_list)}')
-    with myzip.open(result_list[0]) as source, open(extracted, 'wb') as target:
+    result_name = find_test_result_in_zip(myzip, zip_file_path)
+    with myzip.open(result_name) as source, open(extracted, 'wb') as target:
       shutil.copyfileobj(source, target)
   return extracted
 
 
+@contextlib.contextmanager
+def open_test_result(report_file):
+  """Open test_result.xml of a report for reading.
+
+  If the report is a zip file, test_result.xml is read straight out of the
+  archive without extracting it.
+  """
+
+  if zipfile.is_zipfile(report_file):
+    with zipfile.ZipFile(report_file) as myzip:
+      result_name = find_test_result_in_zip(myzip, report_file)
+      with myzip.open(result_name) as xml_file:
+        yield xml_file
+  else:
+    with open(report_file, 'rb') as xml_file:
+      yield xml_file
+
+
 def parse_report_file(report_file,
                       selected_abis=constant.ALL_TEST_ABIS,
                       ignore_abi=False):
   """Turn one cts report into a CtsReport object."""
 
-  with tempfile.TemporaryDirectory() as temp_dir:
-    xml_path = (
-        extract_test_result_from_zip(report_file, temp_dir)
-        if zipfile.is_zipfile(report_file)
-        else report_file
-    )
+  with open_test_result(report_file) as xml_file:
+    reader = TestResultReader(xml_file, report_file)
 
-    test_info = get_test_info_xml(xml_path)
+    test_info = reader.info
     print(f'Parsing {selected_abis} test results from: ')
     print_test_info(test_info)
 
     report = CtsReport(test_info, selected_abis)
-    report.read_test_result_xml(xml_path, ignore_abi)
+    report.read_test_results(reader.tests(), ignore_abi)
 
   return report
 
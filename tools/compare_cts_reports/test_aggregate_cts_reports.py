@@ -14,6 +14,7 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 #
+import io
 import unittest
 import aggregate_cts_reports
 
@@ -26,6 +27,23 @@ class TestParse(unittest.TestCase):
 
     self.check_ctsreport(report)
 
+  def test_aggregate_parallel(self):
+    report_files = ['testdata/test_result_1.xml', 'testdata/test_result_2.xml',
+                    'testdata/report.zip']
+    serial = aggregate_cts_reports.aggregate_cts_reports(report_files)
+    parallel = aggregate_cts_reports.aggregate_cts_reports_parallel(
+        report_files, jobs=2)
+
+    self.check_ctsreport(parallel)
+
+    serial_result, serial_summary = io.StringIO(), io.StringIO()
+    serial.write_to_csv(serial_result, serial_summary)
+    parallel_result, parallel_summary = io.StringIO(), io.StringIO()
+    parallel.write_to_csv(parallel_result, parallel_summary)
+
+    self.assertEqual(serial_result.getvalue(), parallel_result.getvalue())
+    self.assertEqual(serial_summary.getvalue(), parallel_summary.getvalue())
+
   def check_ctsreport(self, report):
     self.assertEqual(
         report.get_test_status('module_1', 'arm64-v8a', 'testcase_1', 'test_1'),
@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+#
+
+import filecmp
+import io
+import os
+import tempfile
+import unittest
+
+import aggregate_cts_reports
+import compact_cts_report
+import compare_cts_reports
+import constant
+
+
+class TestCompact(unittest.TestCase):
+
+  def test_set(self):
+    report = compact_cts_report.CompactCtsReport({})
+    test_item = ('module', 'abi', 'class', 'test')
+
+    report.add_test_status(*test_item, 'IGNORED')
+    report.add_test_status(*test_item, 'fail')
+
+    self.assertEqual(report.get_test_status(*test_item), 'IGNORED')
+
+    report.add_test_status(*test_item, 'pass')
+
+    self.assertEqual(report.get_test_status(*test_item), 'pass')
+    self.assertEqual(len(report), 1)
+    self.assertEqual(
+        report.get_test_status('module', 'abi', 'class', 'other'),
+        constant.NO_DATA,
+    )
+
+  def test_output(self):
+    report = compact_cts_report.parse_report_files(
+        ['testdata/test_result_1.xml'])
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      report.output_files(temp_dir)
+
+      self.assertTrue(filecmp.cmp('testdata/output/info_1.json',
+                                  os.path.join(temp_dir, 'info.json')))
+      self.assertTrue(filecmp.cmp('testdata/output/result_1.csv',
+                                  os.path.join(temp_dir, 'result.csv')))
+      self.assertTrue(filecmp.cmp('testdata/output/summary_1.csv',
+                                  os.path.join(temp_dir, 'summary.csv')))
+
+  def test_same_as_ctsreport(self):
+    report_files = ['testdata/test_result_1.xml', 'testdata/test_result_2.xml',
+                    'testdata/test_result_multiple_abis.xml']
+    for ignore_abi in [False, True]:
+      report = aggregate_cts_reports.aggregate_cts_reports(
+          report_files[:2], ignore_abi=ignore_abi)
+      report.read_test_result_xml(report_files[2], ignore_abi)
+      compact = compact_cts_report.parse_report_files(
+          report_files[:2], ignore_abi=ignore_abi)
+      # Read some more after the first sort.
+      self.assertEqual(len(compact), 12)
+      compact.read_test_result_xml(report_files[2], ignore_abi)
+
+      self.assertEqual(report.gen_keys_list(), compact.gen_keys_list())
+      for keys in report.gen_keys_list():
+        self.assertEqual(report.get_test_status(*keys),
+                         compact.get_test_status(*keys))
+
+      result, summary = io.StringIO(), io.StringIO()
+      report.write_to_csv(result, summary)
+      compact_result, compact_summary = io.StringIO(), io.StringIO()
+      compact.write_to_csv(compact_result, compact_summary)
+      self.assertEqual(result.getvalue(), compact_result.getvalue())
+      self.assertEqual(summary.getvalue(), compact_summary.getvalue())
+
+  def test_merge_join(self):
+    reports = [
+        compact_cts_report.parse_report_files(['testdata/test_result_1.xml']),
+        compact_cts_report.parse_report_files(['testdata/test_result_2.xml']),
+    ]
+    joined = list(compact_cts_report.merge_join(reports))
+
+    self.assertEqual(len(joined), 12)
+    self.assertEqual(joined, sorted(joined))
+    self.assertIn((('module_3', 'arm64-v8a', 'testcase_5', 'test_10'),
+                   ['TEST_ERROR', constant.NO_DATA]), joined)
+    self.assertIn((('module_4', 'arm64-v8a', 'testcase_6', 'test_12'),
+                   [constant.NO_DATA, 'fail']), joined)
+
+  def test_compare(self):
+    reports = [
+        compact_cts_report.parse_report_files(['testdata/test_result_1.xml']),
+        compact_cts_report.parse_report_files(['testdata/test_result_2.xml']),
+    ]
+    with tempfile.TemporaryDirectory() as temp_dir:
+      for mode, compare in [
+          ('one_way', compare_cts_reports.one_way_compare),
+          ('two_way', compare_cts_reports.two_way_compare),
+          ('n_way', compare_cts_reports.n_way_compare),
+      ]:
+        csvfile = os.path.join(temp_dir, f'{mode}_diff.csv')
+        compare(reports, csvfile)
+
+        self.assertTrue(
+            filecmp.cmp(f'testdata/compare/{mode}_diff.csv', csvfile))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -20,6 +20,7 @@ import tempfile
 import unittest
 
 import compare_cts_reports
+import constant
 import parse_cts_report
 
 
@@ -47,6 +48,26 @@ class TestParse(unittest.TestCase):
 
       self.assertTrue(filecmp.cmp('testdata/compare/two_way_diff.csv', csvfile))
 
+  def test_two_way_order(self):
+    report_a = parse_cts_report.CtsReport({})
+    report_a.set_test_status('m1', 'x86', 'c1', 't1', 'pass')
+    report_a.set_test_status('m2', 'x86', 'c1', 't1', 'pass')
+    report_b = parse_cts_report.CtsReport({})
+    report_b.set_test_status('m3', 'x86', 'c1', 't1', 'fail')
+    report_b.set_test_status('m1', 'x86', 'c2', 't1', 'fail')
+    report_b.set_test_status('m1', 'x86', 'c1', 't2', 'fail')
+    report_b.set_test_status('m2', 'x86', 'c1', 't1', 'fail')
+
+    diff = list(compare_cts_reports.iter_two_way_diff(report_a, report_b))
+
+    self.assertEqual(diff, [
+        ['m1', 'x86', 'c1', 't1', 'pass', constant.NO_DATA],
+        ['m1', 'x86', 'c1', 't2', constant.NO_DATA, 'fail'],
+        ['m1', 'x86', 'c2', 't1', constant.NO_DATA, 'fail'],
+        ['m2', 'x86', 'c1', 't1', 'pass', 'fail'],
+        ['m3', 'x86', 'c1', 't1', constant.NO_DATA, 'fail'],
+    ])
+
   def test_n_way(self):
     ctsreports = [
         parse_cts_report.parse_report_file('testdata/test_result_1.xml'),
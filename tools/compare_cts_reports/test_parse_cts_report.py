@@ -66,6 +66,56 @@ class TestParse(unittest.TestCase):
 
     self.check_ctsreport(report)
 
+  def test_reader(self):
+    with parse_cts_report.open_test_result('testdata/report.zip') as xml_file:
+      reader = parse_cts_report.TestResultReader(xml_file, 'report.zip')
+
+      self.assertEqual(reader.info['source_path'], 'report.zip')
+      self.assertEqual(reader.info['build_fingerprint'],
+                       'this_build_fingerprint')
+
+      tests = list(reader.tests())
+
+    self.assertEqual(len(tests), 10)
+    self.assertEqual(tests[0],
+                     ('module_1', 'arm64-v8a', 'testcase_1', 'test_1', 'pass'))
+    self.assertEqual(tests[-1], ('module_3', 'arm64-v8a', 'testcase_5',
+                                 'test_10', 'TEST_ERROR'))
+
+  def test_reader_detaches_elements(self):
+    with open('testdata/test_result_1.xml', 'rb') as xml_file:
+      reader = parse_cts_report.TestResultReader(xml_file, 'test_result_1.xml')
+      root = reader._pending[0][1]
+      read = []
+      for test in reader.tests():
+        # The tests read before are no longer attached to the tree.
+        attached = [elem.attrib['name'] for elem in root.iter('Test')]
+        self.assertFalse(set(read) & set(attached))
+        read.append(test[3])
+
+    self.assertEqual(len(root), 0)
+
+  def test_reader_build_after_modules(self):
+    with open('testdata/test_result_1.xml', 'r') as xml_file:
+      lines = xml_file.readlines()
+    build = next(line for line in lines if '<Build ' in line)
+    lines.remove(build)
+    lines.insert(-1, build)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      report_file = os.path.join(temp_dir, 'test_result.xml')
+      with open(report_file, 'w') as xml_file:
+        xml_file.writelines(lines)
+
+      with open(report_file, 'rb') as xml_file:
+        reader = parse_cts_report.TestResultReader(xml_file, report_file)
+        tests = list(reader.tests())
+
+      self.assertEqual(reader.info['build_fingerprint'],
+                       'this_build_fingerprint')
+      self.assertEqual(len(tests), 10)
+      self.check_ctsreport(parse_cts_report.parse_report_file(report_file))
+
   def check_ctsreport(self, report):
     self.assertEqual(
         report.get_test_status('module_1', 'arm64-v8a', 'testcase_1', 'test_1'),
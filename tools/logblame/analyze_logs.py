@@ -2,9 +2,12 @@
 
 import argparse
 import datetime
+import Queue
 import re
 import subprocess
 import sys
+import threading
+import time
 
 import logs
 import ps
@@ -36,6 +39,16 @@ class Stats(object):
     bucket.memory += logLine.memory()
     bucket.lines.append(logLine)
 
+  def addCounts(self, key, count, memory, logLine):
+    """Add already-counted totals for a key, only keeping the first line as an example."""
+    bucket = self._data.get(key)
+    if not bucket:
+      bucket = Bucket()
+      bucket.lines.append(logLine)
+      self._data[key] = bucket
+    bucket.count += count
+    bucket.memory += memory
+
   def __iter__(self):
     return self._data.iteritems()
 
@@ -53,6 +66,71 @@ class Stats(object):
     return result
 
 
+class TimeSlot(object):
+  """The counts for all of the logs that arrived in one slot of a RollingStats."""
+  def __init__(self, slotId):
+    self.slotId = slotId
+    self.count = 0
+    self.memory = 0
+    self.byTag = dict()
+    self.byPid = dict()
+    self.byText = dict()
+
+  def add(self, logLine):
+    memory = logLine.memory()
+    self.count += 1
+    self.memory += memory
+    for counts, key in ((self.byTag, logLine.tag), (self.byPid, logLine.pid),
+        (self.byText, logLine.text)):
+      entry = counts.get(key)
+      if entry:
+        entry[0] += 1
+        entry[1] += memory
+      else:
+        counts[key] = [1, memory, logLine]
+
+
+# How many time slots a RollingStats window is split into. A window covers the current,
+# partly filled slot and the slots before it, so it is short by less than one slot.
+ROLLING_SLOTS = 60
+
+class RollingStats(object):
+  """Tag, pid and text stats over a sliding window of time.
+
+  The window is split into slotCount fixed width time slots kept in a ring buffer, so only
+  the counts (and one example line per key) are kept rather than every log line."""
+  def __init__(self, windowSec, slotCount=ROLLING_SLOTS):
+    self._slotSec = float(windowSec) / slotCount
+    self._slots = [None] * slotCount
+
+  def add(self, now, logLine):
+    slotId = int(now / self._slotSec)
+    index = slotId % len(self._slots)
+    slot = self._slots[index]
+    if not slot or slot.slotId != slotId:
+      slot = TimeSlot(slotId)
+      self._slots[index] = slot
+    slot.add(logLine)
+
+  def window(self, now):
+    """Returns (totalCount, totalMemory, byTag, byPid, byText) for the slots in the window."""
+    oldest = int(now / self._slotSec) - len(self._slots) + 1
+    totalCount = 0
+    totalMemory = 0
+    byTag = Stats()
+    byPid = Stats()
+    byText = Stats()
+    for slot in self._slots:
+      if not slot or slot.slotId < oldest:
+        continue
+      totalCount += slot.count
+      totalMemory += slot.memory
+      for stats, counts in ((byTag, slot.byTag), (byPid, slot.byPid), (byText, slot.byText)):
+        for key, (count, memory, logLine) in counts.iteritems():
+          stats.addCounts(key, count, memory, logLine)
+    return (totalCount, totalMemory, byTag, byPid, byText)
+
+
 def ParseDuration(s):
   """Parse a date of the format .w.d.h.m.s into the number of seconds."""
   def make_int(index):
@@ -115,6 +193,68 @@ def WriteResult(totalCount, totalMemory, bucket, text):
       FormatMemory(bucket.memory), (100 * bucket.memory / totalMemory), text)
   
 
+def PrintReport(processes, totalCount, totalMemory, byTag, byPid, byText):
+  """Print the top tags, processes and duplicates."""
+  print "Top tags by count"
+  print "-----------------"
+  i = 0
+  for k,v in byTag.byCount():
+    WriteResult(totalCount, totalMemory, v, k)
+    if i >= 10:
+      break
+    i += 1
+
+  print
+  print "Top tags by memory"
+  print "------------------"
+  i = 0
+  for k,v in byTag.byMemory():
+    WriteResult(totalCount, totalMemory, v, k)
+    if i >= 10:
+      break
+    i += 1
+
+  print
+  print "Top Processes by memory"
+  print "-----------------------"
+  i = 0
+  for k,v in byPid.byMemory():
+    WriteResult(totalCount, totalMemory, v,
+        "%-8s %s" % (k, processes.FindPid(k).DisplayName()))
+    if i >= 10:
+      break
+    i += 1
+
+  print
+  print "Top Duplicates by count"
+  print "-----------------------"
+  i = 0
+  for k,v in byText.byCount():
+    logLine = v.lines[0]
+    WriteResult(totalCount, totalMemory, v,
+        "%s/%s: %s" % (logLine.level, logLine.tag, logLine.text))
+    if i >= 10:
+      break
+    i += 1
+
+  print
+  print "Top Duplicates by memory"
+  print "-----------------------"
+  i = 0
+  for k,v in byText.byCount():
+    logLine = v.lines[0]
+    WriteResult(totalCount, totalMemory, v,
+        "%s/%s: %s" % (logLine.level, logLine.tag, logLine.text))
+    if i >= 10:
+      break
+    i += 1
+
+  print
+  print "Totals"
+  print "------"
+  print "%7d  %s" % (totalCount, FormatMemory(totalMemory))
+
+
 def ParseArgs(argv):
   parser = argparse.ArgumentParser(description="Process some integers.")
   parser.add_argument("input", type=str, nargs="?",
@@ -125,14 +265,103 @@ def ParseArgs(argv):
                       help="how long to run for (XdXhXmXs)")
   parser.add_argument("--rawlogs", type=str, nargs=1,
                       help="file to put the rawlogs into")
+  parser.add_argument("--live", type=str, nargs=1,
+                      help="keep streaming, and print a report this often (XdXhXmXs)")
+  parser.add_argument("--window", type=str, nargs=1,
+                      help="with --live, how far back each report looks (XdXhXmXs, default 5m)")
+  parser.add_argument("--refresh", type=str, nargs=1,
+                      help="with --live, the least time between process table updates"
+                          + " (XdXhXmXs, default 10s)")
 
   args = parser.parse_args()
 
   args.durationSec = ParseDuration(args.duration[0]) if args.duration else 0
+  args.liveSec = ParseDuration(args.live[0]) if args.live else 0
+  args.windowSec = ParseDuration(args.window[0]) if args.window else 300
+  args.refreshSec = ParseDuration(args.refresh[0]) if args.refresh else 10
 
   return args
 
 
+def WriteRawLog(rawlogs, logLine):
+  rawlogs.write("%-10s %s %-6s %-6s %-6s %s/%s: %s\n" %(logLine.buf, logLine.timestamp,
+      logLine.uid, logLine.pid, logLine.tid, logLine.level, logLine.tag, logLine.text))
+
+
+def ReadLines(infile, lineQueue):
+  """Read lines from infile into lineQueue, followed by None at the end of the file."""
+  for line in iter(infile.readline, ""):
+    lineQueue.put(line)
+  lineQueue.put(None)
+
+
+class LiveReporter(object):
+  """Prints a report over the last args.windowSec every args.liveSec.
+
+  The log lines are read on a separate thread, so the reports are printed on time even
+  when no log lines are coming out. The reports themselves are printed from the thread
+  parsing the logs, because the ProcessSet isn't thread safe."""
+  def __init__(self, args, processes):
+    self._args = args
+    self._processes = processes
+    self.rolling = RollingStats(args.windowSec)
+    self._startTime = datetime.datetime.now()
+    self._nextReport = time.time() + args.liveSec
+    if args.durationSec:
+      self._endTime = time.time() + args.durationSec
+    else:
+      self._endTime = None
+
+  def lines(self, lineQueue):
+    """Yield the lines from lineQueue, printing the reports that are due in the meantime."""
+    while True:
+      now = time.time()
+      if self._endTime and now >= self._endTime:
+        return
+      if now >= self._nextReport:
+        self.report(now)
+        self._nextReport = now + self._args.liveSec
+        continue
+      timeout = self._nextReport - now
+      if self._endTime:
+        timeout = min(timeout, self._endTime - now)
+      try:
+        line = lineQueue.get(True, timeout)
+      except Queue.Empty:
+        continue
+      if line is None:
+        return
+      yield line
+
+  def report(self, now):
+    totalCount, totalMemory, byTag, byPid, byText = self.rolling.window(now)
+    self._processes.UpdateProcesses()
+    print
+    print "=== %s (window %s, running %s) ===" % (
+        datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        FormateTimeDelta(datetime.timedelta(seconds=self._args.windowSec)),
+        FormateTimeDelta(datetime.datetime.now() - self._startTime))
+    PrintReport(self._processes, totalCount, totalMemory, byTag, byPid, byText)
+    sys.stdout.flush()
+
+
+def RunLive(args, infile, processes, rawlogs):
+  """Stream the logs and print a report over the last args.windowSec every args.liveSec."""
+  # Unknown pids are collected and looked up together, at most once every refreshSec.
+  processes.minUpdateInterval = args.refreshSec
+
+  lineQueue = Queue.Queue()
+  reader = threading.Thread(target=ReadLines, args=(infile, lineQueue))
+  reader.daemon = True
+  reader.start()
+
+  reporter = LiveReporter(args, processes)
+  for logLine in logs.ParseLogcat(reporter.lines(lineQueue), processes):
+    if rawlogs:
+      WriteRawLog(rawlogs, logLine)
+    reporter.rolling.add(time.time(), logLine)
+
+
 def main(argv):
   args = ParseArgs(argv)
 
@@ -156,7 +385,7 @@ def main(argv):
     if args.clear:
       subprocess.check_call(["adb", "logcat", "-c"])
     cmd = ["adb", "logcat", "-v", "long", "-D", "-v", "uid"]
-    if not args.durationSec:
+    if not args.durationSec and not args.liveSec:
       cmd.append("-d")
     logcat = subprocess.Popen(cmd, stdout=subprocess.PIPE)
     infile = logcat.stdout
@@ -164,9 +393,13 @@ def main(argv):
     # Do one update because we know we'll need it, but then don't do it again
     # if we're not streaming them.
     processes.Update(True)
-    if args.durationSec:
+    if args.durationSec or args.liveSec:
       processes.doUpdates = True
 
+  if args.liveSec:
+    RunLive(args, infile, processes, rawlogs)
+    return
+
   totalCount = 0
   totalMemory = 0
   byTag = Stats()
@@ -178,9 +411,8 @@ def main(argv):
   # Read the log lines from the parser and build a big mapping of everything
   for logLine in logs.ParseLogcat(infile, processes, args.durationSec):
     if rawlogs:
-      rawlogs.write("%-10s %s %-6s %-6s %-6s %s/%s: %s\n" %(logLine.buf, logLine.timestamp,
-          logLine.uid, logLine.pid, logLine.tid, logLine.level, logLine.tag, logLine.text))
-    
+      WriteRawLog(rawlogs, logLine)
+
     totalCount += 1
     totalMemory += logLine.memory()
     byTag.add(logLine.tag, logLine)
@@ -195,64 +427,7 @@ def main(argv):
   # for new processes
   processes.doUpdates = False
 
-  print "Top tags by count"
-  print "-----------------"
-  i = 0
-  for k,v in byTag.byCount():
-    WriteResult(totalCount, totalMemory, v, k)
-    if i >= 10:
-      break
-    i += 1
-
-  print
-  print "Top tags by memory"
-  print "------------------"
-  i = 0
-  for k,v in byTag.byMemory():
-    WriteResult(totalCount, totalMemory, v, k)
-    if i >= 10:
-      break
-    i += 1
-
-  print
-  print "Top Processes by memory"
-  print "-----------------------"
-  i = 0
-  for k,v in byPid.byMemory():
-    WriteResult(totalCount, totalMemory, v,
-        "%-8s %s" % (k, processes.FindPid(k).DisplayName()))
-    if i >= 10:
-      break
-    i += 1
-
-  print
-  print "Top Duplicates by count"
-  print "-----------------------"
-  i = 0
-  for k,v in byText.byCount():
-    logLine = v.lines[0]
-    WriteResult(totalCount, totalMemory, v,
-        "%s/%s: %s" % (logLine.level, logLine.tag, logLine.text))
-    if i >= 10:
-      break
-    i += 1
-
-  print
-  print "Top Duplicates by memory"
-  print "-----------------------"
-  i = 0
-  for k,v in byText.byCount():
-    logLine = v.lines[0]
-    WriteResult(totalCount, totalMemory, v,
-        "%s/%s: %s" % (logLine.level, logLine.tag, logLine.text))
-    if i >= 10:
-      break
-    i += 1
-
-  print
-  print "Totals"
-  print "------"
-  print "%7d  %s" % (totalCount, FormatMemory(totalMemory))
+  PrintReport(processes, totalCount, totalMemory, byTag, byPid, byText)
 
   print "Actual duration: %s" % FormateTimeDelta(endTime-startTime)
 
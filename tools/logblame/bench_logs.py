@@ -0,0 +1,101 @@
+#!/usr/bin/env python2.7 -B
+
+"""Benchmark for logs.ParseLogcat.
+
+Writes a synthetic "logcat -v long -v uid" file of the requested size (if it does not
+already exist) and times how long it takes to parse it.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+import logs
+import ps
+
+SIZE_RE_UNITS = {"k": 1024, "m": 1024 * 1024, "g": 1024 * 1024 * 1024}
+
+TAGS = ["ActivityManager", "PackageManager", "chatty", "WifiService", "NetworkController",
+    "thermal-engine", "SurfaceFlinger", "BluetoothAdapter", "AudioFlinger", "GCoreUlr"]
+UIDS = ["root", "system", "1000", "u0_a22", "u0_a136", "radio", "wifi"]
+LEVELS = "EWIDV"
+BUFFERS = ["main", "system", "radio", "events", "crash"]
+
+def ParseSize(s):
+  """Parse a size like 512m or 2g into a number of bytes."""
+  s = s.strip().lower()
+  if s and s[-1] in SIZE_RE_UNITS:
+    return int(s[:-1]) * SIZE_RE_UNITS[s[-1]]
+  return int(s)
+
+
+def WriteSynthetic(filename, size, seed=0):
+  """Write roughly size bytes of synthetic logs to filename."""
+  rnd = random.Random(seed)
+  pids = [rnd.randint(100, 32000) for i in range(200)]
+  words = ["lorem", "ipsum", "dolor", "sit", "amet", "changed;", "collecting", "certs",
+      "/system/app/KeyChain", "uid=1000(system)", "identical"]
+  written = 0
+  n = 0
+  out = open(filename, "w")
+  try:
+    while written < size:
+      chunk = []
+      for i in range(1000):
+        if n % 5000 == 0:
+          chunk.append("--------- switch to %s\n" % BUFFERS[(n / 5000) % len(BUFFERS)])
+        pid = rnd.choice(pids)
+        tag = rnd.choice(TAGS)
+        chunk.append("[ 03-29 %02d:%02d:%02d.%03d %5s:%5d:%5d %s/%s ]\n" % (
+            (n / 3600000) % 24, (n / 60000) % 60, (n / 1000) % 60, n % 1000,
+            rnd.choice(UIDS), pid, pid + rnd.randint(0, 20), rnd.choice(LEVELS), tag))
+        if tag == "chatty" and n > 0:
+          chunk.append("uid=1000(system) Thread-6 identical %d lines\n" % rnd.randint(1, 4))
+        else:
+          for j in range(1 + (n % 7 == 0) * 2):
+            chunk.append(" ".join(rnd.choice(words) for k in range(rnd.randint(3, 15))))
+            chunk.append("\n")
+        chunk.append("\n")
+        n += 1
+      text = "".join(chunk)
+      out.write(text)
+      written += len(text)
+  finally:
+    out.close()
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description="Benchmark the logcat parser.")
+  parser.add_argument("--file", type=str, default="/tmp/logblame-bench.txt",
+                      help="the synthetic log file to parse (generated if missing)")
+  parser.add_argument("--size", type=str, default="2g",
+                      help="how big of a file to generate (e.g. 512m, 2g)")
+  parser.add_argument("--regenerate", action="store_true",
+                      help="regenerate the file even if it already exists")
+  args = parser.parse_args(argv[1:])
+
+  if args.regenerate or not os.path.exists(args.file):
+    start = time.time()
+    WriteSynthetic(args.file, ParseSize(args.size))
+    print "Generated %s in %.1fs" % (args.file, time.time() - start)
+
+  size = os.path.getsize(args.file)
+  processes = ps.ProcessSet()
+  count = 0
+  start = time.time()
+  with open(args.file, "r") as f:
+    for logLine in logs.ParseLogcat(f, processes):
+      count += 1
+  elapsed = time.time() - start
+
+  print "Parsed %d lines (%d bytes) in %.2fs: %.1f MB/s, %.0f lines/s" % (count, size, elapsed,
+      size / elapsed / (1024 * 1024), count / elapsed)
+
+
+if __name__ == "__main__":
+  main(sys.argv)
+
+
+# vim: set ts=2 sw=2 sts=2 tw=100 nocindent autoindent smartindent expandtab:
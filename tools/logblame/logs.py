@@ -8,6 +8,12 @@ HEADER = re.compile("^\\[ (\\d\\d-\\d\\d \\d\\d:\\d\\d:\\d\\d.\\d\\d\\d) +(.+?):
 HEADER_TYPE2 = re.compile("^(\\d\\d-\\d\\d \\d\\d:\\d\\d:\\d\\d.\\d\\d\\d) *(\\d+) *(\\d+) *([EWIDV]) ([^ :]*?): (.*?)$")
 CHATTY_IDENTICAL = re.compile("^.* identical (\\d+) lines$")
 
+# Both header formats in one regex. Groups 1-6 are HEADER, groups 7-12 are HEADER_TYPE2.
+HEADER_ANY = re.compile("^(?:" + HEADER.pattern[1:-1] + "|" + HEADER_TYPE2.pattern[1:-1] + ")$")
+BUFFER_BEGIN_PREFIX = "--------- beginning of "
+BUFFER_SWITCH_PREFIX = "--------- switch to "
+DIGITS = frozenset("0123456789")
+
 STATE_BEGIN = 0
 STATE_BUFFER = 1
 STATE_HEADER = 2
@@ -73,20 +79,14 @@ def ParseLogcat(f, processes, duration=None):
 
 
 def ParseLogcatInner(f, processes, duration=None):
-  """Parses a file object containing log text and returns a list of LogLine objects."""
-  result = []
-
+  """Parses a file object containing log text and returns a list of LogLine objects.
+  Only lines starting with '[' or a digit are tried against the header regex, and
+  FindPid results are memoized since they never change once a pid has been seen."""
   buf = None
-  timestamp = None
-  uid = None
-  pid = None
-  tid = None
-  level = None
-  tag = None
-
   state = STATE_BEGIN
   logLine = None
-  previous = None
+  parts = None
+  pidCache = dict()
 
   if duration:
     endTime = datetime.datetime.now() + datetime.timedelta(seconds=duration)
@@ -97,85 +97,71 @@ def ParseLogcatInner(f, processes, duration=None):
     if duration and endTime <= datetime.datetime.now():
       break
 
-    if len(line) > 0 and line[-1] == '\n':
+    if line and line[-1] == '\n':
       line = line[0:-1]
 
-    m = BUFFER_BEGIN.match(line)
-    if m:
-      if logLine:
-        yield logLine
-        logLine = None
-      buf = m.group(1)
-      state = STATE_BUFFER
-      continue
-
-    m = BUFFER_SWITCH.match(line)
-    if m:
-      if logLine:
-        yield logLine
-        logLine = None
-      buf = m.group(1)
-      state = STATE_BUFFER
+    if not line:
+      if state == STATE_BLANK:
+        if logLine:
+          parts.append("\n")
+      state = STATE_BLANK
       continue
 
-    m = HEADER.match(line)
-    if m:
-      if logLine:
-        yield logLine
-      logLine = LogLine(
-            buf=buf,
-            timestamp=m.group(1),
-            uid=m.group(2),
-            pid=m.group(3),
-            tid=m.group(4),
-            level=m.group(5),
-            tag=m.group(6)
-          )
-      previous = logLine
-      logLine.process = processes.FindPid(logLine.pid, logLine.uid)
-      state = STATE_HEADER
-      continue
+    first = line[0]
 
-    m = HEADER_TYPE2.match(line)
-    if m:
-      if logLine:
-        yield logLine
-      logLine = LogLine(
-            buf=buf,
-            timestamp=m.group(1),
-            uid="0",
-            pid=m.group(2),
-            tid=m.group(3),
-            level=m.group(4),
-            tag=m.group(5),
-            text=m.group(6)
-          )
-      previous = logLine
-      logLine.process = processes.FindPid(logLine.pid, logLine.uid)
-      state = STATE_BEGIN
-      continue
+    if first == "-":
+      if line.startswith(BUFFER_BEGIN_PREFIX):
+        newBuf = line[len(BUFFER_BEGIN_PREFIX):]
+      elif line.startswith(BUFFER_SWITCH_PREFIX):
+        newBuf = line[len(BUFFER_SWITCH_PREFIX):]
+      else:
+        newBuf = None
+      if newBuf is not None:
+        if logLine:
+          logLine.text = "".join(parts)
+          yield logLine
+          logLine = None
+        buf = newBuf
+        state = STATE_BUFFER
+        continue
 
-    if not len(line):
-      if state == STATE_BLANK:
+    elif first == "[" or first in DIGITS:
+      m = HEADER_ANY.match(line)
+      if m:
         if logLine:
-          logLine.text += "\n"
-      state = STATE_BLANK
-      continue
+          logLine.text = "".join(parts)
+          yield logLine
+        g = m.groups()
+        if g[0] is not None:
+          logLine = LogLine(buf, g[0], g[1], g[2], g[3], g[4], g[5])
+          parts = []
+          state = STATE_HEADER
+        else:
+          logLine = LogLine(buf, g[6], "0", g[7], g[8], g[9], g[10])
+          parts = [g[11]] if g[11] else []
+          state = STATE_BEGIN
+        process = pidCache.get(logLine.pid)
+        if process is None:
+          process = processes.FindPid(logLine.pid, logLine.uid)
+          pidCache[logLine.pid] = process
+        logLine.process = process
+        continue
 
     if logLine:
       if state == STATE_HEADER:
-        logLine.text += line
+        parts.append(line)
       elif state == STATE_TEXT:
-        logLine.text += "\n"
-        logLine.text += line
+        parts.append("\n")
+        parts.append(line)
       elif state == STATE_BLANK:
-        if len(logLine.text):
-          logLine.text += "\n"
-        logLine.text += "\n"
-        logLine.text += line
+        if parts:
+          parts.append("\n")
+        parts.append("\n")
+        parts.append(line)
     state = STATE_TEXT
 
   if logLine:
+    logLine.text = "".join(parts)
     yield logLine
 
 
@@ -1,6 +1,7 @@
 import csv
 import re
 import subprocess
+import time
 
 HEADER_RE = re.compile("USER\\s*PID\\s*PPID\\s*VSIZE\\s*RSS\\s*WCHAN\\s*PC\\s*NAME")
 PROCESS_RE = re.compile("(\\S+)\\s+(\\d+)\\s+(\\d+)\\s+\\d+\\s+\\d+\\s+\\S+\\s+.\\S+\\s+\\S+\\s+(.*)")
@@ -39,25 +40,48 @@ class ProcessSet(object):
     self._uids = dict()
     self._pidUpdateCount = 0
     self._uidUpdateCount = 0
+    self._lastPidUpdate = None
+    self._pendingPids = dict()
     self.doUpdates = False
+    # When non-zero, don't run ps more often than this many seconds. Unknown pids seen in
+    # the meantime are batched up and resolved together by the next update.
+    self.minUpdateInterval = 0
 
   def Update(self, force=False):
     self.UpdateUids(force)
     self.UpdateProcesses(force)
 
   def UpdateProcesses(self, force=False):
+    """Run ps on the device and add any new processes. Returns whether ps was run."""
     if not (self.doUpdates or force):
-      return
+      return False
+    now = time.time()
+    if (not force and self.minUpdateInterval and self._lastPidUpdate is not None
+        and now - self._lastPidUpdate < self.minUpdateInterval):
+      return False
+    self._lastPidUpdate = now
     self._pidUpdateCount += 1
     try:
       text = subprocess.check_output(["adb", "shell", "ps"])
     except subprocess.CalledProcessError:
-      return # oh well. we won't get the pid
+      return False # oh well. we won't get the pid
     lines = ParsePs(text)
     for line in lines:
       if not self._processes.has_key(line[1]):
         uid = self.FindUid(ParseUid(line[0]))
-        self._processes[line[1]] = Process(uid, line[1], line[2], line[3])
+        pending = self._pendingPids.pop(line[1], None)
+        if pending:
+          # Fill in the object we already handed out, so callers holding it see the name.
+          pending.uid = uid
+          pending.ppid = line[2]
+          pending.name = line[3]
+          self._processes[line[1]] = pending
+        else:
+          self._processes[line[1]] = Process(uid, line[1], line[2], line[3])
+    # Anything still pending has died since we saw it in the logs.
+    self._processes.update(self._pendingPids)
+    self._pendingPids.clear()
+    return True
 
   def UpdateUids(self, force=False):
     if not (self.doUpdates or force):
@@ -79,15 +103,19 @@ class ProcessSet(object):
     That can only happen after the process has died, and we just missed our
     chance to find it.  The pid won't come back.
     """
-    result = self._processes.get(pid)
+    result = self._processes.get(pid) or self._pendingPids.get(pid)
     if not result:
-      self.UpdateProcesses()
+      updated = self.UpdateProcesses()
       result = self._processes.get(pid)
       if not result:
         if uid:
           uid = self._uids.get(uid)
         result = Process(uid, pid, None, None)
-        self._processes[pid] = result
+        if self.doUpdates and not updated:
+          # Rate limited. Look for it again with the next batch.
+          self._pendingPids[pid] = result
+        else:
+          self._processes[pid] = result
     return result
 
   def FindUid(self, uid):
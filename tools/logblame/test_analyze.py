@@ -1,6 +1,11 @@
 #!/usr/bin/env python2.7 -B
 
+import Queue
+import StringIO
+import sys
+
 import analyze_logs
+import logs
 
 
 def test_ParseDuration(s, expected):
@@ -8,6 +13,71 @@ def test_ParseDuration(s, expected):
   if actual != expected:
     raise Exception("expected %s, actual %s" % (expected, actual))
 
+def test_RollingStats():
+  rolling = analyze_logs.RollingStats(30, 3)
+  a = logs.LogLine("main", "03-29 00:46:58.857", "1000", "1815", "1816", "I", "A", "one")
+  b = logs.LogLine("main", "03-29 00:46:58.857", "1000", "1900", "1901", "W", "B", "two")
+  rolling.add(1000, a)
+  rolling.add(1005, a)
+  rolling.add(1015, b)
+  rolling.add(1025, b)
+
+  totalCount, totalMemory, byTag, byPid, byText = rolling.window(1029)
+  actual = [(k, v.count) for k, v in byTag.byCount()]
+  if totalCount != 4 or actual not in ([("A", 2), ("B", 2)], [("B", 2), ("A", 2)]):
+    raise Exception("expected 4 lines in the window, actual %s %s" % (totalCount, actual))
+
+  # The slot with both of the "A" lines has now dropped out of the window.
+  totalCount, totalMemory, byTag, byPid, byText = rolling.window(1035)
+  actual = [(k, v.count, v.memory) for k, v in byPid.byCount()]
+  if totalCount != 2 or actual != [("1900", 2, 2 * b.memory())]:
+    raise Exception("expected only pid 1900, actual %s %s" % (totalCount, actual))
+
+  # Adding to a reused slot replaces the old counts.
+  rolling.add(1031, a)
+  totalCount, totalMemory, byTag, byPid, byText = rolling.window(1031)
+  if totalCount != 3 or byText.byCount()[0][1].lines[0] != b:
+    raise Exception("expected 3 lines, actual %s" % totalCount)
+
+def test_RollingStatsSlides():
+  # With the default slots, the window slides by 1s at a time rather than resetting.
+  rolling = analyze_logs.RollingStats(60)
+  a = logs.LogLine("main", "03-29 00:46:58.857", "1000", "1815", "1816", "I", "A", "one")
+  for now in range(1000, 1120):
+    rolling.add(now, a)
+    totalCount = rolling.window(now + 0.5)[0]
+    expected = min(now - 1000 + 1, 60)
+    if totalCount != expected:
+      raise Exception("expected %s lines at %s, actual %s" % (expected, now, totalCount))
+
+
+class FakeArgs(object):
+  def __init__(self, liveSec, windowSec, durationSec):
+    self.liveSec = liveSec
+    self.windowSec = windowSec
+    self.durationSec = durationSec
+
+
+class FakeProcesses(object):
+  def UpdateProcesses(self):
+    pass
+
+
+def test_LiveReporterIdle():
+  # Reports come out on time even when no log lines arrive.
+  reporter = analyze_logs.LiveReporter(FakeArgs(0.05, 60, 0.28), FakeProcesses())
+  stdout = sys.stdout
+  sys.stdout = StringIO.StringIO()
+  try:
+    lines = list(reporter.lines(Queue.Queue()))
+    output = sys.stdout.getvalue()
+  finally:
+    sys.stdout = stdout
+  reports = output.count("=== ")
+  if lines or not 4 <= reports <= 5:
+    raise Exception("expected 5 reports, actual %s" % reports)
+
+
 def main():
   test_ParseDuration("1w", 604800)
   test_ParseDuration("1d", 86400)
@@ -15,6 +85,9 @@ def main():
   test_ParseDuration("1m", 60)
   test_ParseDuration("1s", 1)
   test_ParseDuration("1w1d1h1m1s", 694861)
+  test_RollingStats()
+  test_RollingStatsSlides()
+  test_LiveReporterIdle()
 
 
 if __name__ == "__main__":
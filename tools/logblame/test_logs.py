@@ -150,6 +150,27 @@ def test_normal():
 
 
 
+def test_type2():
+  """Test the single line (threadtime) header format mixed with the long format."""
+  expected = [
+      logs.LogLine("main", "03-29 00:46:58.857", "0", "1815", "1816", "I", "PackageManager",
+        "/system/app/KeyChain changed; collecting certs"),
+      logs.LogLine("main", "03-29 00:46:58.858", "0", "1815", "1817", "W", "Empty", ""),
+      logs.LogLine("main", "03-29 00:46:58.872", "1000", "1815", "1816", "I", "PackageManager",
+        "12 certs\n[ not a header"),
+  ]
+
+  text = """--------- beginning of main
+03-29 00:46:58.857  1815  1816 I PackageManager: /system/app/KeyChain changed; collecting certs
+03-29 00:46:58.858  1815  1817 W Empty: 
+[ 03-29 00:46:58.872  1000: 1815: 1816 I/PackageManager ]
+12 certs
+[ not a header
+
+"""
+  check_parsing(expected, text)
+
+
 def check_parsing(expected, text):
   """Parse the text and see if it parsed as expected."""
   processes = ps.ProcessSet()
@@ -170,6 +191,7 @@ def main():
   test_two_blanks()
   test_chatty()
   test_normal()
+  test_type2()
 
 
 if __name__ == "__main__":
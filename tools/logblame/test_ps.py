@@ -68,6 +68,64 @@ pkg-usr,0,IbsusL,0,?
     raise Exception("test failed")
 
 
+PS_HEADER = "USER      PID   PPID  VSIZE  RSS   WCHAN              PC  NAME\n"
+PS_LINE = "u0_a22    %s  633   1808572 79760 SyS_epoll_ 0000000000 S %s\n"
+
+
+class FakeDevice(object):
+  """Stands in for subprocess.check_output and time.time in the ps module."""
+  def __init__(self):
+    self.now = 1000
+    self.processes = []
+    self.psCount = 0
+
+  def time(self):
+    return self.now
+
+  def check_output(self, cmd):
+    if cmd[-1] == "ps":
+      self.psCount += 1
+      return PS_HEADER + "".join(PS_LINE % process for process in self.processes)
+    return ""
+
+
+def test_rateLimitedUpdates():
+  device = FakeDevice()
+  check_output, now = ps.subprocess.check_output, ps.time.time
+  ps.subprocess.check_output, ps.time.time = device.check_output, device.time
+  try:
+    processes = ps.ProcessSet()
+    processes.doUpdates = True
+    processes.minUpdateInterval = 10
+
+    device.processes = [("100", "first")]
+    if processes.FindPid("100").name != "first" or device.psCount != 1:
+      raise Exception("expected one ps run, actual %s" % device.psCount)
+
+    # Unknown pids within minUpdateInterval are batched up without running ps.
+    device.now = 1005
+    device.processes = [("100", "first"), ("200", "second")]
+    second = processes.FindPid("200")
+    dead = processes.FindPid("300")
+    if second.name or dead.name or processes.FindPid("200") is not second:
+      raise Exception("expected pending pids, actual %s %s" % (second, dead))
+    if device.psCount != 1 or sorted(processes._pendingPids) != ["200", "300"]:
+      raise Exception("expected no ps run, actual %s" % device.psCount)
+
+    # The next ps run fills in the objects already handed out.
+    device.now = 1010
+    if not processes.UpdateProcesses() or device.psCount != 2:
+      raise Exception("expected a second ps run, actual %s" % device.psCount)
+    if second.name != "second" or processes.FindPid("200") is not second:
+      raise Exception("expected the pending process to be updated, actual %s" % second)
+    if dead.name or processes.FindPid("300") is not dead or processes._pendingPids:
+      raise Exception("expected the dead process to be kept, actual %s" % dead)
+    if device.psCount != 2:
+      raise Exception("expected no more ps runs, actual %s" % device.psCount)
+  finally:
+    ps.subprocess.check_output, ps.time.time = check_output, now
+
+
 def test_update():
   """Requires an attached device."""
   processes = ps.ProcessSet()
@@ -87,6 +145,7 @@ def test_update():
 def main():
   #test_uids()
   #test_pids()
+  test_rateLimitedUpdates()
   test_update()
 
 
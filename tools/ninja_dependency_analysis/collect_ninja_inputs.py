@@ -23,50 +23,115 @@ import sys
 import xml.etree.ElementTree as ET
 from collections import OrderedDict
 from operator import itemgetter
+from input_closure import InputClosure
 from ninja_metrics_proto import ninja_metrics
 
-def build_cmd(ninja_binary, ninja_file, target, exempted_file_list):
-    cmd = [ninja_binary, '-f', ninja_file, '-t', 'inputs']
+try:
+    import ninja
+except ImportError:
+    # Not built with Soong: use the parser from the source tree.
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    '..', '..', 'vndk', 'tools', 'sourcedr',
+                                    'ninja'))
+    import ninja
+
+
+def read_exempted_files(exempted_file_list):
+    exempted_files = []
     if exempted_file_list and exempted_file_list.exists():
         with open(exempted_file_list) as fin:
             for l in map(str.strip, fin.readlines()):
                 if l and not l.startswith('#'):
-                    cmd.extend(['-e', l])
+                    exempted_files.append(l)
+    return exempted_files
+
+
+def build_cmd(ninja_binary, ninja_file, target, exempted_file_list):
+    cmd = [ninja_binary, '-f', ninja_file, '-t', 'inputs']
+    for l in read_exempted_files(exempted_file_list):
+        cmd.extend(['-e', l])
     cmd.append(target)
 
     return cmd
 
 
 def count_project(projects, input_files):
+    """Counts the input files under each project.
+
+    A file is counted for every project whose path is a prefix of the file's
+    directory, which is looked up in a trie of the project path components.
+    """
+    # Each node maps a path component to its child node. A node ending a
+    # project path maps None to the project path.
+    trie = dict()
+    for p in projects:
+        node = trie
+        for component in p.split(os.path.sep):
+            node = node.setdefault(component, dict())
+        node[None] = p
+
+    file_counts = dict()
+    for f in input_files:
+        node = trie
+        # The last component is the file name, which cannot be a project.
+        for component in f.split(os.path.sep)[:-1]:
+            node = node.get(component)
+            if node is None:
+                break
+            if None in node:
+                file_counts[node[None]] = file_counts.get(node[None], 0) + 1
+
+    # Keep the order of the projects list for projects with the same count.
     project_count = dict()
     for p in projects:
-        file_count = sum(f.startswith(p + os.path.sep) for f in input_files)
-        if file_count > 0:
-            project_count[p] = file_count
+        if p in file_counts and p not in project_count:
+            project_count[p] = file_counts[p]
 
     return dict(sorted(project_count.items(), key=itemgetter(1), reverse=True))
 
 
+def collect_result(input_files, projects):
+    result = dict()
+    result['input_files'] = input_files
+
+    if projects:
+        project_to_count = count_project(projects, input_files)
+        result['project_count'] = project_to_count
+        result['total_project_count'] = len(project_to_count)
+
+    result['total_input_count'] = len(input_files)
+    return result
+
+
+def write_result(result, out):
+    with open(os.path.join(out.parent, out.name + '.json'), 'w') as json_file:
+        json.dump(result, json_file, indent=2)
+    with open(os.path.join(out.parent, out.name + '.pb'), 'wb') as pb_file:
+        pb_file.write(ninja_metrics.generate_proto(result).SerializeToString())
+
+
 parser = argparse.ArgumentParser()
 
-parser.add_argument('-n', '--ninja_binary', type=pathlib.Path, required=True)
+parser.add_argument('-n', '--ninja_binary', type=pathlib.Path,
+                    help='ninja binary to run `ninja -t inputs` with. If '
+                         'not set, the ninja file is parsed in-process.')
 parser.add_argument('-f', '--ninja_file', type=pathlib.Path, required=True)
-parser.add_argument('-t', '--target', type=str, required=True)
+parser.add_argument('-d', '--ninja_deps', type=pathlib.Path,
+                    help='.ninja_deps file; when set, depfile dependencies '
+                         'are included in the in-process inputs')
+parser.add_argument('-t', '--target', type=str, required=True,
+                    action='append',
+                    help='can be repeated; with several targets, the output '
+                         'is one result per target')
 parser.add_argument('-e', '--exempted_file_list', type=pathlib.Path)
-parser.add_argument('-o', '--out', type=pathlib.Path)
+parser.add_argument('-o', '--out', type=pathlib.Path,
+                    help='writes OUT.json and OUT.pb, or OUT_TARGET.json '
+                         'and OUT_TARGET.pb for each of several targets')
 group = parser.add_mutually_exclusive_group()
 group.add_argument('-r', '--repo_project_list', type=pathlib.Path)
 group.add_argument('-m', '--repo_manifest', type=pathlib.Path)
 args = parser.parse_args()
 
-input_files = sorted(
-    subprocess.check_output(
-        build_cmd(args.ninja_binary, args.ninja_file, args.target,
-                  args.exempted_file_list), text=True).strip().split('\n'))
-
-result = dict()
-result['input_files'] = input_files
-
 projects = None
 if args.repo_project_list and args.repo_project_list.exists():
     with open(args.repo_project_list) as fin:
@@ -77,17 +142,39 @@ elif args.repo_manifest and args.repo_manifest.exists():
         for p in ET.parse(args.repo_manifest).getroot().findall('project')
     ]
 
-if projects:
-    project_to_count = count_project(projects, input_files)
-    result['project_count'] = project_to_count
-    result['total_project_count'] = len(project_to_count)
-
-result['total_input_count'] = len(input_files)
+closure = None
+if not args.ninja_binary:
+    manifest = ninja.Parser().parse(
+        str(args.ninja_file), 'utf-8',
+        str(args.ninja_deps) if args.ninja_deps else None)
+    closure = InputClosure(manifest,
+                           read_exempted_files(args.exempted_file_list),
+                           with_depfile_ins=bool(args.ninja_deps))
+    del manifest
+
+results = OrderedDict()
+for target in args.target:
+    if closure:
+        try:
+            input_files = sorted(closure.inputs(target))
+        except KeyError:
+            sys.exit('error: unknown target ' + target)
+    else:
+        input_files = sorted(
+            subprocess.check_output(
+                build_cmd(args.ninja_binary, args.ninja_file, target,
+                          args.exempted_file_list),
+                text=True).strip().split('\n'))
+    results[target] = collect_result(input_files, projects)
 
 if args.out:
-    with open(os.path.join(args.out.parent, args.out.name + '.json'), 'w') as json_file:
-        json.dump(result, json_file, indent=2)
-    with open(os.path.join(args.out.parent, args.out.name + '.pb'), 'wb') as pb_file:
-        pb_file.write(ninja_metrics.generate_proto(result).SerializeToString())
+    if len(results) == 1:
+        write_result(results[args.target[0]], args.out)
+    else:
+        for target, result in results.items():
+            write_result(result, args.out.with_name(
+                args.out.name + '_' + target.replace(os.path.sep, '_')))
+elif len(results) == 1:
+    print(json.dumps(results[args.target[0]], indent=2))
 else:
-    print(json.dumps(result, indent=2))
+    print(json.dumps(results, indent=2))
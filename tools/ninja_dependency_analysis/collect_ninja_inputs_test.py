@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2022 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import shutil
+import subprocess
+import unittest
+
+import ninja
+from input_closure import InputClosure
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'testdata')
+NINJA_FILE = os.path.join(TEST_DATA_DIR, 'build.ninja')
+
+# The inputs listed by `ninja -t inputs` for the targets of NINJA_FILE.
+EXPECTED_INPUTS = {
+    'gen/tool': ['tool.c'],
+    'gen/config.h': ['config.in', 'gen/tool', 'tool.c'],
+    'generated': ['config.in', 'gen/tool', 'tool.c'],
+    'obj/a.o': ['config.in', 'gen/tool', 'generated', 'src/a.c', 'src/a.h',
+                'tool.c'],
+    'bin/app': ['config.in', 'gen/config.h', 'gen/tool', 'generated', 'libs',
+                'obj/a.o', 'obj/b.o', 'src/a.c', 'src/a.h', 'src/b.c',
+                'src/b.h', 'tool.c'],
+    'docs': [],
+    'all': ['config.in', 'gen/config.h', 'gen/tool', 'generated', 'libs',
+            'obj/a.o', 'obj/b.o', 'src/a.c', 'src/a.h', 'src/b.c', 'src/b.h',
+            'tool.c'],
+}
+
+
+def parse_manifest():
+    return ninja.Parser().parse(NINJA_FILE, 'utf-8')
+
+
+class InputClosureTest(unittest.TestCase):
+    def test_inputs(self):
+        closure = InputClosure(parse_manifest())
+        for target, expected in EXPECTED_INPUTS.items():
+            self.assertEqual(sorted(closure.inputs(target)), expected,
+                             target)
+
+    def test_memo(self):
+        # Closures reused from earlier targets give the same inputs as a
+        # fresh traversal.
+        manifest = parse_manifest()
+        closure = InputClosure(manifest)
+        for target in reversed(list(EXPECTED_INPUTS)):
+            self.assertEqual(closure.inputs(target),
+                             InputClosure(manifest).inputs(target), target)
+
+    def test_exempted_files(self):
+        closure = InputClosure(parse_manifest(), ['gen/config.h', 'src/a.h'])
+        self.assertEqual(sorted(closure.inputs('obj/b.o')),
+                         ['src/b.c', 'src/b.h'])
+        self.assertEqual(sorted(closure.inputs('obj/a.o')),
+                         ['generated', 'src/a.c'])
+
+    def test_unknown_target(self):
+        with self.assertRaises(KeyError):
+            InputClosure(parse_manifest()).inputs('src/a.c')
+
+    def test_ninja_tool(self):
+        ninja_binary = shutil.which('ninja')
+        if not ninja_binary:
+            self.skipTest('ninja is not installed')
+        version = subprocess.check_output([ninja_binary, '--version'],
+                                          text=True)
+        if tuple(map(int, re.findall(r'\d+', version)[:2])) >= (1, 12):
+            self.skipTest('ninja 1.12 changed the output of -t inputs')
+
+        closure = InputClosure(parse_manifest())
+        for target in EXPECTED_INPUTS:
+            output = subprocess.check_output(
+                [ninja_binary, '-f', NINJA_FILE, '-t', 'inputs', target],
+                text=True)
+            self.assertEqual(sorted(closure.inputs(target)),
+                             sorted(output.split()), target)
+
+
+if __name__ == '__main__':
+    unittest.main()
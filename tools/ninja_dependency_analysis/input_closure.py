@@ -0,0 +1,79 @@
+# Copyright (C) 2022 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+
+
+class InputClosure:
+    """Computes `ninja -t inputs` for many targets from one parsed manifest.
+
+    The closure of every requested target is memoized, and reused as is when
+    the traversal of a later target reaches it, so targets that depend on
+    each other are only walked once.
+    """
+
+    def __init__(self, manifest, exempted_files=(), with_depfile_ins=False):
+        self._graph = {}
+        for build in manifest.builds:
+            for path in itertools.chain(build.explicit_outs,
+                                        build.implicit_outs):
+                self._graph[path] = build
+        self._exempted = set(exempted_files)
+        self._with_depfile_ins = with_depfile_ins
+        self._memo = {}
+
+    def _inputs(self, build):
+        inputs = itertools.chain(build.explicit_ins, build.implicit_ins,
+                                 build.prerequisites)
+        if self._with_depfile_ins:
+            inputs = itertools.chain(inputs, build.depfile_implicit_ins)
+        return inputs
+
+    def inputs(self, target):
+        """Returns the set of all transitive inputs of target.
+
+        Exempted files are neither listed nor traversed.
+
+        Raises:
+            KeyError if no build statement outputs target.
+        """
+        root = self._graph[target]
+        result = self._memo.get(root)
+        if result is not None:
+            return result
+        result = set()
+        visited = {root}
+        stack = [root]
+        while stack:
+            build = stack.pop()
+            # Like `ninja -t inputs`, the inputs of phony edges are
+            # traversed but not listed.
+            phony = build.rule == 'phony'
+            for path in self._inputs(build):
+                if path in self._exempted:
+                    continue
+                if not phony:
+                    result.add(path)
+                dep = self._graph.get(path)
+                if dep is None or dep in visited:
+                    continue
+                visited.add(dep)
+                memo = self._memo.get(dep)
+                if memo is not None:
+                    result.update(memo)
+                else:
+                    stack.append(dep)
+        result = frozenset(result)
+        self._memo[root] = result
+        return result
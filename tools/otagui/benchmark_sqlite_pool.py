@@ -0,0 +1,131 @@
+"""
+Benchmark concurrent requests to the build database of the web server.
+
+Several threads look builds up by path, as GET /check/<id> and job
+creation do, and list the builds every few lookups, as GET /file does.
+The database is populated with fake builds unless it exists already, so
+a copy of a real target/ota_database.db can be measured as well.
+
+Usage::
+  python3 benchmark_sqlite_pool.py [--db <path>] [--builds <n>]
+      [--threads <n>] [--lookups <n>] [--list-every <n>] [--page-size <n>]
+      [--unpooled]
+
+--unpooled opens a new connection in the default journal mode for every
+request and drops the Builds.Path index, like the web server did before
+the connections were pooled. --page-size 0 lists all the builds at once.
+"""
+
+import argparse
+import contextlib
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from target_lib import TargetLib
+
+
+class UnpooledConnections:
+    """
+    Open a new connection for every request, like the web server did before
+    the connections were pooled.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    @contextlib.contextmanager
+    def connection(self):
+        connect = sqlite3.connect(self.db_path)
+        try:
+            with connect:
+                yield connect
+        finally:
+            connect.close()
+
+
+def populate(target_lib, builds):
+    """
+    Insert fake builds into the database of target_lib
+    """
+    rows = [('build{}.zip'.format(i), i,
+             os.path.join('target', 'build{}.zip'.format(i)), 'ID', str(i),
+             'flavor', 'system,vendor', 0, 0, None)
+            for i in range(builds)]
+    with target_lib.pool.connection() as connect:
+        connect.executemany("""
+        INSERT INTO Builds (FileName, UploadTime, Path, BuildID, BuildVersion, BuildFlavor, Partitions, FileSize, FileMtime, ContentHash)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+
+
+def run_requests(target_lib, paths, lookups, list_every, page_size, seed):
+    """
+    Look up random builds by path, and list the builds every list_every
+    lookups
+    """
+    rand = random.Random(seed)
+    for i in range(lookups):
+        target_lib.get_build_by_path(rand.choice(paths))
+        if list_every and i % list_every == 0:
+            if page_size:
+                target_lib.get_builds(page_size, rand.randrange(len(paths)))
+            else:
+                target_lib.get_builds()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--db', default='benchmark_ota_database.db',
+                        help='the database, populated if it does not exist')
+    parser.add_argument('--builds', type=int, default=20000,
+                        help='the number of fake builds to populate')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--lookups', type=int, default=2000,
+                        help='the number of lookups by path of each thread')
+    parser.add_argument('--list-every', type=int, default=20,
+                        help='list the builds every n lookups, 0 to never')
+    parser.add_argument('--page-size', type=int, default=100,
+                        help='the builds listed at once, 0 for all')
+    parser.add_argument('--unpooled', action='store_true',
+                        help='open a new connection for every request')
+    args = parser.parse_args()
+
+    populated = os.path.exists(args.db)
+    target_lib = TargetLib(working_dir='target', db_path=args.db)
+    if not populated:
+        populate(target_lib, args.builds)
+    with target_lib.pool.connection() as connect:
+        paths = [row[0] for row in connect.execute(
+            "SELECT Path FROM Builds").fetchall()]
+        if args.unpooled:
+            connect.execute("DROP INDEX IF EXISTS BuildsPath")
+    if args.unpooled:
+        target_lib.pool.close()
+        with contextlib.closing(sqlite3.connect(args.db)) as connect:
+            connect.execute("PRAGMA journal_mode=DELETE")
+        target_lib.pool = UnpooledConnections(args.db)
+    if not paths:
+        parser.error('{} has no builds'.format(args.db))
+
+    threads = [threading.Thread(target=run_requests, args=(
+        target_lib, paths, args.lookups, args.list_every, args.page_size, i))
+        for i in range(args.threads)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    requests = args.threads * args.lookups
+    if args.list_every:
+        requests += args.threads * -(-args.lookups // args.list_every)
+    print('{} requests on {} builds from {} threads in {:.2f}s, {:.0f}/s'.format(
+        requests, len(paths), args.threads, elapsed, requests / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,11 @@ import subprocess
 import os
 import pipes
 import threading
+import json
 from dataclasses import dataclass, asdict, field
 import logging
-import sqlite3
 import time
+from sqlite_pool import ConnectionPool
 
 
 @dataclass
@@ -28,6 +29,7 @@ class JobInfo:
     finish_time: int = 0
     isPartial: bool = False
     isIncremental: bool = False
+    priority: int = 0
 
     def __post_init__(self):
 
@@ -52,7 +54,7 @@ class JobInfo:
             id: string, target: string, incremental: string, verbose: int,
             partial: string, output:string, status:string,
             downgrade: bool, extra: string, stdout: string, stderr:string,
-            start_time:int, finish_time: int(not required)
+            start_time:int, finish_time: int(not required), priority: int
         """
         sql_form_dict = asdict(self)
         sql_form_dict['partial'] = ','.join(sql_form_dict['partial'])
@@ -121,20 +123,32 @@ class ProcessesManagement:
             raise DependencyError(
                 "zip command not found in PATH. Attempt to generate OTA might fail. " + str(e))
 
-    def __init__(self, *, working_dir='output', db_path=None, otatools_dir=None):
+    # The columns of a job, in the order of the fields of JobInfo
+    JOB_COLUMNS = """
+        ID, TargetPath, IncrementalPath, Verbose, Partial, OutputPath, Status,
+        Downgrade, OtherFlags, STDOUT, STDERR, StartTime, FinishTime"""
+
+    def __init__(self, *, working_dir='output', db_path=None, otatools_dir=None,
+                 max_workers=2, ota_generator='ota_from_target_files'):
         """
-        create a table if not exist
+        create a table if not exist, and start max_workers threads, which run
+        the queued jobs one at a time each
+        Args:
+            max_workers: the maximum number of OTA generations running at once
+            ota_generator: the command generating OTA packages
         """
         ProcessesManagement.check_external_dependencies()
         self.working_dir = working_dir
         self.logs_dir = os.path.join(working_dir, 'logs')
         self.otatools_dir = otatools_dir
+        self.ota_generator = ota_generator
         os.makedirs(self.working_dir, exist_ok=True)
         os.makedirs(self.logs_dir, exist_ok=True)
         if not db_path:
             db_path = os.path.join(self.working_dir, "ota_database.db")
         self.path = db_path
-        with sqlite3.connect(self.path) as connect:
+        self.pool = ConnectionPool(self.path)
+        with self.pool.connection() as connect:
             cursor = connect.cursor()
             cursor.execute("""
                 CREATE TABLE if not exists Jobs (
@@ -150,22 +164,67 @@ class ProcessesManagement:
                 STDOUT TEXT,
                 STDERR TEXT,
                 StartTime INTEGER,
-                FinishTime INTEGER
+                FinishTime INTEGER,
+                Priority INTEGER DEFAULT 0,
+                Command TEXT
             )
             """)
+            # Add the columns of the job queue to databases created before
+            cursor.execute("PRAGMA table_info(Jobs)")
+            columns = [column[1] for column in cursor.fetchall()]
+            if 'Priority' not in columns:
+                cursor.execute(
+                    "ALTER TABLE Jobs ADD COLUMN Priority INTEGER DEFAULT 0")
+            if 'Command' not in columns:
+                cursor.execute("ALTER TABLE Jobs ADD COLUMN Command TEXT")
+            cursor.execute("""
+                CREATE INDEX if not exists JobsID ON Jobs (ID)
+            """)
+            cursor.execute("""
+                CREATE INDEX if not exists JobsQueue ON Jobs (Status, Priority)
+            """)
+            # The processes of the jobs running when the server stopped are
+            # gone, and their output might be partial. Do not run them again
+            # behind the back of the user, who can submit them again.
+            cursor.execute("""
+                UPDATE Jobs SET Status='Interrupted', FinishTime=(?)
+                WHERE Status='Running'
+            """, (int(time.time()),))
+        self.max_workers = max_workers
+        self.processes = {}
+        self.cancelled = set()
+        self.queue_condition = threading.Condition()
+        self.stopped = False
+        self.workers = [
+            threading.Thread(target=self.worker, daemon=True)
+            for _ in range(max_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        """
+        Stop the workers once their running jobs finish
+        """
+        with self.queue_condition:
+            self.stopped = True
+            self.queue_condition.notify_all()
+        for worker in self.workers:
+            worker.join()
 
-    def insert_database(self, job_info):
+    def insert_database(self, job_info, command=None):
         """
         Insert the job_info into the database
         Args:
             job_info: JobInfo
+            command: the command to run the job, if it is queued
         """
-        with sqlite3.connect(self.path) as connect:
+        with self.pool.connection() as connect:
             cursor = connect.cursor()
             cursor.execute("""
-                    INSERT INTO Jobs (ID, TargetPath, IncrementalPath, Verbose, Partial, OutputPath, Status, Downgrade, OtherFlags, STDOUT, STDERR, StartTime, Finishtime)
-                    VALUES (:id, :target, :incremental, :verbose, :partial, :output, :status, :downgrade, :extra, :stdout, :stderr, :start_time, :finish_time)
-                """, job_info.to_sql_form_dict())
+                    INSERT INTO Jobs (ID, TargetPath, IncrementalPath, Verbose, Partial, OutputPath, Status, Downgrade, OtherFlags, STDOUT, STDERR, StartTime, Finishtime, Priority, Command)
+                    VALUES (:id, :target, :incremental, :verbose, :partial, :output, :status, :downgrade, :extra, :stdout, :stderr, :start_time, :finish_time, :priority, :command)
+                """, dict(job_info.to_sql_form_dict(),
+                          command=json.dumps(command) if command else None))
 
     def get_status_by_ID(self, id):
         """
@@ -175,33 +234,84 @@ class ProcessesManagement:
         Return:
             JobInfo
         """
-        with sqlite3.connect(self.path) as connect:
+        with self.pool.connection() as connect:
             cursor = connect.cursor()
             logging.info(id)
             cursor.execute("""
-            SELECT ID, TargetPath, IncrementalPath, Verbose, Partial, OutputPath, Status, Downgrade, OtherFlags, STDOUT, STDERR, StartTime, FinishTime
+            SELECT {}, Priority
             FROM Jobs WHERE ID=(?)
-            """, (str(id),))
+            """.format(self.JOB_COLUMNS), (str(id),))
             row = cursor.fetchone()
-        status = JobInfo(*row)
+        status = JobInfo(*row[:-1], priority=row[-1])
         return status
 
-    def get_status(self):
+    def get_status(self, limit=None, offset=0):
         """
-        Return the status of all jobs as a list of JobInfo
+        Return the status of all jobs as a list of JobInfo, in the order they
+        were submitted
+        Args:
+            limit: the maximum number of jobs to return, or None for all
+            offset: the number of jobs to skip
         Return:
             List[JobInfo]
         """
-        with sqlite3.connect(self.path) as connect:
+        with self.pool.connection() as connect:
             cursor = connect.cursor()
             cursor.execute("""
-            SELECT ID, TargetPath, IncrementalPath, Verbose, Partial, OutputPath, Status, Downgrade, OtherFlags, STDOUT, STDERR, StartTime, FinishTime
-            FROM Jobs
-            """)
+            SELECT {}, Priority
+            FROM Jobs ORDER BY rowid LIMIT (?) OFFSET (?)
+            """.format(self.JOB_COLUMNS), (-1 if limit is None else limit, offset))
             rows = cursor.fetchall()
-        statuses = [JobInfo(*row) for row in rows]
+        statuses = [JobInfo(*row[:-1], priority=row[-1]) for row in rows]
         return statuses
 
+    def get_progress(self, id):
+        """
+        Return the progress of job <id>
+        Args:
+            id: string
+        Return:
+            A dict of the status, the number of queued jobs which will run
+            before this one, the seconds it has been running for, and the
+            last line it logged, or None if there is no job <id>
+        """
+        with self.pool.connection() as connect:
+            cursor = connect.cursor()
+            cursor.execute("""
+            SELECT Status, Priority, rowid, StartTime, STDOUT, STDERR
+            FROM Jobs WHERE ID=(?)
+            """, (str(id),))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            status, priority, rowid, start_time, stdout, stderr = row
+            queue_position = None
+            if status == 'Queued':
+                cursor.execute("""
+                SELECT COUNT(*) FROM Jobs WHERE Status='Queued' AND
+                (Priority>(?) OR (Priority=(?) AND rowid<(?)))
+                """, (priority, priority, rowid))
+                queue_position = cursor.fetchone()[0]
+        progress = {
+            'id': id,
+            'status': status,
+            'queue_position': queue_position,
+            'elapsed_time': int(time.time()) - start_time
+            if status == 'Running' else None,
+            'last_output': '',
+        }
+        # Both logs are written to by ota_run
+        for log_path in [stdout, stderr]:
+            try:
+                with open(log_path, 'rb') as log:
+                    log.seek(max(0, os.path.getsize(log_path) - 4096))
+                    lines = log.read().decode(errors='replace').splitlines()
+            except OSError:
+                continue
+            if lines:
+                progress['last_output'] = lines[-1]
+        return progress
+
     def update_status(self, id, status, finish_time):
         """
         Change the status and finish time of job <id> in the database
@@ -210,7 +320,7 @@ class ProcessesManagement:
             status: string
             finish_time: int
         """
-        with sqlite3.connect(self.path) as connect:
+        with self.pool.connection() as connect:
             cursor = connect.cursor()
             cursor.execute("""
                 UPDATE Jobs SET Status=(?), FinishTime=(?)
@@ -218,23 +328,104 @@ class ProcessesManagement:
                 """,
                            (status, finish_time, id))
 
+    def claim_job(self):
+        """
+        Mark the next queued job as running, by priority then in the order
+        of submission
+        Return:
+            (command, id, stdout path, stderr path) of the job, which are
+            the arguments of ota_run, or None if no job is queued
+        """
+        with self.pool.connection() as connect:
+            cursor = connect.cursor()
+            # Take the write lock first, so that a job is claimed only once
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+            SELECT ID, Command, STDOUT, STDERR FROM Jobs WHERE Status='Queued'
+            ORDER BY Priority DESC, rowid LIMIT 1
+            """)
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            cursor.execute("""
+                UPDATE Jobs SET Status='Running', StartTime=(?)
+                WHERE ID=(?) AND Status='Queued'
+                """, (int(time.time()), row[0]))
+        id, command, stdout, stderr = row
+        return json.loads(command), id, stdout, stderr
+
+    def worker(self):
+        """
+        Run the queued jobs until stop() is called
+        """
+        while True:
+            with self.queue_condition:
+                if self.stopped:
+                    return
+                job = self.claim_job()
+                if job is None:
+                    self.queue_condition.wait()
+                    continue
+            try:
+                self.ota_run(*job)
+            except Exception:
+                # ota_run marked the job as failed, keep serving the queue
+                pass
+
+    def cancel(self, id):
+        """
+        Cancel job <id> if it is queued or running
+        Return:
+            True if the job was cancelled
+        """
+        with self.queue_condition:
+            with self.pool.connection() as connect:
+                cursor = connect.cursor()
+                cursor.execute("""
+                    UPDATE Jobs SET Status='Cancelled', FinishTime=(?)
+                    WHERE ID=(?) AND Status='Queued'
+                    """, (int(time.time()), id))
+                if cursor.rowcount:
+                    return True
+                cursor.execute("""
+                    SELECT Status FROM Jobs WHERE ID=(?)
+                    """, (id,))
+                row = cursor.fetchone()
+            if row is None or row[0] != 'Running':
+                return False
+            self.cancelled.add(id)
+            # The job might be claimed but not started yet, then ota_run
+            # does not start it
+            proc = self.processes.get(id)
+        if proc:
+            proc.terminate()
+        return True
+
     def ota_run(self, command, id, stdout_path, stderr_path):
         """
-        Initiate a subprocess to run the ota generation. Wait until it finished and update
+        Run the ota generation in a subprocess. Wait until it finished and update
         the record in the database.
         """
         stderr_pipes = pipes.Template()
         stdout_pipes = pipes.Template()
         ferr = stderr_pipes.open(stdout_path, 'w')
         fout = stdout_pipes.open(stderr_path, 'w')
-        env = {}
+        # The generator needs the environment of the server, e.g. PATH to
+        # find java and zip
+        env = dict(os.environ)
         if self.otatools_dir:
             env['PATH'] = os.path.join(
                 self.otatools_dir, "bin") + ":" + os.environ["PATH"]
         # TODO(lishutong): Enable user to use self-defined stderr/stdout path
         try:
-            proc = subprocess.Popen(
-                command, stderr=ferr, stdout=fout, shell=False, env=env, cwd=self.otatools_dir)
+            with self.queue_condition:
+                if id in self.cancelled:
+                    self.cancelled.remove(id)
+                    self.update_status(id, 'Cancelled', int(time.time()))
+                    return
+                proc = subprocess.Popen(
+                    command, stderr=ferr, stdout=fout, shell=False, env=env, cwd=self.otatools_dir)
+                self.processes[id] = proc
         except FileNotFoundError as e:
             logging.error('ota_from_target_files is not set properly %s', e)
             self.update_status(id, 'Error', int(time.time()))
@@ -243,28 +434,35 @@ class ProcessesManagement:
             logging.error('Failed to execute ota_from_target_files %s', e)
             self.update_status(id, 'Error', int(time.time()))
             raise
+        finally:
+            ferr.close()
+            fout.close()
 
-        def wait_result():
-            exit_code = proc.wait()
-            if exit_code == 0:
+        exit_code = proc.wait()
+        with self.queue_condition:
+            del self.processes[id]
+            if id in self.cancelled:
+                self.cancelled.remove(id)
+                self.update_status(id, 'Cancelled', int(time.time()))
+            elif exit_code == 0:
                 self.update_status(id, 'Finished', int(time.time()))
             else:
                 self.update_status(id, 'Error', int(time.time()))
-        threading.Thread(target=wait_result).start()
 
     def ota_generate(self, args, id):
         """
-        Read in the arguments from the frontend and start running the OTA
-        generation process, then update the records in database.
+        Read in the arguments from the frontend and queue the OTA generation
+        process, then update the records in database.
         Format of args:
             output: string, extra_keys: List[string], extra: string,
             isIncremental: bool, isPartial: bool, partial: List[string],
-            incremental: string, target: string, verbose: bool
+            incremental: string, target: string, verbose: bool,
+            priority: int(not required, higher runs first)
         args:
             args: dict
             id: string
         """
-        command = ['ota_from_target_files']
+        command = [self.ota_generator]
         # Check essential configuration is properly set
         if not os.path.isfile(args['target']):
             raise FileNotFoundError
@@ -296,14 +494,16 @@ class ProcessesManagement:
                            partial=args['partial'] if args['isPartial'] else [
                            ],
                            output=args['output'],
-                           status='Running',
+                           status='Queued',
                            extra=args['extra'],
                            start_time=int(time.time()),
                            stdout=stdout,
-                           stderr=stderr
+                           stderr=stderr,
+                           priority=int(args.get('priority', 0))
                            )
-        self.ota_run(command, id, job_info.stdout, job_info.stderr)
-        self.insert_database(job_info)
+        with self.queue_condition:
+            self.insert_database(job_info, command)
+            self.queue_condition.notify()
         logging.info(
-            'Starting generating OTA package with id {}: \n {}'
+            'Queued generating OTA package with id {}: \n {}'
             .format(id, command))
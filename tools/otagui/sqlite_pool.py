@@ -0,0 +1,76 @@
+import contextlib
+import queue
+import sqlite3
+import threading
+
+
+class ConnectionPool:
+    """
+    A pool of sqlite connections to one database in WAL mode, shared by all
+    the threads of the web server.
+    Each connection is used by one thread at a time, so that readers do not
+    wait for each other, and only writers contend on the database lock.
+    Every owner of a database creates its own pool, so that a database which
+    is deleted or replaced is reopened by the next owner.
+    """
+
+    def __init__(self, db_path, size=8, timeout=30):
+        """
+        Args:
+            db_path: the path of the database
+            size: the maximum number of open connections
+            timeout: seconds to wait for the database lock
+        """
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        connect = sqlite3.connect(
+            self.db_path, timeout=self.timeout, check_same_thread=False)
+        connect.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode, NORMAL is still safe against corruption, and avoids a
+        # sync on every commit.
+        connect.execute("PRAGMA synchronous=NORMAL")
+        return connect
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Borrow a connection from the pool.
+        The transaction is committed when the block exits normally, and rolled
+        back if it raises.
+        """
+        self._slots.acquire()
+        try:
+            try:
+                connect = self._idle.get_nowait()
+            except queue.Empty:
+                connect = self._connect()
+            reuse = True
+            try:
+                with connect:
+                    yield connect
+            except sqlite3.DatabaseError:
+                # The connection might be unusable, do not reuse it.
+                reuse = False
+                raise
+            finally:
+                if reuse:
+                    self._idle.put(connect)
+                else:
+                    connect.close()
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """
+        Close all the idle connections.
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -1,11 +1,12 @@
 from dataclasses import dataclass, asdict, field
-import sqlite3
+import hashlib
 import time
 import logging
 import os
 import zipfile
 import re
 import json
+from sqlite_pool import ConnectionPool
 
 
 class BuildFileInvalidError(Exception):
@@ -76,6 +77,30 @@ class BuildInfo:
         return asdict(self)
 
 
+def central_directory_hash(path):
+    """
+    Hash the central directory of a zip file, i.e. the name, CRC and sizes of
+    each entry. It changes whenever the content of the zip changes, but is
+    much faster to compute than a hash of the whole file.
+    """
+    digest = hashlib.sha256()
+    with zipfile.ZipFile(path) as build:
+        for info in build.infolist():
+            digest.update('{}\0{}\0{}\0{}\n'.format(
+                info.filename, info.CRC, info.file_size,
+                info.compress_size).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def file_signature(path):
+    """
+    Return the (size, mtime in ns) of a file, which are compared to tell if
+    a build changed since it was analysed.
+    """
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
 class TargetLib:
     """
     A class that manages the builds in database.
@@ -89,7 +114,8 @@ class TargetLib:
         if db_path is None:
             db_path = os.path.join(working_dir, "ota_database.db")
         self.db_path = db_path
-        with sqlite3.connect(self.db_path) as connect:
+        self.pool = ConnectionPool(self.db_path)
+        with self.pool.connection() as connect:
             cursor = connect.cursor()
             cursor.execute("""
                 CREATE TABLE if not exists Builds (
@@ -99,9 +125,24 @@ class TargetLib:
                 BuildID TEXT,
                 BuildVersion TEXT,
                 BuildFlavor TEXT,
-                Partitions TEXT
+                Partitions TEXT,
+                FileSize INTEGER,
+                FileMtime INTEGER,
+                ContentHash TEXT
             )
             """)
+            # Add the columns of the analysis cache to databases created before
+            cursor.execute("PRAGMA table_info(Builds)")
+            columns = [column[1] for column in cursor.fetchall()]
+            for column, column_type in [('FileSize', 'INTEGER'),
+                                        ('FileMtime', 'INTEGER'),
+                                        ('ContentHash', 'TEXT')]:
+                if column not in columns:
+                    cursor.execute("ALTER TABLE Builds ADD COLUMN {} {}".format(
+                        column, column_type))
+            cursor.execute("""
+                CREATE INDEX if not exists BuildsPath ON Builds (Path)
+            """)
 
     def new_build(self, filename, path):
         """
@@ -117,19 +158,48 @@ class TargetLib:
             build_info.build_flavor, build_info.build_id, build_info.build_version))
         if path != build_info.path:
             os.rename(path, build_info.path)
-        with sqlite3.connect(self.db_path) as connect:
+        file_size, file_mtime = file_signature(build_info.path)
+        with self.pool.connection() as connect:
             cursor = connect.cursor()
             cursor.execute("""
-            SELECT * FROM Builds WHERE FileName=:file_name and Path=:path
+            DELETE FROM Builds WHERE Path=:path
             """, build_info.to_sql_form_dict())
-            if cursor.fetchall():
-                cursor.execute("""
-                DELETE FROM Builds WHERE FileName=:file_name and Path=:path
-                """, build_info.to_sql_form_dict())
             cursor.execute("""
-            INSERT INTO Builds (FileName, UploadTime, Path, BuildID, BuildVersion, BuildFlavor, Partitions)
-            VALUES (:file_name, :time, :path, :build_id, :build_version, :build_flavor, :partitions)
-            """, build_info.to_sql_form_dict())
+            INSERT INTO Builds (FileName, UploadTime, Path, BuildID, BuildVersion, BuildFlavor, Partitions, FileSize, FileMtime, ContentHash)
+            VALUES (:file_name, :time, :path, :build_id, :build_version, :build_flavor, :partitions, :file_size, :file_mtime, :content_hash)
+            """, dict(build_info.to_sql_form_dict(),
+                      file_size=file_size, file_mtime=file_mtime,
+                      content_hash=central_directory_hash(build_info.path)))
+
+    def is_analysed(self, path, cached):
+        """
+        Check if the build at path is the one analysed in the database
+        Args:
+            path: the path of the build
+            cached: the (FileSize, FileMtime, ContentHash) of the build in the
+                database, or None
+        Return:
+            True if the build does not need to be analysed again
+        """
+        if cached is None:
+            return False
+        file_size, file_mtime = file_signature(path)
+        cached_size, cached_mtime, cached_hash = cached
+        if (file_size, file_mtime) == (cached_size, cached_mtime):
+            return True
+        # The file might only be touched or copied, compare its content
+        try:
+            if file_size != cached_size or cached_hash is None or \
+                    central_directory_hash(path) != cached_hash:
+                return False
+        except zipfile.BadZipFile:
+            return False
+        with self.pool.connection() as connect:
+            cursor = connect.cursor()
+            cursor.execute("""
+            UPDATE Builds SET FileMtime=(?) WHERE Path==(?)
+            """, (file_mtime, path))
+        return True
 
     def new_build_from_dir(self):
         """
@@ -139,10 +209,20 @@ class TargetLib:
         """
         build_dir = self.working_dir
         if os.path.isdir(build_dir):
+            # Only the builds which are new or changed since they were
+            # analysed are opened
+            with self.pool.connection() as connect:
+                cursor = connect.cursor()
+                cursor.execute("""
+                SELECT Path, FileSize, FileMtime, ContentHash FROM Builds
+                """)
+                cached_builds = {row[0]: row[1:] for row in cursor.fetchall()}
             builds_name = os.listdir(build_dir)
             for build_name in builds_name:
                 path = os.path.join(build_dir, build_name)
-                if build_name.endswith(".zip") and zipfile.is_zipfile(path):
+                if build_name.endswith(".zip") and \
+                        not self.is_analysed(path, cached_builds.get(path)) and \
+                        zipfile.is_zipfile(path):
                     self.new_build(build_name, path)
         elif os.path.isfile(build_dir) and build_dir.endswith(".zip"):
             self.new_build(os.path.split(build_dir)[-1], build_dir)
@@ -152,18 +232,22 @@ class TargetLib:
         build_info = BuildInfo(*row[:6], row[6].split(','))
         return build_info
 
-    def get_builds(self):
+    def get_builds(self, limit=None, offset=0):
         """
-        Get a list of builds in the database
+        Get a list of builds in the database, in the order they were added
+        Args:
+            limit: the maximum number of builds to return, or None for all
+            offset: the number of builds to skip
         Return:
             A list of build_info, each of which is an object:
             (FileName, UploadTime, Path, Build ID, Build Version, Build Flavor, Partitions)
         """
-        with sqlite3.connect(self.db_path) as connect:
+        with self.pool.connection() as connect:
             cursor = connect.cursor()
             cursor.execute("""
             SELECT FileName, Path, UploadTime, BuildID, BuildVersion, BuildFlavor, Partitions
-            FROM Builds""")
+            FROM Builds ORDER BY rowid LIMIT (?) OFFSET (?)
+            """, (-1 if limit is None else limit, offset))
             return list(map(self.sql_to_buildinfo, cursor.fetchall()))
 
     def get_build_by_path(self, path):
@@ -173,10 +257,11 @@ class TargetLib:
             A build_info, which is an object:
             (FileName, UploadTime, Path, Build ID, Build Version, Build Flavor, Partitions)
         """
-        with sqlite3.connect(self.db_path) as connect:
+        with self.pool.connection() as connect:
             cursor = connect.cursor()
             cursor.execute("""
             SELECT FileName, Path, UploadTime, BuildID, BuildVersion, BuildFlavor, Partitions
             FROM Builds WHERE Path==(?)
             """, (path, ))
-        return self.sql_to_buildinfo(cursor.fetchone())
+            row = cursor.fetchone()
+        return self.sql_to_buildinfo(row)
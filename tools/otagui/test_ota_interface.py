@@ -1,9 +1,12 @@
 import unittest
 from ota_interface import JobInfo, ProcessesManagement
 from unittest.mock import patch, mock_open, Mock, MagicMock
+import json
 import os
+import shutil
 import sqlite3
 import copy
+import time
 
 class TestJobInfo(unittest.TestCase):
     def setUp(self):
@@ -182,14 +185,22 @@ class TestProcessesManagement(unittest.TestCase):
     def setUp(self):
         if os.path.isfile('test_process.db'):
             self.tearDown()
-        self.processes = ProcessesManagement(db_path='test_process.db')
+        # Without workers, the queued jobs stay in the database as they are.
+        self.processes = ProcessesManagement(db_path='test_process.db',
+                                             max_workers=0)
         testcase_job_info = TestJobInfo()
         testcase_job_info.setUp()
         self.test_job_info = testcase_job_info.setup_job(incremental='target/source.zip')
         self.processes.insert_database(self.test_job_info)
 
     def tearDown(self):
-        os.remove('test_process.db')
+        if hasattr(self, 'processes'):
+            self.processes.stop()
+            self.processes.pool.close()
+        for path in ['test_process.db', 'test_process.db-wal',
+                     'test_process.db-shm']:
+            if os.path.isfile(path):
+                os.remove(path)
         try:
             os.remove('output/stderr.'+self.test_job_info.id)
             os.remove('output/stdout.'+self.test_job_info.id)
@@ -298,19 +309,16 @@ class TestProcessesManagement(unittest.TestCase):
         #   [-i incremental_source] [-p partial_list] target output
         test_command = [
             'ota_from_target_files', '-v', '--downgrade',
-            '--wipe_user_data', '--disable_vabc', '-k',
-            'build/make/target/product/security/testkey',
-            '-i', 'target/source.zip',
-            '--partial', 'system vendor', 'target/build.zip', 'ota.zip'
+            '--wipe_user_data', '--disable_vabc',
+            '-i', os.path.realpath('target/source.zip'),
+            '--partial', 'system vendor', os.path.realpath('target/build.zip'),
+            os.path.realpath('ota.zip')
         ]
         mock_os_path_isfile = Mock(return_value=True)
-        mock_threading = Mock()
-        mock_thread = Mock(return_value=mock_threading)
-        with patch("os.path.isfile", mock_os_path_isfile), \
-            patch("threading.Thread", mock_thread):
-                self.processes.ota_generate(test_args, id='test')
+        with patch("os.path.isfile", mock_os_path_isfile):
+            self.processes.ota_generate(test_args, id='test')
         job_info = self.processes.get_status_by_ID('test')
-        self.assertEqual(job_info.status, 'Running',
+        self.assertEqual(job_info.status, 'Queued',
             'The job cannot be stored into database properly'
         )
         # Test if the job stored into database properly
@@ -322,9 +330,130 @@ class TestProcessesManagement(unittest.TestCase):
                 'The column ' + key + ' is not stored into database properly'
             )
         # Test if the command is in its order
-        self.assertEqual(mock_thread.call_args[1]['args'][0], test_command,
+        connect = sqlite3.connect('test_process.db')
+        try:
+            command, = connect.execute(
+                "SELECT Command FROM Jobs WHERE ID='test'").fetchone()
+        finally:
+            connect.close()
+        self.assertEqual(json.loads(command), test_command,
             'The subprocess command is not in its good shape'
         )
 
+class TestJobScheduler(unittest.TestCase):
+    def setUp(self):
+        self.test_path = 'test/test_scheduler.db'
+        self.tearDown()
+        self.processes = self.start(max_workers=2)
+        with open('test/test_scheduler_target.zip', 'wb'):
+            pass
+
+    def start(self, max_workers):
+        with patch.object(ProcessesManagement, 'check_external_dependencies'):
+            return ProcessesManagement(
+                working_dir='test/scheduler_output', db_path=self.test_path,
+                max_workers=max_workers,
+                ota_generator=os.path.realpath('test/stub_ota_from_target_files'))
+
+    def tearDown(self):
+        if hasattr(self, 'processes'):
+            self.processes.stop()
+            self.processes.pool.close()
+        for path in ['test/test_scheduler_target.zip', self.test_path,
+                     self.test_path + '-wal', self.test_path + '-shm']:
+            if os.path.isfile(path):
+                os.remove(path)
+        if os.path.isdir('test/scheduler_output'):
+            shutil.rmtree('test/scheduler_output')
+
+    def submit(self, id, priority=0):
+        self.processes.ota_generate({
+            'output': 'test/scheduler_output/' + id + '.zip',
+            'extra_keys': [],
+            'extra': '',
+            'isIncremental': False,
+            'isPartial': False,
+            'partial': [],
+            'incremental': '',
+            'target': 'test/test_scheduler_target.zip',
+            'verbose': False,
+            'priority': priority,
+        }, id=id)
+
+    def wait_for(self, id, statuses, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            status = self.processes.get_status_by_ID(id).status
+            if status in statuses:
+                return status
+            time.sleep(0.05)
+        self.fail('Job ' + id + ' is still ' + status)
+
+    def test_max_workers(self):
+        with patch.dict(os.environ, {'STUB_OTA_SECONDS': '0.5'}):
+            for i in range(4):
+                self.submit('job' + str(i))
+            self.wait_for('job0', ['Running'])
+            self.wait_for('job1', ['Running'])
+            running = [job.id for job in self.processes.get_status()
+                       if job.status == 'Running']
+            self.assertLessEqual(len(running), 2,
+                'More jobs are running than the worker limit'
+            )
+            progress = self.processes.get_progress('job3')
+            self.assertEqual(progress['status'], 'Queued')
+            self.assertEqual(progress['queue_position'], 1)
+            for i in range(4):
+                self.assertEqual(self.wait_for('job' + str(i), ['Finished']),
+                    'Finished')
+        self.assertTrue(os.path.isfile('test/scheduler_output/job3.zip'),
+            'The output of the job is not generated'
+        )
+
+    def test_priority_and_cancel(self):
+        with patch.dict(os.environ, {'STUB_OTA_SECONDS': '1'}):
+            # Occupy both workers
+            self.submit('busy0')
+            self.submit('busy1')
+            self.wait_for('busy1', ['Running'])
+            self.submit('low', priority=0)
+            self.submit('high', priority=1)
+            self.assertEqual(self.processes.get_progress('high')['queue_position'], 0,
+                'The job with higher priority is not first in the queue'
+            )
+            self.assertTrue(self.processes.cancel('low'))
+            self.assertEqual(self.wait_for('low', ['Cancelled']), 'Cancelled')
+            self.assertTrue(self.processes.cancel('busy0'))
+            self.assertEqual(self.wait_for('busy0', ['Cancelled']), 'Cancelled')
+            self.assertEqual(self.wait_for('high', ['Finished']), 'Finished')
+            self.assertFalse(self.processes.cancel('high'),
+                'A finished job cannot be cancelled'
+            )
+
+    def test_restart(self):
+        # Jobs queued while no worker is running are run after a restart
+        self.processes.stop()
+        self.processes = self.start(max_workers=0)
+        self.submit('queued')
+        self.processes.stop()
+        self.processes = self.start(max_workers=1)
+        self.assertEqual(self.wait_for('queued', ['Finished']), 'Finished')
+
+    def test_restart_running(self):
+        # Jobs running when the server stops are not run again
+        self.processes.stop()
+        self.processes = self.start(max_workers=0)
+        self.submit('running')
+        self.assertIsNotNone(self.processes.claim_job())
+        self.processes.stop()
+        self.processes = self.start(max_workers=1)
+        self.assertEqual(self.processes.get_status_by_ID('running').status,
+            'Interrupted'
+        )
+        self.assertIsNone(self.processes.claim_job())
+
+    def test_progress_unknown_job(self):
+        self.assertIsNone(self.processes.get_progress('unknown'))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,69 @@
+import unittest
+from sqlite_pool import ConnectionPool
+import os
+import sqlite3
+import threading
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.test_path = 'test/test_sqlite_pool.db'
+        self.tearDown()
+        self.pool = ConnectionPool(self.test_path, size=2)
+        with self.pool.connection() as connect:
+            connect.execute("CREATE TABLE Numbers (Value INTEGER)")
+
+    def tearDown(self):
+        if hasattr(self, 'pool'):
+            self.pool.close()
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.isfile(self.test_path + suffix):
+                os.remove(self.test_path + suffix)
+
+    def test_wal_mode(self):
+        with self.pool.connection() as connect:
+            mode = connect.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, 'wal',
+            'The database is not in WAL mode'
+        )
+
+    def test_reuse(self):
+        with self.pool.connection() as connect:
+            first = connect
+        with self.pool.connection() as connect:
+            self.assertIs(connect, first,
+                'The idle connection is not reused'
+            )
+
+    def test_rollback(self):
+        with self.assertRaises(ValueError):
+            with self.pool.connection() as connect:
+                connect.execute("INSERT INTO Numbers VALUES (1)")
+                raise ValueError
+        with self.pool.connection() as connect:
+            count = connect.execute("SELECT COUNT(*) FROM Numbers").fetchone()[0]
+        self.assertEqual(count, 0,
+            'The transaction is not rolled back on errors'
+        )
+
+    def test_concurrent_writes(self):
+        def insert(start):
+            for value in range(start, start + 50):
+                with self.pool.connection() as connect:
+                    connect.execute("INSERT INTO Numbers VALUES (?)", (value,))
+        threads = [threading.Thread(target=insert, args=(i * 50,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Committed data is visible to other connections.
+        with sqlite3.connect(self.test_path) as connect:
+            values = connect.execute("SELECT Value FROM Numbers").fetchall()
+        self.assertEqual(sorted(value for value, in values), list(range(200)),
+            'Concurrent writes are lost'
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
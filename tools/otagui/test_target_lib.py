@@ -4,7 +4,7 @@ from target_lib import BuildInfo, TargetLib
 import zipfile
 import os
 import sqlite3
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 
 class CreateTestBuild():
     def __init__(self, include_build_prop=True, include_ab_partitions=True):
@@ -188,5 +188,73 @@ class TestTargetLib(unittest.TestCase):
         test_build.clean()
 
 
+class TestBuildCache(unittest.TestCase):
+    def setUp(self):
+        self.working_dir = TemporaryDirectory(dir='test/')
+        self.target_build = TargetLib(
+            working_dir=self.working_dir.name,
+            db_path=os.path.join(self.working_dir.name, 'test_cache.db'))
+        path = os.path.join(self.working_dir.name, 'build.zip')
+        with zipfile.ZipFile(path, mode='w') as package:
+            package.write('test/test_build.prop', 'SYSTEM/build.prop')
+            package.write('test/test_ab_partitions.txt',
+                'META/ab_partitions.txt')
+
+    def tearDown(self):
+        self.target_build.pool.close()
+        self.working_dir.cleanup()
+
+    def count_analysis(self):
+        analyse_buildprop = BuildInfo.analyse_buildprop
+        mock_analyse = Mock(side_effect=lambda build_info:
+            analyse_buildprop(build_info), autospec=True)
+        with patch.object(BuildInfo, 'analyse_buildprop',
+                          lambda build_info: mock_analyse(build_info)):
+            builds = self.target_build.new_build_from_dir()
+        return builds, mock_analyse.call_count
+
+    def test_unchanged_build(self):
+        builds, count = self.count_analysis()
+        self.assertEqual((len(builds), count), (1, 1))
+        builds, count = self.count_analysis()
+        self.assertEqual((len(builds), count), (1, 0),
+            'An unchanged build is analysed again'
+        )
+        # Touching the build does not change its content
+        os.utime(builds[0].path, ns=(0, 0))
+        builds, count = self.count_analysis()
+        self.assertEqual((len(builds), count), (1, 0),
+            'A touched build is analysed again'
+        )
+
+    def test_changed_build(self):
+        builds, count = self.count_analysis()
+        with zipfile.ZipFile(builds[0].path, mode='a') as package:
+            package.writestr('IMAGES/system.img', 'new content')
+        builds, count = self.count_analysis()
+        self.assertEqual((len(builds), count), (1, 1),
+            'A changed build is not analysed again'
+        )
+
+    def test_replaced_database(self):
+        self.count_analysis()
+        self.assertEqual(len(self.target_build.get_builds()), 1)
+        db_path = self.target_build.db_path
+        for path in [db_path, db_path + '-wal', db_path + '-shm']:
+            if os.path.isfile(path):
+                os.remove(path)
+        target_build = TargetLib(working_dir=self.working_dir.name,
+                                 db_path=db_path)
+        try:
+            self.assertTrue(os.path.isfile(db_path),
+                'The deleted database is not created again'
+            )
+            self.assertEqual(target_build.get_builds(), [],
+                'A new database returns the builds of the deleted one'
+            )
+        finally:
+            target_build.pool.close()
+
+
 if __name__ == '__main__':
     unittest.main()
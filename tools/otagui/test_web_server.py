@@ -0,0 +1,262 @@
+import unittest
+from unittest import mock
+from web_server import MultipartError, parse_range, stream_multipart_file
+import errno
+import functools
+import hashlib
+import http.client
+import io
+import json
+import os
+import tempfile
+import threading
+import web_server
+
+
+class TestStreamMultipartFile(unittest.TestCase):
+    def setUp(self):
+        self.boundary = b'----WebKitFormBoundary7MA4YWxkTrZu0gW'
+        # Shrink the buffer, so that the terminator spans chunks
+        self.buffer_size = web_server.BUFFER_SIZE
+        web_server.BUFFER_SIZE = 7
+
+    def tearDown(self):
+        web_server.BUFFER_SIZE = self.buffer_size
+
+    def form_data(self, content):
+        return (b'--' + self.boundary + b'\r\n' +
+                b'Content-Disposition: form-data; name="file"; filename="build.zip"\r\n' +
+                b'Content-Type: application/zip\r\n' +
+                b'\r\n' + content + b'\r\n' +
+                b'--' + self.boundary + b'--\r\n')
+
+    def test_stream(self):
+        # The content contains line breaks and a part of the boundary
+        content = b'PK\x03\x04\r\n--' + self.boundary[:10] + b'\r\n' * 5 + b'end'
+        for boundary in [self.boundary, None]:
+            body = self.form_data(content)
+            rfile = io.BytesIO(body + b'next request')
+            output = io.BytesIO()
+            digest = stream_multipart_file(rfile, len(body), boundary, output)
+            self.assertEqual(output.getvalue(), content,
+                'The file content is not extracted correctly'
+            )
+            self.assertEqual(digest.hexdigest(),
+                hashlib.sha256(content).hexdigest())
+            self.assertEqual(rfile.read(), b'next request',
+                'The request body is not consumed exactly'
+            )
+
+    def test_truncated(self):
+        body = self.form_data(b'content')[:-20]
+        with self.assertRaises(MultipartError):
+            stream_multipart_file(io.BytesIO(body), len(body), self.boundary,
+                io.BytesIO())
+
+
+class TestParseRange(unittest.TestCase):
+    def test_parse_range(self):
+        self.assertIsNone(parse_range(None, 100))
+        self.assertEqual(parse_range('bytes=10-19', 100), (10, 19))
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=90-200', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-200', 100), (0, 99))
+        # Multiple or invalid ranges are ignored
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 100))
+        self.assertIsNone(parse_range('bytes=20-10', 100))
+        self.assertIsNone(parse_range('items=0-1', 100))
+        with self.assertRaises(ValueError):
+            parse_range('bytes=100-', 100)
+        # No range of an empty file can be satisfied
+        for range_header in ['bytes=-10', 'bytes=0-', 'bytes=0-10']:
+            with self.assertRaises(ValueError):
+                parse_range(range_header, 0)
+
+
+class FakeLib:
+    """
+    Record the page arguments of the list requests
+    """
+
+    def __init__(self):
+        self.page_args = []
+
+    def get_builds(self, limit=None, offset=0):
+        self.page_args.append((limit, offset))
+        return []
+
+    get_status = get_builds
+
+    def get_progress(self, id):
+        return {'id': id} if id == 'job' else None
+
+
+class ServerTestCase(unittest.TestCase):
+    """
+    Run the request handler on a local server
+    """
+
+    handler_class = web_server.RequestHandler
+
+    def setUp(self):
+        self.server = web_server.ThreadedHTTPServer(
+            ('127.0.0.1', 0), self.handler_class)
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def request(self, method, path, headers={}):
+        """
+        Send a request, return the response and its body
+        """
+        connection = http.client.HTTPConnection(*self.server.server_address)
+        self.addCleanup(connection.close)
+        connection.request(method, path, headers=headers)
+        response = connection.getresponse()
+        return response, response.read()
+
+
+class TestRequestHandler(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.lib = FakeLib()
+        web_server.jobs = web_server.target_lib = self.lib
+        self.addCleanup(delattr, web_server, 'jobs')
+        self.addCleanup(delattr, web_server, 'target_lib')
+
+    def test_page_args(self):
+        for path in ['/check', '/file']:
+            response, body = self.request('GET', path + '?limit=10&offset=5')
+            self.assertEqual(response.status, 200)
+            self.assertEqual(json.loads(body), [])
+            response, _ = self.request('GET', path)
+            self.assertEqual(response.status, 200)
+        self.assertEqual(self.lib.page_args,
+                         [(10, 5), (None, 0), (10, 5), (None, 0)])
+
+    def test_invalid_page_args(self):
+        for path in ['/check', '/file/']:
+            for query in ['limit=ten', 'offset=-1', 'limit=-5', 'limit=',
+                          'offset=1.5']:
+                response, _ = self.request('GET', path + '?' + query)
+                self.assertEqual(response.status, 400, path + '?' + query)
+        self.assertEqual(self.lib.page_args, [])
+
+    def test_progress(self):
+        response, body = self.request('GET', '/progress/job')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(json.loads(body), {'id': 'job'})
+        response, _ = self.request('GET', '/progress/unknown')
+        self.assertEqual(response.status, 404)
+
+
+class TestSendFile(ServerTestCase):
+    # Larger than 4GiB, so that offsets do not fit in 32 bits
+    SPARSE_SIZE = (5 << 30) + 7
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.handler_class = functools.partial(
+            web_server.RequestHandler, directory=self.temp_dir.name)
+        super().setUp()
+        # Only the written bytes of the sparse file take disk space
+        with open(self.path('sparse'), 'wb') as f:
+            f.write(b'head')
+            f.seek(4 << 30)
+            f.write(b'4GiB')
+            f.truncate(self.SPARSE_SIZE - 4)
+            f.seek(0, os.SEEK_END)
+            f.write(b'tail')
+        with open(self.path('small'), 'wb') as f:
+            f.write(bytes(range(100)))
+        open(self.path('empty'), 'wb').close()
+
+    def path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def download(self, name, **headers):
+        return self.request('GET', '/download/' + name, headers=headers)
+
+    def test_ranges(self):
+        size = self.SPARSE_SIZE
+        for range_header, start, body in [
+                ('bytes=0-3', 0, b'head'),
+                ('bytes=-4', size - 4, b'tail'),
+                ('bytes={}-'.format(size - 4), size - 4, b'tail'),
+                ('bytes={}-{}'.format(4 << 30, (4 << 30) + 3), 4 << 30,
+                 b'4GiB')]:
+            response, content = self.download('sparse', Range=range_header)
+            self.assertEqual(response.status, 206, range_header)
+            self.assertEqual(content, body)
+            self.assertEqual(response.getheader('Content-Range'),
+                'bytes {}-{}/{}'.format(start, start + len(body) - 1, size))
+            self.assertEqual(response.getheader('Content-Length'),
+                str(len(body)))
+            self.assertEqual(response.getheader('Accept-Ranges'), 'bytes')
+
+    def test_unsatisfiable(self):
+        response, content = self.download(
+            'sparse', Range='bytes={}-'.format(self.SPARSE_SIZE))
+        self.assertEqual(response.status, 416)
+        self.assertEqual(content, b'')
+        self.assertEqual(response.getheader('Content-Range'),
+            'bytes */{}'.format(self.SPARSE_SIZE))
+        for range_header in ['bytes=-5', 'bytes=0-']:
+            response, content = self.download('empty', Range=range_header)
+            self.assertEqual(response.status, 416, range_header)
+            self.assertEqual(response.getheader('Content-Range'), 'bytes */0')
+
+    def test_whole_file(self):
+        for name, body in [('small', bytes(range(100))), ('empty', b'')]:
+            response, content = self.download(name)
+            self.assertEqual(response.status, 200)
+            self.assertEqual(content, body)
+            self.assertIsNone(response.getheader('Content-Range'))
+        # Multiple ranges are answered with the whole file
+        response, content = self.download('small', Range='bytes=0-1,5-6')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(content, bytes(range(100)))
+
+    def test_if_range(self):
+        response, _ = self.download('small')
+        etag = response.getheader('ETag')
+        last_modified = response.getheader('Last-Modified')
+        self.assertTrue(etag)
+        for validator in [etag, last_modified]:
+            response, content = self.download(
+                'small', Range='bytes=90-', **{'If-Range': validator})
+            self.assertEqual(response.status, 206)
+            self.assertEqual(content, bytes(range(90, 100)))
+
+        # The file changed since the validator was sent
+        with open(self.path('small'), 'ab') as f:
+            f.write(b'more')
+        response, content = self.download(
+            'small', Range='bytes=90-', **{'If-Range': etag})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(content, bytes(range(100)) + b'more')
+        self.assertNotEqual(response.getheader('ETag'), etag)
+
+    def test_sendfile_fallback(self):
+        size = self.SPARSE_SIZE
+        with mock.patch('os.sendfile',
+                        side_effect=OSError(errno.EINVAL, 'Invalid argument')):
+            response, content = self.download(
+                'sparse', Range='bytes={}-'.format(size - 4))
+            self.assertEqual(response.status, 206)
+            self.assertEqual(content, b'tail')
+            response, content = self.download('small')
+            self.assertEqual(content, bytes(range(100)))
+
+    def test_not_found(self):
+        response, _ = self.download('missing')
+        self.assertEqual(response.status, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
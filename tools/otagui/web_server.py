@@ -3,18 +3,24 @@ A local HTTP server for Android OTA package generation.
 Based on OTA_from_target_files.py
 
 Usage::
-  python ./web_server.py [<port>]
+  python ./web_server.py [<port>] [<max number of OTA jobs running at once>]
 
 API::
   GET /check : check the status of all jobs
+  GET /check?limit=<n>&offset=<m> : check the status of n jobs, skipping m
   GET /check/<id> : check the status of the job with <id>
+  GET /progress/<id> : check the queue position, running time and last
+                       output line of the job with <id>
   GET /file : fetch the target file list
+  GET /file?limit=<n>&offset=<m> : fetch n targets of the list, skipping m
   GET /file/<path> : Add build file(s) in <path>, and return the target file list
-  GET /download/<id> : download the ota package with <id>
-  POST /run/<id> : submit a job with <id>,
+  GET /download/<id> : download the ota package with <id>,
+                      a single byte range can be requested with Range/If-Range
+  POST /run/<id> : queue a job with <id>,
                  arguments set in a json uploaded together
-  POST /file/<filename> : upload a target file
-  [TODO] POST /cancel/<id> : cancel a job with <id>
+  POST /file/<filename> : upload a target file as multipart/form-data,
+                          its SHA-256 is returned in the Digest header
+  POST /cancel/<id> : cancel a queued or running job with <id>
 
 TODO:
   - Avoid unintentionally path leakage
@@ -30,12 +36,121 @@ from ota_interface import ProcessesManagement
 from target_lib import TargetLib
 import logging
 import json
+import base64
 import cgi
+import hashlib
 import os
+import re
 import stat
+import tempfile
+import urllib.parse
 import zipfile
 
 LOCAL_ADDRESS = '0.0.0.0'
+BUFFER_SIZE = 1024*1024
+
+
+class MultipartError(Exception):
+    pass
+
+
+def stream_multipart_file(rfile, content_length, boundary, output_file):
+    """
+    Copy the content of the first part of a multipart/form-data body into
+    output_file, without holding more than BUFFER_SIZE bytes in memory.
+    Please refer to the following link for the format of the body:
+    https://datatracker.ietf.org/doc/html/rfc7578
+    Args:
+        rfile: the request body
+        content_length: the length of the request body
+        boundary: the boundary parameter of the Content-Type, bytes, or None
+            to take the first line of the body as the boundary
+        output_file: a binary file the part content is written into
+    Return:
+        The SHA-256 hash object of the part content
+    """
+    remaining = content_length
+
+    def readline():
+        nonlocal remaining
+        line = rfile.readline(min(remaining, 65536))
+        remaining -= len(line)
+        return line
+
+    first_line = readline().rstrip(b'\r\n')
+    delimiter = b'--' + boundary if boundary else first_line
+    if not delimiter.startswith(b'--') or first_line != delimiter:
+        raise MultipartError('The body does not start with the boundary')
+    # Skip the part headers, which end with an empty line
+    while True:
+        line = readline()
+        if not line:
+            raise MultipartError('The part headers are truncated')
+        if line in (b'\r\n', b'\n'):
+            break
+
+    # The part content ends right before CRLF and the next delimiter
+    terminator = b'\r\n' + delimiter
+    digest = hashlib.sha256()
+    buffer = b''
+    while True:
+        if remaining == 0:
+            raise MultipartError('The closing boundary is missing')
+        chunk = rfile.read(min(remaining, BUFFER_SIZE))
+        if not chunk:
+            raise MultipartError('The body is truncated')
+        remaining -= len(chunk)
+        buffer += chunk
+        end = buffer.find(terminator)
+        if end >= 0:
+            content = buffer[:end]
+        else:
+            # Keep the bytes which might be the beginning of the terminator
+            content = buffer[:max(0, len(buffer) - len(terminator) + 1)]
+        output_file.write(content)
+        digest.update(content)
+        if end >= 0:
+            break
+        buffer = buffer[len(content):]
+    # Drain the rest of the body, i.e. the closing delimiter and other parts
+    while remaining:
+        chunk = rfile.read(min(remaining, BUFFER_SIZE))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+    return digest
+
+
+def parse_range(range_header, file_size):
+    """
+    Parse a Range header for a single byte range.
+    Args:
+        range_header: the value of the Range header, or None
+        file_size: the size of the requested file
+    Return:
+        (start, end) of the range, end included, or None to send the whole
+        file, which is allowed for headers of any other form
+    Raise:
+        ValueError if the range cannot be satisfied
+    """
+    if not range_header:
+        return None
+    match = re.fullmatch(r'\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*', range_header)
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    if match.group(1) == '':
+        # The last N bytes
+        length = int(match.group(2))
+        if length == 0 or file_size == 0:
+            raise ValueError('Empty suffix range')
+        return max(0, file_size - length), file_size - 1
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) else file_size - 1
+    if start >= file_size:
+        raise ValueError('The range starts after the end of the file')
+    if end < start:
+        return None
+    return start, min(end, file_size - 1)
 
 
 class CORSSimpleHTTPHandler(SimpleHTTPRequestHandler):
@@ -62,14 +177,109 @@ class RequestHandler(CORSSimpleHTTPHandler):
         self.send_header("Access-Control-Allow-Headers", "Content-Type")
         self.end_headers()
 
+    def send_file(self, path):
+        """
+        Send a file, or the byte range of it requested by Range and If-Range
+        headers, with os.sendfile so that the content is not copied through
+        python
+        """
+        try:
+            file = open(path, 'rb')
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+        with file:
+            fstat = os.fstat(file.fileno())
+            file_size = fstat.st_size
+            etag = '"{:x}-{:x}"'.format(file_size, fstat.st_mtime_ns)
+            last_modified = self.date_time_string(int(fstat.st_mtime))
+            range_header = self.headers['Range']
+            if_range = self.headers['If-Range']
+            if if_range and if_range != etag and if_range != last_modified:
+                # The file changed since the client downloaded a part of it
+                range_header = None
+            try:
+                byte_range = parse_range(range_header, file_size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(file_size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if byte_range:
+                start, end = byte_range
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                    start, end, file_size))
+            else:
+                start, end = 0, file_size - 1
+                self.send_response(200)
+            self.send_header('Content-type', self.guess_type(path))
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.end_headers()
+
+            offset = start
+            remaining = end - start + 1
+            try:
+                while remaining > 0:
+                    sent = os.sendfile(self.connection.fileno(), file.fileno(),
+                                       offset, min(remaining, 1 << 30))
+                    if sent == 0:
+                        break
+                    offset += sent
+                    remaining -= sent
+            except (AttributeError, OSError) as e:
+                if isinstance(e, (BrokenPipeError, ConnectionResetError)):
+                    # The client stopped the download, it can resume it
+                    return
+                # os.sendfile is not supported, copy the rest of the range
+                file.seek(offset)
+                while remaining > 0:
+                    chunk = file.read(min(remaining, BUFFER_SIZE))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+
+    def _page_args(self):
+        """
+        Parse the optional limit and offset of a list request
+        Raise:
+            ValueError if limit or offset is not a non-negative integer
+        """
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query,
+                                      keep_blank_values=True)
+        limit = int(query['limit'][0]) if 'limit' in query else None
+        offset = int(query['offset'][0]) if 'offset' in query else 0
+        if (limit is not None and limit < 0) or offset < 0:
+            raise ValueError('limit and offset must not be negative')
+        return limit, offset
+
     def do_GET(self):
-        if self.path == '/check' or self.path == '/check/':
-            statuses = jobs.get_status()
+        path = urllib.parse.urlsplit(self.path).path
+        if path == '/check' or path == '/check/':
+            try:
+                page_args = self._page_args()
+            except ValueError as e:
+                self.send_error(400, "Invalid limit or offset", str(e))
+                return
+            statuses = jobs.get_status(*page_args)
             self._set_response(type='application/json')
             self.wfile.write(
                 json.dumps([status.to_dict_basic()
                             for status in statuses]).encode()
             )
+        elif self.path.startswith('/progress/'):
+            id = self.path[10:]
+            progress = jobs.get_progress(id)
+            if progress is None:
+                self.send_error(404, "Job not found")
+                return
+            self._set_response(type='application/json')
+            self.wfile.write(json.dumps(progress).encode())
         elif self.path.startswith('/check/'):
             id = self.path[7:]
             status = jobs.get_status_by_ID(id=id)
@@ -78,8 +288,13 @@ class RequestHandler(CORSSimpleHTTPHandler):
                 json.dumps(status.to_dict_detail(target_lib)).encode()
             )
         elif self.path.startswith('/file') or self.path.startswith("/reconstruct_build_list"):
-            if self.path == '/file' or self.path == '/file/':
-                file_list = target_lib.get_builds()
+            if path == '/file' or path == '/file/':
+                try:
+                    page_args = self._page_args()
+                except ValueError as e:
+                    self.send_error(400, "Invalid limit or offset", str(e))
+                    return
+                file_list = target_lib.get_builds(*page_args)
             else:
                 file_list = target_lib.new_build_from_dir()
             builds_info = [build.to_dict() for build in file_list]
@@ -94,6 +309,9 @@ class RequestHandler(CORSSimpleHTTPHandler):
             return
         elif self.path.startswith('/download'):
             self.path = self.path[10:]
+            file_path = self.translate_path(self.path)
+            if os.path.isfile(file_path):
+                return self.send_file(file_path)
             return CORSSimpleHTTPHandler.do_GET(self)
         else:
             if not os.path.exists('dist' + self.path):
@@ -117,7 +335,7 @@ class RequestHandler(CORSSimpleHTTPHandler):
                 self._set_response(code=200)
                 self.send_header("Content-Type", 'application/json')
                 self.wfile.write(json.dumps(
-                    {"success": True, "msg": "OTA Generator started running"}).encode())
+                    {"success": True, "msg": "OTA Generator is queued"}).encode())
             except Exception as e:
                 logging.warning(
                     "Failed to run ota_from_target_files %s", e.__traceback__)
@@ -128,30 +346,44 @@ class RequestHandler(CORSSimpleHTTPHandler):
                 str(self.path), str(self.headers),
                 json.dumps(post_data)
             )
+        elif self.path.startswith('/cancel/'):
+            if jobs.cancel(self.path[8:]):
+                self._set_response(type='application/json')
+                self.wfile.write(json.dumps(
+                    {"success": True, "msg": "OTA job is cancelled"}).encode())
+            else:
+                self.send_error(
+                    400, "Failed to cancel the job, it is not queued or running")
         elif self.path.startswith('/file'):
             file_name = os.path.join('target', self.path[6:])
             file_length = int(self.headers['Content-Length'])
-            with open(file_name, 'wb') as output_file:
-                # Unwrap the uploaded file first (due to the usage of FormData)
-                # The wrapper has a boundary line at the top and bottom
-                # and some file information in the beginning
-                # There are a file content line, a file name line, and an empty line
-                # The boundary line in the bottom is 4 bytes longer than the top one
-                # Please refer to the following links for more details:
-                # https://stackoverflow.com/questions/8659808/how-does-http-file-upload-work
-                # https://datatracker.ietf.org/doc/html/rfc1867
-                upper_boundary = self.rfile.readline()
-                file_length -= len(upper_boundary) * 2 + 4
-                file_length -= len(self.rfile.readline())
-                file_length -= len(self.rfile.readline())
-                file_length -= len(self.rfile.readline())
-                BUFFER_SIZE = 1024*1024
-                for offset in range(0, file_length, BUFFER_SIZE):
-                    chunk = self.rfile.read(
-                        min(file_length-offset, BUFFER_SIZE))
-                    output_file.write(chunk)
-                target_lib.new_build(self.path[6:], file_name)
-            self._set_response(code=201)
+            content_type, params = cgi.parse_header(
+                self.headers['Content-Type'] or '')
+            boundary = None
+            if content_type == 'multipart/form-data' and 'boundary' in params:
+                boundary = params['boundary'].encode()
+            # Write into a temporary file first, so that an interrupted upload
+            # does not leave a truncated build behind
+            with tempfile.NamedTemporaryFile(
+                    dir=os.path.dirname(file_name) or '.', suffix='.uploading',
+                    delete=False) as output_file:
+                try:
+                    digest = stream_multipart_file(
+                        self.rfile, file_length, boundary, output_file)
+                except (MultipartError, OSError) as e:
+                    output_file.close()
+                    os.remove(output_file.name)
+                    self.send_error(400, "Failed to receive the file", str(e))
+                    return
+            os.replace(output_file.name, file_name)
+            logging.info("Received %s, SHA-256 %s",
+                         file_name, digest.hexdigest())
+            target_lib.new_build(self.path[6:], file_name)
+            self.send_response(201)
+            self.send_header('Content-type', 'text/html')
+            self.send_header('Digest', 'sha-256=' +
+                             base64.b64encode(digest.digest()).decode())
+            self.end_headers()
             self.wfile.write(
                 "File received, saved into {}".format(
                     file_name).encode('utf-8')
@@ -199,8 +431,12 @@ if __name__ == '__main__':
     if not os.path.isdir('output'):
         os.mkdir('output', 755)
     target_lib = TargetLib()
-    jobs = ProcessesManagement(otatools_dir=EXTRACT_DIR)
-    if len(argv) == 2:
+    if len(argv) == 3:
+        jobs = ProcessesManagement(otatools_dir=EXTRACT_DIR,
+                                   max_workers=int(argv[2]))
+    else:
+        jobs = ProcessesManagement(otatools_dir=EXTRACT_DIR)
+    if len(argv) >= 2:
         run_server(port=int(argv[1]))
     else:
         run_server()
@@ -19,18 +19,40 @@ from xml.dom import minidom
 
 import argparse
 import itertools
+import json
+import multiprocessing
 import os
 import re
+import struct
 import subprocess
 import sys
 import tempfile
 import shutil
+import zipfile
+
+from multiprocessing.pool import ThreadPool
 
 DEVICE_PREFIX = 'device:'
 ANDROID_NAME_REGEX = r'A: android:name\([\S]+\)=\"([\S]+)\"'
 ANDROID_PROTECTION_LEVEL_REGEX = \
     r'A: android:protectionLevel\([^\)]+\)=\(type [\S]+\)0x([\S]+)'
 BASE_XML_FILENAME = 'privapp-permissions-platform.xml'
+ANDROID_MANIFEST = 'AndroidManifest.xml'
+USES_PERMISSION_TAGS = ('uses-permission', 'uses-permission-sdk-23',
+                        'uses-permission-sdk-m')
+
+# Compiled (binary) XML constants, as defined in
+# frameworks/base/libs/androidfw/include/androidfw/ResourceTypes.h
+RES_STRING_POOL_TYPE = 0x0001
+RES_XML_TYPE = 0x0003
+RES_XML_START_ELEMENT_TYPE = 0x0102
+RES_XML_RESOURCE_MAP_TYPE = 0x0180
+RES_STRING_POOL_UTF8_FLAG = 0x100
+RES_VALUE_TYPE_STRING = 0x03
+RES_VALUE_TYPE_FIRST_INT = 0x10
+RES_VALUE_TYPE_LAST_INT = 0x1f
+ANDROID_NAME_ATTR = 0x01010003
+ANDROID_PROTECTION_LEVEL_ATTR = 0x01010009
 
 HELP_MESSAGE = """\
 Generates privapp-permissions.xml file for priv-apps.
@@ -94,6 +116,10 @@ class MissingResourceError(Exception):
     """Raised when a dependency cannot be located."""
 
 
+class AxmlError(Exception):
+    """Raised when a compiled XML file cannot be decoded."""
+
+
 class Adb(object):
     """A small wrapper around ADB calls."""
 
@@ -139,6 +165,135 @@ class Adb(object):
                 extracmd = ' 1>&2'
             os.system(command + extracmd)
 
+
+class DeviceMirror(object):
+    """A local mirror of device files, keyed by serial and build fingerprint.
+
+    Files are listed on the device with their size and mtime, and only the
+    ones that changed since the last sync are pulled, several at a time.
+
+    Attributes:
+        root: The local directory mirroring the device's root directory.
+    """
+
+    INDEX_FILENAME = 'index.json'
+
+    def __init__(self, adb, cache_dir, pull_jobs=4):
+        self.adb = adb
+        self.pull_jobs = max(1, pull_jobs)
+        fingerprint = adb.call('shell getprop ro.build.fingerprint').strip()
+        if not fingerprint:
+            raise MissingResourceError(
+                'Could not read the build fingerprint of device "%s".' %
+                adb.serial)
+        self._dir = os.path.join(cache_dir,
+                                 re.sub(r'[^\w.-]', '_', adb.serial),
+                                 re.sub(r'[^\w.-]', '_', fingerprint))
+        self.root = os.path.join(self._dir, 'files')
+        self._index_path = os.path.join(self._dir, self.INDEX_FILENAME)
+        self._index = {}
+        if os.path.isfile(self._index_path):
+            try:
+                with open(self._index_path) as f:
+                    self._index = json.load(f)
+            except ValueError:
+                self._index = {}
+
+    def local_path(self, device_path):
+        """Returns where device_path is mirrored on the host."""
+        return os.path.join(self.root, device_path.strip('/'))
+
+    def sync(self, device_path, suffix=None):
+        """Mirrors a device file or directory tree.
+
+        Args:
+            device_path: the device file or directory to mirror.
+            suffix: if set, only the files with this file name suffix, e.g.
+                '.apk', are mirrored.
+        Returns:
+            The sorted list of mirrored local files. It is empty if
+            device_path does not exist on the device.
+        Throws:
+            MissingResourceError if a changed file could not be pulled.
+        """
+        device_path = '/' + device_path.strip('/')
+        listing = self._list(device_path, suffix)
+
+        stale = [path for path, stamp in listing.items()
+                 if self._index.get(path) != stamp or
+                 not os.path.isfile(self.local_path(path))]
+        vprint(self.adb.verbose, '# %s: %d files, %d changed', device_path,
+               len(listing), len(stale))
+        failed = []
+        if stale:
+            pool = ThreadPool(min(self.pull_jobs, len(stale)))
+            try:
+                failed = [path for path, ok in
+                          zip(stale, pool.map(self._pull, stale)) if not ok]
+            finally:
+                pool.close()
+                pool.join()
+            for path in stale:
+                if path not in failed:
+                    self._index[path] = listing[path]
+
+        # Drop files which are gone from the device
+        prefix = device_path.rstrip('/') + '/'
+        removed = [path for path in self._index if path not in listing and
+                   (path == device_path or path.startswith(prefix)) and
+                   (not suffix or path.endswith(suffix))]
+        for path in removed:
+            del self._index[path]
+            if os.path.isfile(self.local_path(path)):
+                os.remove(self.local_path(path))
+
+        if stale or removed:
+            self._write_index()
+        if failed:
+            raise MissingResourceError(
+                'Could not pull %s from device "%s".' %
+                (', '.join(failed), self.adb.serial))
+        return sorted(self.local_path(path) for path in listing)
+
+    def _list(self, device_path, suffix=None):
+        """Returns {device path: [size, mtime]} for files under device_path,
+        with the file name suffix if it is set."""
+        name = ' -name "*%s"' % suffix if suffix else ''
+        output = self.adb.call(
+            'shell \'find "%s" -type f%s -exec stat -c "%%s %%Y %%n" {} + '
+            '2>/dev/null; true\'' % (device_path, name))
+        listing = {}
+        for line in output.splitlines():
+            fields = line.split(' ', 2)
+            if len(fields) == 3 and fields[0].isdigit():
+                listing[fields[2]] = [int(fields[0]), int(fields[1])]
+        return listing
+
+    def _pull(self, device_path):
+        """Pulls one file into the mirror, returns whether it succeeded."""
+        dst = self.local_path(device_path)
+        dst_dir = os.path.dirname(dst)
+        if not os.path.isdir(dst_dir):
+            try:
+                os.makedirs(dst_dir)
+            except OSError:
+                # Created by another pull thread in the meantime
+                if not os.path.isdir(dst_dir):
+                    raise
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(
+                [self.adb.path, '-s', self.adb.serial, 'pull', device_path,
+                 dst], stdout=devnull, stderr=devnull) == 0
+
+    def _write_index(self):
+        if not os.path.isdir(self._dir):
+            os.makedirs(self._dir)
+        tmp_path = self._index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._index, f)
+        os.rename(tmp_path, self._index_path)
+
+
 class Aapt(object):
     def __init__(self, path):
         self.path = path
@@ -168,11 +323,12 @@ class Resources(object):
     def __init__(self, adb_path=None, aapt_path=None, use_device=None,
                  serial=None, partitions=None, verbose=False,
                  writetodisk=None, systemfile=None, productfile=None,
-                 apks=None):
+                 apks=None, jobs=None, cache_dir=None, pull_jobs=4):
         self.adb = Resources._resolve_adb(adb_path)
         self.aapt = Resources._resolve_aapt(aapt_path)
 
         self.verbose = self.adb.verbose = verbose
+        self.jobs = jobs
         self.writetodisk = writetodisk
         self.systemfile = systemfile;
         self.productfile = productfile;
@@ -184,9 +340,14 @@ class Resources(object):
 
         self.adb.serial = self._resolve_serial(use_device, serial)
 
+        self.mirror = None
         if self.adb.serial:
             self.adb.call('root')
             self.adb.call('wait-for-device')
+            if not cache_dir:
+                cache_dir = tempfile.mkdtemp()
+                temp_dirs.append(cache_dir)
+            self.mirror = DeviceMirror(self.adb, cache_dir, pull_jobs)
 
         if self.adb.serial is None and not self._is_android_env:
             raise MissingResourceError(
@@ -268,8 +429,11 @@ class Resources(object):
     def _resolve_aapt(aapt_path):
         """Resolves AAPT from either the cmdline argument or the os environment.
 
+        AAPT is only used as a fallback for manifests that cannot be decoded
+        in-process, so it is not an error for it to be missing from the path.
+
         Returns:
-            An Aapt Object
+            An Aapt Object, or None if aapt is not in the path.
         """
         if aapt_path:
             if os.path.isfile(aapt_path):
@@ -281,11 +445,11 @@ class Resources(object):
             try:
                 return Aapt(get_output('which aapt').strip())
             except subprocess.CalledProcessError:
-                print('Cannot resolve aapt: AAPT does not exist within path. '
-                      'Did you forget to setup the build environment or set '
-                      '--aapt?',
+                print('# AAPT does not exist within path, manifests will only '
+                      'be decoded in-process. Set --aapt to enable the '
+                      'fallback.',
                       file=sys.stderr)
-                raise
+                return None
 
     def _resolve_serial(self, device, serial):
         """Resolves the serial used for device files or generating permissions.
@@ -417,13 +581,11 @@ class Resources(object):
         for apk in apks:
             if apk.startswith(DEVICE_PREFIX):
                 device_apk = apk[len(DEVICE_PREFIX):]
-                try:
-                    apk = self.adb.pull(device_apk)
-                except subprocess.CalledProcessError:
+                if not self.mirror.sync(device_apk):
                     raise MissingResourceError(
                         'File "%s" could not be located on device "%s".' %
                         (device_apk, self.adb.serial))
-                results[p].append(apk)
+                results[p].append(self.mirror.local_path(device_apk))
             elif not os.path.isfile(apk):
                 raise MissingResourceError('File "%s" does not exist.' % apk)
             else:
@@ -441,21 +603,18 @@ class Resources(object):
         if not self.adb.serial:
             priv_app_dir = os.path.join(os.environ['ANDROID_PRODUCT_OUT'],
                                         partition + '/priv-app')
-        else:
-            try:
-                priv_app_dir = self.adb.pull(partition + '/priv-app/')
-            except subprocess.CalledProcessError:
-                raise MissingResourceError(
-                    'Directory "%s/priv-app" could not be pulled from on '
-                    'device "%s".' % (partition, self.adb.serial))
-        return get_output('find %s -name "*.apk"' % priv_app_dir).split()
+            return list_files(priv_app_dir, '.apk')
+        return self.mirror.sync(partition + '/priv-app', '.apk')
 
     def _resolve_sys_path(self, file_path):
-        """Resolves a path that is a part of an Android System Image."""
+        """Resolves a path that is a part of an Android System Image.
+
+        On a device, the path is synced into the device mirror first.
+        """
         if not self.adb.serial:
             return os.path.join(os.environ['ANDROID_PRODUCT_OUT'], file_path)
-        else:
-            return self.adb.pull(file_path)
+        self.mirror.sync(file_path)
+        return self.mirror.local_path(file_path)
 
     def _resolve_sys_paths(self, file_path, partitions):
         """Resolves a path that is a part of an Android System Image, for the
@@ -513,7 +672,18 @@ def parse_args():
         type=str,
         required=False,
         metavar='<AAPT_PATH>',
-        help='Path to aapt. If none specified, uses the environment\'s aapt.'
+        help='Path to aapt. If none specified, uses the environment\'s aapt. '
+             'aapt is only used for manifests that cannot be decoded '
+             'in-process.'
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        required=False,
+        metavar='<JOBS>',
+        help='Number of processes used to decode APK manifests. Defaults to '
+             'one per CPU.'
     )
     parser.add_argument(
         '-s',
@@ -568,6 +738,33 @@ def parse_args():
         required=False,
         help='Path to system permissions file. Default value is ./product.xml'
     )
+    parser.add_argument(
+        '--cache-dir',
+        default=os.path.join(os.path.expanduser('~'), '.cache',
+                             'privapp_permissions'),
+        required=False,
+        metavar='<CACHE_DIR>',
+        help='Where files pulled from a device are mirrored, per device serial '
+             'and build fingerprint. Only files that changed on the device '
+             'are pulled again. Default value is '
+             '~/.cache/privapp_permissions'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        default=False,
+        required=False,
+        help='Pull device files into a temporary directory instead of the '
+             'cache directory.'
+    )
+    parser.add_argument(
+        '--pull-jobs',
+        type=int,
+        default=4,
+        required=False,
+        metavar='<PULL_JOBS>',
+        help='Number of concurrent adb pulls. Default value is 4'
+    )
     cmd_args = parser.parse_args()
 
     return cmd_args
@@ -626,9 +823,9 @@ def generate_missing_permissions(resources, priv_permissions, partition):
 
     apps_redefine_base = []
     results = {}
-    for priv_app in resources.privapp_apks[partition]:
-        pkg_info = extract_pkg_and_requested_permissions(resources.aapt,
-                                                         priv_app)
+    pkg_infos = extract_all_pkg_and_requested_permissions(
+        resources.aapt, resources.privapp_apks[partition], resources.jobs)
+    for pkg_info in pkg_infos:
         pkg_name = pkg_info['package_name']
         # get intersection of what's requested by app and by framework
         priv_perms = get_priv_permissions(pkg_info['permissions'],
@@ -676,26 +873,199 @@ def get_priv_permissions(requested_perms, priv_perms):
     return set(requested_perms).intersection(set(priv_perms))
 
 
-def list_xml_files(directory):
-    """Returns a list of all .xml files within a given directory.
+def list_files(directory, suffix):
+    """Returns a list of all files with the given suffix within a directory.
 
     Args:
-        directory: the directory to look for xml files in.
+        directory: the directory to look for files in.
+        suffix: the file name suffix to match, e.g. '.xml'.
     """
-    xml_files = []
+    files = []
     for dirName, subdirList, file_list in os.walk(directory):
         for file in file_list:
-            if file.endswith('.xml'):
+            if file.endswith(suffix):
                 file_path = os.path.join(dirName, file)
-                xml_files.append(file_path)
-    return xml_files
+                files.append(file_path)
+    return files
+
+
+def list_xml_files(directory):
+    """Returns a list of all .xml files within a given directory.
+
+    Args:
+        directory: the directory to look for xml files in.
+    """
+    return list_files(directory, '.xml')
+
+
+class _StringPool(object):
+    """Lazily decoded string pool chunk of a compiled XML file."""
+
+    def __init__(self, data, offset):
+        (_, header_size, _, count, _, flags, strings_start,
+         _) = struct.unpack_from('<HHIIIIII', data, offset)
+        self._data = data
+        self._utf8 = flags & RES_STRING_POOL_UTF8_FLAG
+        self._base = offset + strings_start
+        self._offsets = struct.unpack_from('<%dI' % count, data,
+                                           offset + header_size)
+        self._strings = {}
+
+    def __getitem__(self, index):
+        if index in self._strings:
+            return self._strings[index]
+        if index >= len(self._offsets):
+            raise AxmlError('String index %d out of range' % index)
+        pos = self._base + self._offsets[index]
+        if self._utf8:
+            # The UTF-16 length comes first; only the UTF-8 length is needed.
+            _, pos = _read_utf8_length(self._data, pos)
+            length, pos = _read_utf8_length(self._data, pos)
+            value = self._data[pos:pos + length].decode('utf-8', 'replace')
+        else:
+            length, = struct.unpack_from('<H', self._data, pos)
+            pos += 2
+            if length & 0x8000:
+                low, = struct.unpack_from('<H', self._data, pos)
+                length = ((length & 0x7fff) << 16) | low
+                pos += 2
+            value = self._data[pos:pos + length * 2].decode('utf-16-le',
+                                                            'replace')
+        self._strings[index] = value
+        return value
+
+
+def _read_utf8_length(data, pos):
+    """Reads a one or two byte string pool length, returns (length, pos)."""
+    length, = struct.unpack_from('<B', data, pos)
+    if length & 0x80:
+        low, = struct.unpack_from('<B', data, pos + 1)
+        return ((length & 0x7f) << 8) | low, pos + 2
+    return length, pos + 1
+
+
+def iter_axml_elements(data):
+    """Yields (tag, attributes) for each start element of a compiled XML file.
+
+    Attributes are keyed by their android resource id when they have one
+    (e.g. ANDROID_NAME_ATTR), and by their name otherwise. Only string and
+    integer values are decoded; other value types are left out.
+
+    Raises:
+        AxmlError if data is not a compiled XML file.
+    """
+    if len(data) < 8:
+        raise AxmlError('File is too small to be a compiled XML file')
+    chunk_type, header_size, size = struct.unpack_from('<HHI', data, 0)
+    if chunk_type != RES_XML_TYPE:
+        raise AxmlError('Not a compiled XML file')
+    if size > len(data):
+        raise AxmlError('Truncated compiled XML file')
+    strings = None
+    resource_ids = ()
+    end = size
+    offset = header_size
+    while offset + 8 <= end:
+        chunk_type, header_size, size = struct.unpack_from('<HHI', data,
+                                                           offset)
+        if size < 8:
+            raise AxmlError('Corrupt chunk at offset %d' % offset)
+        if chunk_type == RES_STRING_POOL_TYPE:
+            strings = _StringPool(data, offset)
+        elif chunk_type == RES_XML_RESOURCE_MAP_TYPE:
+            resource_ids = struct.unpack_from(
+                '<%dI' % ((size - header_size) // 4), data,
+                offset + header_size)
+        elif chunk_type == RES_XML_START_ELEMENT_TYPE:
+            if strings is None:
+                raise AxmlError('Element found before the string pool')
+            ext = offset + header_size
+            (_, name, attr_start, attr_size,
+             attr_count) = struct.unpack_from('<IIHHH', data, ext)
+            attributes = {}
+            pos = ext + attr_start
+            for _ in range(attr_count):
+                (_, attr_name, _, _, _, value_type,
+                 value) = struct.unpack_from('<IIIHBBI', data, pos)
+                pos += attr_size
+                if attr_name < len(resource_ids) and resource_ids[attr_name]:
+                    key = resource_ids[attr_name]
+                else:
+                    key = strings[attr_name]
+                if value_type == RES_VALUE_TYPE_STRING:
+                    attributes[key] = strings[value]
+                elif (RES_VALUE_TYPE_FIRST_INT <= value_type <=
+                      RES_VALUE_TYPE_LAST_INT):
+                    attributes[key] = value
+            yield strings[name], attributes
+        offset += size
+
+
+def read_manifest(apk_path):
+    """Returns the compiled AndroidManifest.xml of an APK as a byte string."""
+    with zipfile.ZipFile(apk_path) as apk:
+        return apk.read(ANDROID_MANIFEST)
+
+
+def decode_pkg_and_requested_permissions(manifest):
+    """Decodes package name and requested permissions from a manifest."""
+    permissions = []
+    package_name = None
+    for tag, attributes in iter_axml_elements(manifest):
+        if tag == 'manifest':
+            package_name = attributes.get('package')
+        elif tag in USES_PERMISSION_TAGS:
+            name = attributes.get(ANDROID_NAME_ATTR)
+            if name:
+                permissions.append(name)
+
+    return {'package_name': package_name, 'permissions': permissions}
+
+
+def decode_priv_permissions(manifest):
+    """Decodes signature|privileged permissions defined by a manifest."""
+    permissions_list = []
+    for tag, attributes in iter_axml_elements(manifest):
+        if tag != 'permission':
+            continue
+        name = attributes.get(ANDROID_NAME_ATTR)
+        level = attributes.get(ANDROID_PROTECTION_LEVEL_ATTR)
+        if name and level and level & 0x12 == 0x12:
+            permissions_list.append(name)
+
+    return permissions_list
+
+
+def _decode_manifest(decoder, aapt, apk_path):
+    """Runs decoder on the manifest of apk_path.
+
+    Returns:
+        The decoded result, or None if the manifest could not be decoded
+        and aapt should be used instead.
+    Throws:
+        MissingResourceError if decoding failed and aapt is unavailable.
+    """
+    try:
+        return decoder(read_manifest(apk_path))
+    except (AxmlError, KeyError, struct.error, zipfile.BadZipfile) as e:
+        if aapt is None:
+            raise MissingResourceError(
+                'Cannot decode the manifest of "%s" (%s) and aapt is not '
+                'available as a fallback. Set --aapt.' % (apk_path, e))
+        vprint(True, '# Falling back to aapt for "%s": %s', apk_path, e)
+        return None
 
 
 def extract_pkg_and_requested_permissions(aapt, apk_path):
     """
     Extract package name and list of requested permissions from the
-    dump of manifest file
+    manifest file, falling back to the aapt dump if it cannot be decoded
     """
+    result = _decode_manifest(decode_pkg_and_requested_permissions, aapt,
+                              apk_path)
+    if result is not None:
+        return result
+
     aapt_args = ['d', 'permissions', apk_path]
     txt = aapt.call(aapt_args)
 
@@ -716,8 +1086,37 @@ def extract_pkg_and_requested_permissions(aapt, apk_path):
     return {'package_name': package_name, 'permissions': permissions}
 
 
+def _extract_pkg_and_requested_permissions(args):
+    """Pool.map helper for extract_pkg_and_requested_permissions."""
+    return extract_pkg_and_requested_permissions(*args)
+
+
+def extract_all_pkg_and_requested_permissions(aapt, apk_paths, jobs=None):
+    """Runs extract_pkg_and_requested_permissions over a list of APKs.
+
+    Args:
+        jobs: number of worker processes, or None for one per CPU.
+    Returns:
+        A list of results, in the same order as apk_paths.
+    """
+    if jobs == 1 or len(apk_paths) < 2:
+        return [extract_pkg_and_requested_permissions(aapt, apk)
+                for apk in apk_paths]
+    pool = multiprocessing.Pool(jobs)
+    try:
+        return pool.map(_extract_pkg_and_requested_permissions,
+                        [(aapt, apk) for apk in apk_paths])
+    finally:
+        pool.close()
+        pool.join()
+
+
 def extract_priv_permissions(aapt, apk_path):
-    """Extract signature|privileged permissions from dump of manifest file."""
+    """Extract signature|privileged permissions from the manifest file."""
+    result = _decode_manifest(decode_priv_permissions, aapt, apk_path)
+    if result is not None:
+        return result
+
     aapt_args = ['d', 'xmltree', apk_path, 'AndroidManifest.xml']
     txt = aapt.call(aapt_args)
     raw_lines = txt.split('\n')
@@ -794,7 +1193,10 @@ if __name__ == '__main__':
             writetodisk=args.writetodisk,
             systemfile=args.systemfile,
             productfile=args.productfile,
-            apks=args.apks
+            apks=args.apks,
+            jobs=args.jobs,
+            cache_dir=None if args.no_cache else args.cache_dir,
+            pull_jobs=args.pull_jobs
         )
         create_permission_file(tool_resources)
     except MissingResourceError as e:
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2026 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the in-process manifest decoder of privapp_permissions."""
+
+import json
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+import zipfile
+
+import privapp_permissions
+from privapp_permissions import (ANDROID_NAME_ATTR,
+                                 ANDROID_PROTECTION_LEVEL_ATTR)
+
+TESTDATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'testdata')
+# The manifests are generated by testdata/make_axml.py.
+MANIFESTS = ['manifest_utf8.axml', 'manifest_utf16.axml']
+
+ANDROID_LABEL_ATTR = 0x01010001
+ANDROID_VALUE_ATTR = 0x01010024
+ANDROID_VERSION_CODE_ATTR = 0x0101021b
+
+FAKE_AAPT = """#!/bin/sh
+echo "package: com.example.fallback"
+echo "uses-permission: name='android.permission.FALLBACK'"
+"""
+
+# Serves the files under a host directory, in place of the device root.
+FAKE_ADB = r"""#!/bin/sh
+root='%s'
+shift 2
+case "$1" in
+shell)
+  case "$2" in
+  getprop*) echo fake/fingerprint ;;
+  *) sh -c "$(echo "$2" | sed "s|\"/|\"$root/|g")" | sed "s| $root/| /|" ;;
+  esac ;;
+pull)
+  echo "$2" >> "$root.pulls"
+  cp "$root$2" "$3" ;;
+esac
+"""
+
+
+def read_testdata(name):
+    with open(os.path.join(TESTDATA_DIR, name), 'rb') as f:
+        return f.read()
+
+
+class AxmlTest(unittest.TestCase):
+    """Decodes the compiled manifests in testdata."""
+
+    def test_elements(self):
+        for name in MANIFESTS:
+            with self.subTest(manifest=name):
+                elements = list(privapp_permissions.iter_axml_elements(
+                    read_testdata(name)))
+                self.assertEqual([tag for tag, _ in elements], [
+                    'manifest', 'uses-permission', 'uses-permission',
+                    'uses-permission-sdk-23', 'permission', 'permission',
+                    'application', 'meta-data'])
+
+                # Attributes without a namespace are keyed by their name,
+                # android ones by their resource id.
+                self.assertEqual(elements[0][1], {
+                    'package': 'com.example.privapp',
+                    ANDROID_VERSION_CODE_ATTR: 1})
+                # References are left out.
+                self.assertEqual(elements[2][1], {})
+                self.assertEqual(elements[4][1], {
+                    ANDROID_NAME_ATTR: 'com.example.privapp.PRIV',
+                    ANDROID_PROTECTION_LEVEL_ATTR: 0x12})
+                self.assertEqual(elements[6][1],
+                                 {ANDROID_LABEL_ATTR: 'Приложение'})
+                # Strings longer than 127 characters have two byte lengths.
+                self.assertEqual(elements[7][1][ANDROID_VALUE_ATTR], 'x' * 200)
+
+    def test_decode_permissions(self):
+        for name in MANIFESTS:
+            with self.subTest(manifest=name):
+                manifest = read_testdata(name)
+                self.assertEqual(
+                    privapp_permissions.decode_pkg_and_requested_permissions(
+                        manifest),
+                    {'package_name': 'com.example.privapp',
+                     'permissions': ['android.permission.INSTALL_PACKAGES',
+                                     'android.permission.READ_LOGS']})
+                self.assertEqual(
+                    privapp_permissions.decode_priv_permissions(manifest),
+                    ['com.example.privapp.PRIV'])
+
+    def test_not_axml(self):
+        for data in [b'', b'<manifest/>', read_testdata(MANIFESTS[0])[:8]]:
+            with self.assertRaises(privapp_permissions.AxmlError):
+                list(privapp_permissions.iter_axml_elements(data))
+
+
+class ExtractTest(unittest.TestCase):
+    """Extracts permissions from APKs, with and without the aapt fallback."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def write_apk(self, name, manifest):
+        apk_path = os.path.join(self.temp_dir, name)
+        with zipfile.ZipFile(apk_path, 'w') as apk:
+            apk.writestr(privapp_permissions.ANDROID_MANIFEST, manifest)
+        return apk_path
+
+    def write_fake_aapt(self):
+        aapt_path = os.path.join(self.temp_dir, 'aapt')
+        with open(aapt_path, 'w') as f:
+            f.write(FAKE_AAPT)
+        os.chmod(aapt_path, os.stat(aapt_path).st_mode | stat.S_IEXEC)
+        return privapp_permissions.Resources._resolve_aapt(aapt_path)
+
+    def test_extract_all(self):
+        apk_paths = [self.write_apk('%d.apk' % i, read_testdata(name))
+                     for i, name in enumerate(MANIFESTS * 2)]
+        results = privapp_permissions.extract_all_pkg_and_requested_permissions(
+            None, apk_paths, jobs=2)
+        self.assertEqual([result['package_name'] for result in results],
+                         ['com.example.privapp'] * 4)
+
+    def test_aapt_fallback(self):
+        apk_path = self.write_apk('broken.apk', b'<manifest/>')
+        with self.assertRaises(privapp_permissions.MissingResourceError):
+            privapp_permissions.extract_pkg_and_requested_permissions(
+                None, apk_path)
+
+        aapt = self.write_fake_aapt()
+        self.assertIsInstance(aapt, privapp_permissions.Aapt)
+        self.assertEqual(
+            privapp_permissions.extract_pkg_and_requested_permissions(
+                aapt, apk_path),
+            {'package_name': 'com.example.fallback',
+             'permissions': ['android.permission.FALLBACK']})
+
+        # aapt is not run for manifests that can be decoded.
+        apk_path = self.write_apk('privapp.apk', read_testdata(MANIFESTS[0]))
+        self.assertEqual(
+            privapp_permissions.extract_pkg_and_requested_permissions(
+                aapt, apk_path)['package_name'],
+            'com.example.privapp')
+
+    def test_missing_aapt(self):
+        with self.assertRaises(privapp_permissions.MissingResourceError):
+            privapp_permissions.Resources._resolve_aapt(
+                os.path.join(self.temp_dir, 'aapt'))
+
+
+class DeviceMirrorTest(unittest.TestCase):
+    """Mirrors the files of a fake device."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.device_root = os.path.join(self.temp_dir, 'device')
+        adb_path = os.path.join(self.temp_dir, 'adb')
+        with open(adb_path, 'w') as f:
+            f.write(FAKE_ADB % self.device_root)
+        os.chmod(adb_path, os.stat(adb_path).st_mode | stat.S_IEXEC)
+        self.adb = privapp_permissions.Adb(adb_path, 'fake')
+
+    def write_device_file(self, device_path):
+        path = self.device_root + device_path
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(device_path)
+
+    def pulls(self):
+        if not os.path.isfile(self.device_root + '.pulls'):
+            return []
+        with open(self.device_root + '.pulls') as f:
+            return sorted(f.read().splitlines())
+
+    def test_sync_suffix(self):
+        for path in ['/system/priv-app/Foo/Foo.apk',
+                     '/system/priv-app/Foo/oat/arm64/Foo.odex',
+                     '/system/priv-app/Foo/oat/arm64/Foo.vdex',
+                     '/system/priv-app/Foo/lib/arm64/libfoo.so',
+                     '/system/priv-app/Bar/Bar.apk']:
+            self.write_device_file(path)
+        mirror = privapp_permissions.DeviceMirror(
+            self.adb, os.path.join(self.temp_dir, 'cache'))
+
+        apks = ['/system/priv-app/Bar/Bar.apk', '/system/priv-app/Foo/Foo.apk']
+        self.assertEqual(mirror.sync('system/priv-app', '.apk'),
+                         [mirror.local_path(path) for path in apks])
+        # The other artifacts are neither pulled nor indexed.
+        self.assertEqual(self.pulls(), apks)
+        with open(mirror._index_path) as f:
+            self.assertEqual(sorted(json.load(f)), apks)
+
+        # Unchanged APKs are not pulled again, removed ones are dropped.
+        os.remove(self.device_root + apks[0])
+        self.assertEqual(mirror.sync('system/priv-app', '.apk'),
+                         [mirror.local_path(apks[1])])
+        self.assertEqual(self.pulls(), apks)
+        self.assertFalse(os.path.exists(mirror.local_path(apks[0])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2026 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Regenerates the compiled manifests used by privapp_permissions_test.py.
+
+The manifests follow the layout written by aapt: a string pool, a resource
+map for the android attribute names, then namespace and element chunks.
+    manifest_utf8.axml: the strings are encoded in UTF-8.
+    manifest_utf16.axml: the strings are encoded in UTF-16.
+"""
+
+import os
+import struct
+
+ANDROID_NS = 'http://schemas.android.com/apk/res/android'
+
+# The attribute names with a resource id come first in the string pool.
+ANDROID_ATTRS = [
+    ('name', 0x01010003),
+    ('protectionLevel', 0x01010009),
+    ('label', 0x01010001),
+    ('versionCode', 0x0101021b),
+    ('value', 0x01010024),
+]
+
+TYPE_REFERENCE = 0x01
+TYPE_STRING = 0x03
+TYPE_INT_DEC = 0x10
+TYPE_INT_HEX = 0x11
+
+# (tag, [(namespace, name, type, value)])
+ELEMENTS = [
+    ('manifest', [(None, 'package', TYPE_STRING, 'com.example.privapp'),
+                  (ANDROID_NS, 'versionCode', TYPE_INT_DEC, 1)], [
+        ('uses-permission', [
+            (ANDROID_NS, 'name', TYPE_STRING,
+             'android.permission.INSTALL_PACKAGES')], []),
+        ('uses-permission', [
+            (ANDROID_NS, 'name', TYPE_REFERENCE, 0x7f010000)], []),
+        ('uses-permission-sdk-23', [
+            (ANDROID_NS, 'name', TYPE_STRING,
+             'android.permission.READ_LOGS')], []),
+        ('permission', [
+            (ANDROID_NS, 'name', TYPE_STRING, 'com.example.privapp.PRIV'),
+            (ANDROID_NS, 'protectionLevel', TYPE_INT_HEX, 0x12)], []),
+        ('permission', [
+            (ANDROID_NS, 'name', TYPE_STRING, 'com.example.privapp.NORMAL'),
+            (ANDROID_NS, 'protectionLevel', TYPE_INT_HEX, 0x0)], []),
+        ('application', [
+            (ANDROID_NS, 'label', TYPE_STRING, 'Приложение')], [
+            ('meta-data', [
+                (ANDROID_NS, 'name', TYPE_STRING, 'com.example.long'),
+                (ANDROID_NS, 'value', TYPE_STRING, 'x' * 200)], []),
+        ]),
+    ]),
+]
+
+
+class StringPool(object):
+    def __init__(self):
+        self.strings = [name for name, _ in ANDROID_ATTRS]
+
+    def index(self, value):
+        if value not in self.strings:
+            self.strings.append(value)
+        return self.strings.index(value)
+
+    def encode(self, utf8):
+        data = b''
+        offsets = []
+        for value in self.strings:
+            offsets.append(len(data))
+            if utf8:
+                encoded = value.encode('utf-8')
+                data += (self._utf8_length(len(value)) +
+                         self._utf8_length(len(encoded)) + encoded + b'\0')
+            else:
+                encoded = value.encode('utf-16-le')
+                data += struct.pack('<H', len(value)) + encoded + b'\0\0'
+        data += b'\0' * (-len(data) % 4)
+        header_size = 28
+        strings_start = header_size + 4 * len(offsets)
+        header = struct.pack('<HHIIIIII', 0x0001, header_size,
+                             strings_start + len(data), len(self.strings), 0,
+                             0x100 if utf8 else 0, strings_start, 0)
+        return header + struct.pack('<%dI' % len(offsets), *offsets) + data
+
+    @staticmethod
+    def _utf8_length(length):
+        if length > 0x7f:
+            return struct.pack('>H', length | 0x8000)
+        return struct.pack('<B', length)
+
+
+def _ref(pool, value):
+    return 0xffffffff if value is None else pool.index(value)
+
+
+def encode_elements(pool, elements, line=1):
+    data = b''
+    for tag, attributes, children in elements:
+        attrs = b''
+        for namespace, name, value_type, value in attributes:
+            if value_type == TYPE_STRING:
+                raw = data_value = pool.index(value)
+            else:
+                raw, data_value = 0xffffffff, value
+            attrs += struct.pack('<IIIHBBI', _ref(pool, namespace),
+                                 pool.index(name), raw, 8, 0, value_type,
+                                 data_value)
+        ext = struct.pack('<IIHHHHHH', 0xffffffff, pool.index(tag), 20, 20,
+                          len(attributes), 0, 0, 0)
+        data += struct.pack('<HHIII', 0x0102, 16, 16 + len(ext) + len(attrs),
+                            line, 0xffffffff) + ext + attrs
+        line += 1
+        data += encode_elements(pool, children, line)
+        data += struct.pack('<HHIIIII', 0x0103, 16, 24, line, 0xffffffff,
+                            0xffffffff, pool.index(tag))
+    return data
+
+
+def make_axml(utf8):
+    pool = StringPool()
+    namespace = struct.pack('<II', pool.index('android'),
+                            pool.index(ANDROID_NS))
+    elements = encode_elements(pool, ELEMENTS)
+    start_ns = struct.pack('<HHIII', 0x0100, 16, 24, 1, 0xffffffff) + namespace
+    end_ns = struct.pack('<HHIII', 0x0101, 16, 24, 1, 0xffffffff) + namespace
+    ids = [resource_id for _, resource_id in ANDROID_ATTRS]
+    resource_map = struct.pack('<HHI%dI' % len(ids), 0x0180, 8,
+                               8 + 4 * len(ids), *ids)
+    body = pool.encode(utf8) + resource_map + start_ns + elements + end_ns
+    return struct.pack('<HHI', 0x0003, 8, 8 + len(body)) + body
+
+
+def main():
+    testdata = os.path.dirname(os.path.abspath(__file__))
+    for name, utf8 in [('manifest_utf8.axml', True),
+                       ('manifest_utf16.axml', False)]:
+        with open(os.path.join(testdata, name), 'wb') as f:
+            f.write(make_axml(utf8))
+
+
+if __name__ == '__main__':
+    main()
@@ -14,10 +14,16 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 import argparse
+import hashlib
+import multiprocessing
 import os
 import subprocess
 
 
+DEFAULT_CACHE_DIR = os.path.expanduser(
+    os.path.join('~', '.cache', 'git_commits_not_upstreamed'))
+
+
 def git(args):
   """Git command.
 
@@ -35,36 +41,137 @@ def git(args):
 
 
 class CommitFinder(object):
+  """Finds the commits that inserted the lines of a file downstream.
+
+  The commits are read from 'git blame --incremental' as it runs. With a
+  cache_dir, the commits of a file are cached by its path, its blob, the
+  upstream commit and the downstream commits that touched it, so that only
+  files that changed since a previous run are blamed again.
+  """
 
-  def __init__(self, working_dir, upstream, downstream):
+  def __init__(self, working_dir, upstream, downstream, cache_dir=None,
+               filenames=None):
     self.working_dir = working_dir
     self.upstream = upstream
     self.downstream = downstream
+    self.cache_dir = cache_dir
+    self.blobs = {}
+    self.history = {}
+    self.upstream_commit = None
+    if cache_dir:
+      self.upstream_commit = git(['-C', working_dir, 'rev-parse',
+                                  upstream]).strip()
+      for line in git(['-C', working_dir, 'ls-tree', '-r', '--full-tree',
+                       downstream]).splitlines():
+        # <mode> <type> <object>\t<path>
+        info, path = line.split(b'\t', 1)
+        self.blobs[path] = info.split()[2]
+      # Blame attributes the lines to the commits that touched the file, whose
+      # hashes change when downstream is rebased or reworded, even if the blob
+      # stays the same.
+      commit = None
+      for line in git(['-C', working_dir, 'log', '-m', '--name-only',
+                       '--format=%x00%H',
+                       '%s..%s' % (upstream, downstream)]).splitlines():
+        if line.startswith(b'\0'):
+          commit = line[1:]
+        elif line:
+          self.history.setdefault(line, []).append(commit)
+      if filenames is not None:
+        # Only keep what is needed, the finder is sent to each worker
+        self.blobs = {filename: self.blobs[filename] for filename in filenames
+                      if filename in self.blobs}
+        self.history = {filename: self.history[filename]
+                        for filename in filenames
+                        if filename in self.history}
+    # Boundary commits are shown as a blank hash instead of ^<hash> if
+    # blame.blankBoundary is set
+    try:
+      blank_boundary = git(['-C', working_dir, 'config', '--bool',
+                            'blame.blankBoundary']).strip() == b'true'
+    except subprocess.CalledProcessError:
+      blank_boundary = False
+    self.blank_boundary = blank_boundary
+
+  def _cache_path(self, filename):
+    blob = self.blobs.get(filename)
+    if not self.cache_dir or blob is None:
+      return None
+    key = hashlib.sha256(b'\0'.join(
+        [filename, blob, self.upstream_commit] +
+        self.history.get(filename, [])))
+    return os.path.join(self.cache_dir, key.hexdigest())
+
+  def blame(self, filename):
+    """Returns the set of commits in the blame of a file.
+
+    Commits outside of upstream..downstream are ^<hash> without the last
+    character of the hash, like in the first field of 'git blame -l'.
+    """
+    command = ['git', '-C', self.working_dir, 'blame', '--incremental',
+               '%s..%s' % (self.upstream, self.downstream), '--', filename]
+    commits = {}
+    commit = None
+    with open(os.devnull, 'w') as devnull:
+      process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                 stderr=devnull)
+      for line in process.stdout:
+        # Each group of lines starts with
+        # <hash> <source line> <result line> <number of lines>
+        # and ends with 'filename <file name>'
+        if commit is None:
+          commit = line.split(b' ', 1)[0]
+          commits.setdefault(commit, False)
+        elif line.rstrip(b'\n') == b'boundary':
+          commits[commit] = True
+        elif line.startswith(b'filename '):
+          commit = None
+      process.stdout.close()
+      if process.wait():
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+    insertion_commits = set()
+    for commit, boundary in commits.items():
+      if boundary:
+        commit = b'' if self.blank_boundary else b'^' + commit[:-1]
+      insertion_commits.add(commit)
+    return insertion_commits
 
   def __call__(self, filename):
     insertion_commits = set()
 
-    if os.path.isfile(os.path.join(self.working_dir, filename)):
-      blame_output = git(['-C', self.working_dir, 'blame', '-l',
-                          '%s..%s' % (self.upstream, self.downstream),
-                          '--', filename])
-      for line in blame_output.splitlines():
-        # The commit is the first field of a line
-        blame_fields = line.split(' ', 1)
-        # Some lines can be empty
-        if blame_fields:
-          insertion_commits.add(blame_fields[0])
+    working_dir = self.working_dir
+    if not isinstance(filename, str):
+      # git outputs bytes on python3
+      working_dir = working_dir.encode('utf-8')
+    if os.path.isfile(os.path.join(working_dir, filename)):
+      cache_path = self._cache_path(filename)
+      if cache_path and os.path.isfile(cache_path):
+        with open(cache_path, 'rb') as cache_file:
+          return set(cache_file.read().splitlines())
+      insertion_commits = self.blame(filename)
+      if cache_path:
+        # Write atomically, other workers may read the same entry
+        temp_path = '%s.%d' % (cache_path, os.getpid())
+        with open(temp_path, 'wb') as cache_file:
+          cache_file.write(b''.join(commit + b'\n'
+                                    for commit in insertion_commits))
+        os.rename(temp_path, cache_path)
 
     return insertion_commits
 
 
-def find_insertion_commits(upstream, downstream, working_dir):
+def find_insertion_commits(upstream, downstream, working_dir, jobs=None,
+                           cache_dir=None):
   """Finds all commits that insert lines on top of the upstream baseline.
 
   Args:
     upstream: Upstream branch to be used as a baseline.
     downstream: Downstream branch to search for commits missing upstream.
     working_dir: Run as if git was started in this directory.
+    jobs: Number of files blamed in parallel, defaults to the number of CPUs.
+    cache_dir: Directory to cache the commits found per file across runs,
+      e.g. DEFAULT_CACHE_DIR. Nothing is cached if it is None.
 
   Returns:
     A set of commits that insert lines on top of the upstream baseline.
@@ -79,8 +186,16 @@ def find_insertion_commits(upstream, downstream, working_dir):
                     downstream])
   diff_files = diff_files.splitlines()
 
-  finder = CommitFinder(working_dir, upstream, downstream)
-  commits_per_file = [finder(filename) for filename in diff_files]
+  if cache_dir and not os.path.isdir(cache_dir):
+    os.makedirs(cache_dir)
+  finder = CommitFinder(working_dir, upstream, downstream, cache_dir,
+                        diff_files)
+  pool = multiprocessing.Pool(jobs)
+  try:
+    commits_per_file = pool.map(finder, diff_files)
+  finally:
+    pool.close()
+    pool.join()
 
   for commits in commits_per_file:
     insertion_commits.update(commits)
@@ -88,13 +203,18 @@ def find_insertion_commits(upstream, downstream, working_dir):
   return insertion_commits
 
 
-def find(upstream, downstream, working_dir):
+def find(upstream, downstream, working_dir, visible_only=False, jobs=None,
+         cache_dir=None):
   """Finds downstream commits that are not upstream and are visible in the diff.
 
   Args:
     upstream: Upstream branch to be used as a baseline.
     downstream: Downstream branch to search for commits missing upstream.
     working_dir: Run as if git was started in thid directory.
+    visible_only: Only keep the commits that insert lines in the diff, which
+      are found with find_insertion_commits.
+    jobs: Number of files blamed in parallel if visible_only is set.
+    cache_dir: Directory to cache the blamed commits if visible_only is set.
 
   Returns:
     A set of downstream commits missing upstream.
@@ -103,6 +223,9 @@ def find(upstream, downstream, working_dir):
   revlist_output = git(['-C', working_dir, 'rev-list', '--no-merges',
                         '%s..%s' % (upstream, downstream)])
   downstream_only_commits = set(revlist_output.splitlines())
+  if visible_only:
+    downstream_only_commits &= find_insertion_commits(
+        upstream, downstream, working_dir, jobs, cache_dir)
   # TODO(slobdell b/78283222) resolve commits not upstreamed that are purely reverts
   return downstream_only_commits
 
@@ -123,12 +246,33 @@ def main():
       '--working_directory',
       help='Run as if git was started in thid directory',
       default='.',)
+  parser.add_argument(
+      '--visible_only',
+      action='store_true',
+      help='Only list the commits that insert lines visible in the diff.',
+  )
+  parser.add_argument(
+      '-j',
+      '--jobs',
+      type=int,
+      help='Number of files blamed in parallel with --visible_only, '
+      'defaults to the number of CPUs.',
+  )
+  parser.add_argument(
+      '--cache_dir',
+      nargs='?',
+      const=DEFAULT_CACHE_DIR,
+      help='Cache the commits blamed with --visible_only across runs, in %s '
+      'if no directory is given.' % DEFAULT_CACHE_DIR,
+  )
   args = parser.parse_args()
   upstream = args.upstream
   downstream = args.downstream
   working_dir = os.path.abspath(args.working_directory)
 
-  print('\n'.join(find(upstream, downstream, working_dir)))
+  commits = find(upstream, downstream, working_dir, args.visible_only,
+                 args.jobs, args.cache_dir)
+  print('\n'.join(commit.decode('utf-8') for commit in commits))
 
 
 if __name__ == '__main__':
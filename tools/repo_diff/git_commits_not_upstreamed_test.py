@@ -0,0 +1,136 @@
+"""Tests for git_commits_not_upstreamed."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import git_commits_not_upstreamed
+
+
+def git(working_dir, args):
+  return subprocess.check_output(['git', '-C', working_dir] + args)
+
+
+def blame_commits(working_dir, upstream, downstream):
+  """Finds insertion commits from the first field of 'git blame -l'."""
+  commits = set()
+  for filename in git(working_dir, ['diff', '--name-only', '--diff-filter=d',
+                                    upstream, downstream]).splitlines():
+    for line in git(working_dir, ['blame', '-l',
+                                  '%s..%s' % (upstream, downstream), '--',
+                                  filename]).splitlines():
+      commits.add(line.split(b' ', 1)[0])
+  return commits
+
+
+class FindInsertionCommitsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    self.repo = os.path.join(self.temp_dir, 'repo')
+    os.mkdir(self.repo)
+    git(self.repo, ['init', '-q'])
+    git(self.repo, ['config', 'user.email', 'dev@example.com'])
+    git(self.repo, ['config', 'user.name', 'Dev'])
+
+    # upstream has a few files, downstream modifies, adds and deletes some.
+    for i in range(5):
+      self.write('file%d.txt' % i, ''.join('line %d\n' % j for j in range(10)))
+    self.write('dir with space/file.txt', 'upstream\n')
+    self.commit('upstream')
+    git(self.repo, ['branch', 'upstream'])
+    for i in range(3):
+      self.write('file%d.txt' % i, 'downstream %d\n' % i, append=True)
+      self.commit('downstream %d' % i)
+    self.write('new.txt', 'new\n')
+    self.write('dir with space/file.txt', 'downstream\n', append=True)
+    self.commit('add new.txt')
+    git(self.repo, ['rm', '-q', 'file4.txt'])
+    self.commit('delete file4.txt')
+
+  def write(self, filename, content, append=False):
+    path = os.path.join(self.repo, filename)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, 'a' if append else 'w') as f:
+      f.write(content)
+
+  def commit(self, message):
+    git(self.repo, ['add', '-A'])
+    git(self.repo, ['commit', '-q', '-m', message])
+
+  def test_same_as_blame(self):
+    expected = blame_commits(self.repo, 'upstream', 'HEAD')
+    # Boundary commits are included like in 'git blame -l'
+    self.assertTrue(any(commit.startswith(b'^') for commit in expected))
+    for jobs in [1, 4]:
+      self.assertEqual(
+          git_commits_not_upstreamed.find_insertion_commits(
+              'upstream', 'HEAD', self.repo, jobs=jobs),
+          expected)
+
+  def test_cache(self):
+    cache_dir = os.path.join(self.temp_dir, 'cache')
+    expected = blame_commits(self.repo, 'upstream', 'HEAD')
+    self.assertEqual(
+        git_commits_not_upstreamed.find_insertion_commits(
+            'upstream', 'HEAD', self.repo, jobs=1, cache_dir=cache_dir),
+        expected)
+    self.assertEqual(len(os.listdir(cache_dir)), 5)
+
+    # Only the changed file is blamed again, into a new cache entry.
+    self.write('file0.txt', 'more\n', append=True)
+    self.commit('change file0.txt')
+    entries = set(os.listdir(cache_dir))
+    self.assertEqual(
+        git_commits_not_upstreamed.find_insertion_commits(
+            'upstream', 'HEAD', self.repo, jobs=1, cache_dir=cache_dir),
+        blame_commits(self.repo, 'upstream', 'HEAD'))
+    self.assertEqual(len(set(os.listdir(cache_dir)) - entries), 1)
+
+    # Cached entries are used as they are.
+    for entry in os.listdir(cache_dir):
+      with open(os.path.join(cache_dir, entry), 'wb') as f:
+        f.write(b'cached\n')
+    self.assertEqual(
+        git_commits_not_upstreamed.find_insertion_commits(
+            'upstream', 'HEAD', self.repo, jobs=1, cache_dir=cache_dir),
+        set([b'cached']))
+
+  def test_cache_reworded(self):
+    cache_dir = os.path.join(self.temp_dir, 'cache')
+    git_commits_not_upstreamed.find_insertion_commits(
+        'upstream', 'HEAD', self.repo, jobs=1, cache_dir=cache_dir)
+
+    # The blobs are the same, but the commits that inserted the lines are
+    # rewritten.
+    git(self.repo, ['rebase', '-q', '--exec',
+                    'git commit -q --amend -m reworded', 'upstream'])
+    self.assertEqual(
+        git_commits_not_upstreamed.find_insertion_commits(
+            'upstream', 'HEAD', self.repo, jobs=1, cache_dir=cache_dir),
+        blame_commits(self.repo, 'upstream', 'HEAD'))
+
+  def test_find_visible_only(self):
+    # A commit reverted downstream is not visible in the diff.
+    self.write('file3.txt', 'reverted\n', append=True)
+    self.commit('add a line to file3.txt')
+    git(self.repo, ['revert', '--no-edit', 'HEAD'])
+    commits = git_commits_not_upstreamed.find('upstream', 'HEAD', self.repo)
+    self.assertEqual(len(commits), 7)
+    visible = git_commits_not_upstreamed.find(
+        'upstream', 'HEAD', self.repo, visible_only=True, jobs=1)
+    # Neither is the commit that only deletes file4.txt.
+    self.assertEqual(
+        visible,
+        set(git(self.repo, ['rev-list', 'upstream..HEAD~3']).splitlines()))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -72,6 +72,40 @@ def git(args):
     return subprocess.check_output(command, stderr=devull)
 
 
+def get_commits_metadata(directory, commits):
+  """Retrieves the author email and subject of many commits.
+
+  All the commits are read by a single git process.
+
+  Args:
+    directory: A path to the git directory of the commits.
+    commits: A list of commit hashes.
+
+  Returns:
+    A dict of (author email, subject) keyed by commit hash.
+  """
+  if not commits:
+    return {}
+
+  command = ['git', '-C', directory, 'log', '--no-walk=unsorted', '--stdin',
+             '--no-patch', '--format=%H%x00%ae%x00%s%x00']
+  with open(os.devnull, 'w') as devnull:
+    process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=devnull)
+    output, _ = process.communicate(b'\n'.join(commits) + b'\n')
+  if process.returncode:
+    raise subprocess.CalledProcessError(process.returncode, command)
+
+  # Each commit is formatted as 3 fields ending with a NUL byte, followed by
+  # a line break
+  fields = output.split(b'\0')
+  metadata = {}
+  for i in range(0, len(fields) - 2, 3):
+    commit = fields[i].strip()
+    metadata[commit] = (fields[i + 1].strip(), fields[i + 2].strip())
+  return metadata
+
+
 def get_revision_diff_stats(directory, rev_a, rev_b):
   """Retrieves stats of diff between two git revisions.
 
@@ -348,12 +382,10 @@ def get_commit_stats_in_project(project):
   print('Finding commits not upstreamed in ' + name)
   commits = git_commits_not_upstreamed.find('FETCH_HEAD', 'HEAD', path)
   print('Found commits not upstreamed in ' + name)
+  metadata = get_commits_metadata(path, list(commits))
   stats = []
   for commit in commits:
-    author = git(['-C', path, 'show', '--no-patch', '--format=%ae', commit])
-    author = author.strip()
-    subject = git(['-C', path, 'show', '--no-patch', '--format=%s', commit])
-    subject = subject.strip()
+    author, subject = metadata[commit]
     stats.append({
         'commit': commit,
         'author': author,
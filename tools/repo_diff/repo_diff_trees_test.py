@@ -0,0 +1,75 @@
+"""Tests for repo_diff_trees."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import repo_diff_trees
+
+
+def git(working_dir, args):
+  return subprocess.check_output(['git', '-C', working_dir] + args)
+
+
+class GetCommitsMetadataTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+    self.repo = os.path.join(self.temp_dir, 'repo')
+    os.mkdir(self.repo)
+    git(self.repo, ['init', '-q'])
+    git(self.repo, ['config', 'user.name', 'Dev'])
+
+    messages = [
+        'plain subject',
+        '',
+        'multi-line\nsubject\n\nbody line 1\nbody line 2\n',
+        u'  non-ASCII \u00e9\u00e8\t\u65e5\u672c  ',
+        '\tleading tab\n\n\ttrailing tab\t',
+    ]
+    self.commits = []
+    for i, message in enumerate(messages):
+      git(self.repo, ['config', 'user.email', 'dev%d@example.com' % i])
+      git(self.repo, ['commit', '-q', '--allow-empty',
+                      '--allow-empty-message', '--cleanup=verbatim', '-m',
+                      message.encode('utf-8')])
+      self.commits.append(git(self.repo, ['rev-parse', 'HEAD']).strip())
+
+  def show(self, commit):
+    """Reads the metadata like the per-commit 'git show' calls did."""
+    author = git(self.repo, ['show', '--no-patch', '--format=%ae', commit])
+    subject = git(self.repo, ['show', '--no-patch', '--format=%s', commit])
+    return (author.strip(), subject.strip())
+
+  def test_same_as_show(self):
+    metadata = repo_diff_trees.get_commits_metadata(self.repo, self.commits)
+    self.assertEqual(sorted(metadata), sorted(self.commits))
+    for commit in self.commits:
+      self.assertEqual(metadata[commit], self.show(commit))
+    self.assertEqual(metadata[self.commits[1]], (b'dev1@example.com', b''))
+    self.assertEqual(metadata[self.commits[2]][1], b'multi-line subject')
+    self.assertEqual(metadata[self.commits[3]][1],
+                     u'non-ASCII \u00e9\u00e8\t\u65e5\u672c'.encode('utf-8'))
+
+  def test_subset(self):
+    commits = self.commits[3:0:-2]
+    metadata = repo_diff_trees.get_commits_metadata(self.repo, commits)
+    self.assertEqual(metadata,
+                     dict((commit, self.show(commit)) for commit in commits))
+
+  def test_no_commits(self):
+    self.assertEqual(repo_diff_trees.get_commits_metadata(self.repo, []), {})
+
+  def test_unknown_commit(self):
+    with self.assertRaises(subprocess.CalledProcessError):
+      repo_diff_trees.get_commits_metadata(self.repo, [b'0' * 40])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -25,6 +25,8 @@ import base64
 import json
 import os
 import sys
+import threading
+import time
 import xml.dom.minidom
 
 try:
@@ -36,40 +38,94 @@ except ImportError:
 try:
     # PY3
     from urllib.error import HTTPError
-    from urllib.parse import urlencode, urlparse
+    from urllib.parse import unquote, urlencode, urljoin, urlparse
     from urllib.request import (
-        HTTPBasicAuthHandler, HTTPHandler, OpenerDirector, Request,
-        build_opener
+        HTTPHandler, OpenerDirector, Request, build_opener, getproxies,
+        proxy_bypass
     )
     if _HAS_SSL:
         from urllib.request import HTTPSHandler
 except ImportError:
     # PY2
-    from urllib import urlencode
+    from urllib import getproxies, proxy_bypass, unquote, urlencode
     from urllib2 import (
-        HTTPBasicAuthHandler, HTTPError, HTTPHandler, OpenerDirector, Request,
-        build_opener
+        HTTPError, HTTPHandler, OpenerDirector, Request, build_opener
     )
     if _HAS_SSL:
         from urllib2 import HTTPSHandler
-    from urlparse import urlparse
+    from urlparse import urljoin, urlparse
 
 try:
-    from http.client import HTTPResponse
+    from http.client import HTTPConnection, HTTPException, HTTPResponse
+    if _HAS_SSL:
+        from http.client import HTTPSConnection
 except ImportError:
-    from httplib import HTTPResponse
+    from httplib import HTTPConnection, HTTPException, HTTPResponse
+    if _HAS_SSL:
+        from httplib import HTTPSConnection
 
 try:
     from urllib import addinfourl
     _HAS_ADD_INFO_URL = True
 except ImportError:
+    from urllib.response import addinfourl
     _HAS_ADD_INFO_URL = False
 
+try:
+    import queue  # PY3
+except ImportError:
+    import Queue as queue  # PY2
+
 try:
     from io import BytesIO
 except ImportError:
     from StringIO import StringIO as BytesIO
 
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # PY2 without the futures backport: run the tasks one at a time.
+
+    class _LazyFuture(object):
+        """A future that runs its task when its result is first asked for."""
+
+        def __init__(self, func, args, kwargs):
+            self._task = (func, args, kwargs)
+            self._result = None
+            self._error = None
+
+        def cancel(self):
+            """Don't run the task if it hasn't run yet."""
+            cancelled = self._task is not None
+            self._task = None
+            return cancelled
+
+        def result(self):
+            """Run the task if needed, and return or raise its outcome."""
+            if self._task is not None:
+                func, args, kwargs = self._task
+                self._task = None
+                try:
+                    self._result = func(*args, **kwargs)
+                except Exception as e:  # pylint: disable=broad-except
+                    self._error = e
+            if self._error is not None:
+                raise self._error
+            return self._result
+
+    class ThreadPoolExecutor(object):
+        """A serial stand-in for `concurrent.futures.ThreadPoolExecutor`."""
+
+        def __init__(self, max_workers=None):
+            pass
+
+        def submit(self, func, *args, **kwargs):
+            """Defer func(*args, **kwargs) until its result is asked for."""
+            return _LazyFuture(func, args, kwargs)
+
+        def shutdown(self, wait=True):
+            """Nothing runs in the background."""
+
 try:
     # PY3.5
     from subprocess import PIPE, run
@@ -213,6 +269,226 @@ if _HAS_SSL:
             return _handle_open_with_curl(self._curl_command_name, req)
 
 
+# Default maximum number of concurrent requests to the Gerrit server.
+DEFAULT_MAX_REQUESTS = 8
+
+# Default number of retries for a request failing with a transient error.
+DEFAULT_RETRIES = 3
+
+
+class KeepAliveURLOpener(object):
+    """A thread-safe URL opener that keeps HTTP/1.1 connections alive.
+
+    Up to `max_connections` connections are opened for each host.  Idle
+    connections are reused by later requests, so that a request doesn't pay
+    for a new TCP and TLS handshake.  Requests failing with a connection error
+    or a transient server error are retried with an exponential backoff.
+    Non-idempotent requests are only retried if they didn't reach the server.
+
+    Like `urllib`, the `http_proxy`, `https_proxy` and `no_proxy` environment
+    variables are honored.  HTTPS requests are tunneled through the proxy with
+    CONNECT.
+
+    Like `urllib`, `open()` returns a file-like response object and raises
+    `HTTPError` for error responses.
+    """
+
+    # Responses to non-idempotent requests that are safe to retry, because the
+    # server didn't process the request.
+    _RETRY_ALWAYS = (429, 503)
+
+    # Responses to idempotent requests that are worth retrying.
+    _RETRY_IDEMPOTENT = (500, 502, 504)
+
+    _IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+    _REDIRECT_STATUS = (301, 302, 303, 307, 308)
+
+    _MAX_REDIRECTS = 5
+
+    # Upper bound of the delay requested by a `Retry-After` header.
+    _MAX_RETRY_AFTER = 60
+
+    def __init__(self, max_connections=DEFAULT_MAX_REQUESTS,
+                 retries=DEFAULT_RETRIES,
+                 backoff=0.5, timeout=60):
+        # pylint: disable=too-many-arguments
+        self._max_connections = max_connections
+        self._retries = retries
+        self._backoff = backoff
+        self._timeout = timeout
+        self._credentials = {}
+        self._proxies = getproxies()
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+
+    def add_password(self, domain, username, password):
+        """Send the credentials to `domain` (the host[:port] of the URLs) with
+        HTTP basic authentication."""
+        token = base64.b64encode(
+            '{}:{}'.format(username, password).encode('utf-8'))
+        self._credentials[domain] = 'Basic ' + token.decode('ascii')
+
+    def _get_pool(self, scheme, netloc):
+        """Get the (semaphore, idle connections) pair of a host."""
+        with self._pools_lock:
+            key = (scheme, netloc)
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = (threading.BoundedSemaphore(self._max_connections),
+                        queue.LifoQueue())
+                self._pools[key] = pool
+            return pool
+
+    def _get_proxy(self, scheme, host):
+        """Get the proxy for a host as a 2-tuple of (netloc, proxy headers),
+        or None to connect to the host directly."""
+        proxy = self._proxies.get(scheme)
+        if not proxy or proxy_bypass(host):
+            return None
+        if '://' not in proxy:
+            proxy = 'http://' + proxy
+        proxy = urlparse(proxy)
+        netloc = proxy.netloc.rpartition('@')[2]
+        proxy_headers = {}
+        if proxy.username:
+            token = base64.b64encode('{}:{}'.format(
+                unquote(proxy.username),
+                unquote(proxy.password or '')).encode('utf-8'))
+            proxy_headers['Proxy-Authorization'] = (
+                'Basic ' + token.decode('ascii'))
+        return netloc, proxy_headers
+
+    def _new_connection(self, scheme, netloc, proxy):
+        """Create a connection to a host, through `proxy` if it isn't None."""
+        if scheme == 'http':
+            if proxy:
+                return HTTPConnection(proxy[0], timeout=self._timeout)
+            return HTTPConnection(netloc, timeout=self._timeout)
+        if scheme == 'https' and _HAS_SSL:
+            if proxy:
+                conn = HTTPSConnection(proxy[0], timeout=self._timeout)
+                conn.set_tunnel(netloc, headers=proxy[1])
+                return conn
+            return HTTPSConnection(netloc, timeout=self._timeout)
+        raise ValueError('unsupported URL scheme: ' + scheme)
+
+    def _send_once(self, method, url, headers, data):
+        """Send a request over a pooled connection and read the response.
+
+        Returns a 4-tuple of (status, reason, headers, body).  Connection
+        errors have a `request_sent` attribute, which is False if the request
+        couldn't have reached the server.
+        """
+        parsed = urlparse(url)
+        proxy = self._get_proxy(parsed.scheme, parsed.hostname)
+        if proxy and parsed.scheme == 'http':
+            # Plain HTTP proxies take the full URL and the credentials with
+            # each request.
+            path = url
+            headers = dict(headers, **proxy[1])
+        else:
+            path = parsed.path or '/'
+            if parsed.query:
+                path += '?' + parsed.query
+
+        slots, idle = self._get_pool(parsed.scheme, parsed.netloc)
+        slots.acquire()
+        try:
+            try:
+                conn = idle.get_nowait()
+            except queue.Empty:
+                conn = self._new_connection(parsed.scheme, parsed.netloc,
+                                            proxy)
+            request_sent = False
+            try:
+                conn.request(method, path, data, headers)
+                request_sent = True
+                response = conn.getresponse()
+                body = response.read()
+                if response.will_close:
+                    conn.close()
+            except (HTTPException, IOError) as e:
+                # The connection is in an unknown state.  Close the socket, so
+                # that the connection reconnects on the next request.
+                conn.close()
+                e.request_sent = request_sent
+                raise
+            except:
+                conn.close()
+                raise
+            finally:
+                # The connection is only given back once it is closed or
+                # ready for the next request.
+                idle.put(conn)
+            return (response.status, response.reason, response.msg, body)
+        finally:
+            slots.release()
+
+    def _get_retry_delay(self, attempt, headers):
+        """Compute the delay before the next attempt."""
+        retry_after = headers.get('Retry-After') if headers else None
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), self._MAX_RETRY_AFTER)
+        return self._backoff * (2 ** attempt)
+
+    def _send(self, method, url, headers, data):
+        """Send a request and retry on connection errors and transient server
+        errors."""
+        idempotent = method in self._IDEMPOTENT_METHODS
+        retry_status = self._RETRY_ALWAYS
+        if idempotent:
+            retry_status += self._RETRY_IDEMPOTENT
+
+        attempt = 0
+        while True:
+            try:
+                result = self._send_once(method, url, headers, data)
+            except (HTTPException, IOError) as e:
+                # The server may have processed a request that was sent, even
+                # if the response was lost.
+                if attempt >= self._retries or (
+                        not idempotent and getattr(e, 'request_sent', True)):
+                    raise
+                res_headers = None
+            else:
+                if result[0] not in retry_status or attempt >= self._retries:
+                    return result
+                res_headers = result[2]
+            time.sleep(self._get_retry_delay(attempt, res_headers))
+            attempt += 1
+
+    def open(self, url, data=None):
+        """Open an URL string or a `Request` object."""
+        if not isinstance(url, Request):
+            url = Request(url, data)
+
+        method = url.get_method()
+        full_url = url.get_full_url()
+        headers = dict(url.header_items())
+        data = url.data
+
+        for _ in range(self._MAX_REDIRECTS + 1):
+            auth = self._credentials.get(urlparse(full_url).netloc)
+            if auth and 'Authorization' not in headers:
+                headers['Authorization'] = auth
+
+            status, reason, res_headers, body = self._send(
+                method, full_url, headers, data)
+
+            location = res_headers.get('Location')
+            if (status not in self._REDIRECT_STATUS or not location or
+                    method not in ('GET', 'HEAD')):
+                break
+            full_url = urljoin(full_url, location)
+            headers.pop('Authorization', None)
+
+        if status >= 400:
+            raise HTTPError(full_url, status, reason, res_headers,
+                            BytesIO(body))
+        return addinfourl(BytesIO(body), res_headers, full_url, status)
+
+
 def load_auth_credentials_from_file(cookie_file):
     """Load credentials from an opened .gitcookies file."""
     credentials = {}
@@ -286,21 +562,23 @@ def _find_auth_credentials(credentials, domain):
     raise KeyError('Domain {} not found'.format(domain))
 
 
-def create_url_opener(cookie_file_path, domain):
-    """Load username and password from .gitcookies and return a URL opener with
-    an authentication handler."""
+def create_url_opener(cookie_file_path, domain,
+                      max_connections=DEFAULT_MAX_REQUESTS,
+                      retries=DEFAULT_RETRIES):
+    """Load username and password from .gitcookies and return a keep-alive URL
+    opener which authenticates to `domain`."""
 
     # Load authentication credentials
     credentials = load_auth_credentials(cookie_file_path)
     username, password = _find_auth_credentials(credentials, domain)
 
-    # Create URL opener with authentication handler
-    auth_handler = HTTPBasicAuthHandler()
-    auth_handler.add_password(domain, domain, username, password)
-    return build_opener(auth_handler)
+    # Create URL opener with authentication credentials
+    url_opener = KeepAliveURLOpener(max_connections, retries)
+    url_opener.add_password(domain, username, password)
+    return url_opener
 
 
-def create_url_opener_from_args(args):
+def create_url_opener_from_args(args, retries=DEFAULT_RETRIES):
     """Create URL opener from command line arguments."""
 
     if args.use_curl:
@@ -315,7 +593,8 @@ def create_url_opener_from_args(args):
     domain = urlparse(args.gerrit).netloc
 
     try:
-        return create_url_opener(args.gitcookies, domain)
+        return create_url_opener(args.gitcookies, domain, args.max_requests,
+                                 retries)
     except KeyError:
         print('error: Cannot find the domain "{}" in "{}". '
               .format(domain, args.gitcookies), file=sys.stderr)
@@ -383,37 +662,71 @@ def _query_change_lists(url_opener, gerrit, query_string, start, count):
     finally:
         response_file.close()
 
-def query_change_lists(url_opener, gerrit, query_string, start, count):
+def query_change_lists(url_opener, gerrit, query_string, start, count,
+                       max_requests=DEFAULT_MAX_REQUESTS):
     """Query change lists from the Gerrit server.
 
     This function queries the Gerrit server based on the input parameters for a
     list of changes.  This function handles querying the server multiple times
     if necessary and combining the results that are returned to the caller.
 
+    The server returns at most a server-defined number of changes per query.
+    Once the first page reveals this page size, up to `max_requests` following
+    pages are prefetched concurrently.  A page is only used if it starts right
+    after the changes that have been collected, so the result is the same as
+    querying the pages one after another.
+
     Args:
         url_opener:  URL opener for request
         gerrit: Gerrit server URL
         query_string: Gerrit query string to select changes
         start: Number of changes to be skipped from the beginning
         count: Maximum number of changes to return
+        max_requests: Maximum number of concurrent requests
 
     Returns:
         List of changes
     """
+    end = start + count
     changes = []
-    while len(changes) < count:
-        chunk = _query_change_lists(url_opener, gerrit, query_string,
-                                    start + len(changes), count - len(changes))
-        if not chunk:
-            break
-
-        changes += chunk
-
-        # The last change object contains a _more_changes attribute if the
-        # number of changes exceeds the query parameter or the internal server
-        # limit.  Stop iteration if `_more_changes` attribute doesn't exist.
-        if '_more_changes' not in chunk[-1]:
-            break
+    pages = {}
+    executor = ThreadPoolExecutor(max(max_requests, 1))
+    try:
+        while len(changes) < count:
+            page_start = start + len(changes)
+            page = pages.pop(page_start, None)
+            if page is None:
+                page = executor.submit(_query_change_lists, url_opener, gerrit,
+                                       query_string, page_start,
+                                       end - page_start)
+            chunk = page.result()
+            if not chunk:
+                break
+
+            changes += chunk
+
+            # The last change object contains a _more_changes attribute if the
+            # number of changes exceeds the query parameter or the internal
+            # server limit.  Stop iteration if `_more_changes` attribute
+            # doesn't exist.
+            if '_more_changes' not in chunk[-1]:
+                break
+
+            # Prefetch the following pages, assuming that the server returns
+            # as many changes per page as this one.
+            page_size = len(chunk)
+            for i in range(max_requests):
+                page_start = start + len(changes) + i * page_size
+                if page_start >= end:
+                    break
+                if page_start not in pages:
+                    pages[page_start] = executor.submit(
+                        _query_change_lists, url_opener, gerrit, query_string,
+                        page_start, min(page_size, end - page_start))
+    finally:
+        for page in pages.values():
+            page.cancel()
+        executor.shutdown()
 
     return changes
 
@@ -568,6 +881,28 @@ def get_patch(url_opener, gerrit_url, change_id, revision_id='current'):
     finally:
         response_file.close()
 
+
+def get_patches(url_opener, gerrit_url, change_ids, revision_id='current',
+                max_requests=DEFAULT_MAX_REQUESTS):
+    """Download the patch files of several change lists concurrently.
+
+    Returns an iterator of patch files in the order of `change_ids`.
+    """
+
+    executor = ThreadPoolExecutor(max(max_requests, 1))
+    patches = []
+    try:
+        for change_id in change_ids:
+            patches.append(executor.submit(get_patch, url_opener, gerrit_url,
+                                           change_id, revision_id))
+        for patch in patches:
+            yield patch.result()
+    finally:
+        for patch in patches:
+            patch.cancel()
+        executor.shutdown()
+
+
 def find_gerrit_name():
     """Find the gerrit instance specified in the default remote."""
     manifest_cmd = ['repo', 'manifest']
@@ -599,6 +934,9 @@ def add_common_parse_args(parser):
                         help='Max number of change lists')
     parser.add_argument('--start', default=0, type=int,
                         help='Skip first N changes in query')
+    parser.add_argument('--max-requests', default=DEFAULT_MAX_REQUESTS,
+                        type=int,
+                        help='Max number of concurrent Gerrit requests')
     parser.add_argument(
         '--use-curl',
         help='Send requests with the specified curl command (e.g. `curl`)')
@@ -629,7 +967,8 @@ def main():
     # Query change lists
     url_opener = create_url_opener_from_args(args)
     change_lists = query_change_lists(
-        url_opener, args.gerrit, args.query, args.start, args.limits)
+        url_opener, args.gerrit, args.query, args.start, args.limits,
+        args.max_requests)
 
     # Print the result
     if args.format == 'json':
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+#
+# Copyright (C) 2026 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the Gerrit Restful API client library."""
+
+import base64
+import json
+import os
+import socket
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlparse
+
+import gerrit
+
+
+class FakeGerritHandler(BaseHTTPRequestHandler):
+    """Serves the Gerrit APIs used by the client from `server.changes`."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _send(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(body)))
+        if self.server.close_connections:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, obj):
+        self._send(200, b")]}'\n" + json.dumps(obj).encode('utf-8'))
+
+    def _check_request(self):
+        """Count the request, fail it if requested and check credentials."""
+        with self.server.lock:
+            self.server.requests.append(self.path)
+            self.server.proxy_authorization = self.headers.get(
+                'Proxy-Authorization')
+            delay = self.server.delays.pop(0) if self.server.delays else 0
+        # Delay the response past the timeout of the client.
+        time.sleep(delay)
+        with self.server.lock:
+            if self.server.failures:
+                self.server.failures -= 1
+                self._send(503, b'try again')
+                return False
+        if self.headers.get('Authorization') != self.server.authorization:
+            self._send(401, b'unauthorized')
+            return False
+        return True
+
+    def do_GET(self):
+        # pylint: disable=invalid-name
+        if not self._check_request():
+            return
+        url = urlparse(self.path)
+        if url.path == '/a/changes/':
+            query = parse_qs(url.query)
+            start = int(query['start'][0])
+            count = min(int(query['n'][0]), self.server.page_size)
+            chunk = [dict(change) for change in
+                     self.server.changes[start:start + count]]
+            if chunk and start + count < len(self.server.changes):
+                chunk[-1]['_more_changes'] = True
+            self._send_json(chunk)
+        elif url.path.endswith('/revisions/current/patch'):
+            change_id = url.path.split('/')[3]
+            self._send(200, base64.b64encode(change_id.encode('utf-8')))
+        else:
+            self._send(404, b'not found')
+
+    def do_POST(self):
+        # pylint: disable=invalid-name
+        self.rfile.read(int(self.headers['Content-Length']))
+        if self._check_request():
+            self._send(409, b'change is closed')
+
+
+class GerritTest(unittest.TestCase):
+    """Tests the Gerrit client against a fake Gerrit server."""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGerritHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.changes = [{'_number': i, 'id': 'change{}'.format(i)}
+                               for i in range(250)]
+        self.server.page_size = 20
+        self.server.connections = 0
+        self.server.requests = []
+        self.server.failures = 0
+        self.server.delays = []
+        self.server.close_connections = False
+        self.server.proxy_authorization = None
+        self.server.authorization = 'Basic ' + base64.b64encode(
+            b'user:secret').decode('ascii')
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        host, port = self.server.server_address
+        self.domain = '{}:{}'.format(host, port)
+        self.gerrit = 'http://' + self.domain
+
+    def create_url_opener(self, max_connections=4, retries=3, timeout=60):
+        url_opener = gerrit.KeepAliveURLOpener(
+            max_connections, retries=retries, backoff=0.01, timeout=timeout)
+        url_opener.add_password(self.domain, 'user', 'secret')
+        return url_opener
+
+    def query(self, url_opener, start, count, max_requests=4):
+        changes = gerrit.query_change_lists(
+            url_opener, self.gerrit, 'topic:test', start, count, max_requests)
+        return [change['_number'] for change in changes]
+
+    def test_query_change_lists(self):
+        url_opener = self.create_url_opener()
+        for start, count in [(0, 1000), (0, 250), (0, 100), (5, 47), (230, 30),
+                             (250, 10), (0, 20), (3, 1)]:
+            expected = list(range(start, min(start + count, 250)))
+            for max_requests in [1, 4]:
+                self.assertEqual(
+                    self.query(url_opener, start, count, max_requests),
+                    expected)
+
+    def test_keep_alive(self):
+        url_opener = self.create_url_opener(max_connections=4)
+        self.assertEqual(self.query(url_opener, 0, 1000), list(range(250)))
+        self.assertGreaterEqual(len(self.server.requests), 13)
+        self.assertLessEqual(self.server.connections, 4)
+
+    def test_retry(self):
+        self.server.failures = 2
+        url_opener = self.create_url_opener()
+        self.assertEqual(self.query(url_opener, 0, 50), list(range(50)))
+
+        self.server.failures = 1
+        url_opener = self.create_url_opener(retries=0)
+        with self.assertRaises(HTTPError) as context:
+            self.query(url_opener, 0, 50)
+        self.assertEqual(context.exception.code, 503)
+
+    def test_unauthorized(self):
+        url_opener = gerrit.KeepAliveURLOpener()
+        with self.assertRaises(HTTPError) as context:
+            self.query(url_opener, 0, 50)
+        self.assertEqual(context.exception.code, 401)
+
+    def test_get_patches(self):
+        url_opener = self.create_url_opener()
+        change_ids = ['change{}'.format(i) for i in range(30)]
+        self.assertEqual(
+            list(gerrit.get_patches(url_opener, self.gerrit, change_ids)),
+            [change_id.encode('utf-8') for change_id in change_ids])
+
+    def test_post_error(self):
+        url_opener = self.create_url_opener()
+        code, body, res_json = gerrit.submit(url_opener, self.gerrit, 'change0')
+        self.assertEqual(code, 409)
+        self.assertEqual(body, b'change is closed')
+        self.assertIsNone(res_json)
+
+
+    def test_connection_close(self):
+        self.server.close_connections = True
+        url_opener = self.create_url_opener(max_connections=1, retries=0)
+        self.assertEqual(self.query(url_opener, 0, 100), list(range(100)))
+        self.assertEqual(self.server.connections, len(self.server.requests))
+
+    def test_retry_timeout(self):
+        # Idempotent requests are retried after a read timeout.
+        self.server.delays = [0.5]
+        url_opener = self.create_url_opener(retries=1, timeout=0.2)
+        self.assertEqual(self.query(url_opener, 0, 10), list(range(10)))
+        self.assertEqual(len(self.server.requests), 2)
+
+        # Other requests may have been processed, so they are not retried.
+        self.server.requests = []
+        self.server.delays = [0.5]
+        with self.assertRaises(socket.timeout):
+            gerrit.submit(url_opener, self.gerrit, 'change0')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_retry_before_sent(self):
+        # Requests that didn't reach the server are retried, whatever their
+        # method is.
+        url_opener = self.create_url_opener(retries=2)
+        connect = gerrit.HTTPConnection.connect
+        attempts = []
+
+        def fail_once(conn):
+            attempts.append(conn)
+            if len(attempts) == 1:
+                raise ConnectionRefusedError()
+            connect(conn)
+
+        with mock.patch.object(gerrit.HTTPConnection, 'connect', fail_once):
+            code, _, _ = gerrit.submit(url_opener, self.gerrit, 'change0')
+        self.assertEqual(code, 409)
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_proxy(self):
+        proxy_env = {'http_proxy': 'http://proxy%40user:secret@' + self.domain,
+                     'no_proxy': ''}
+        with mock.patch.dict(os.environ, proxy_env):
+            url_opener = self.create_url_opener()
+            url_opener.add_password('gerrit.invalid', 'user', 'secret')
+            changes = gerrit.query_change_lists(
+                url_opener, 'http://gerrit.invalid', 'topic:test', 0, 30)
+        self.assertEqual([change['_number'] for change in changes],
+                         list(range(30)))
+        self.assertTrue(self.server.requests[0].startswith(
+            'http://gerrit.invalid/a/changes/?'))
+        self.assertEqual(
+            self.server.proxy_authorization,
+            'Basic ' + base64.b64encode(b'proxy@user:secret').decode('ascii'))
+
+        # Hosts in no_proxy are connected to directly.
+        self.server.requests = []
+        proxy_env = {'http_proxy': 'http://proxy.invalid:1',
+                     'no_proxy': '127.0.0.1'}
+        with mock.patch.dict(os.environ, proxy_env):
+            url_opener = self.create_url_opener()
+            self.assertEqual(self.query(url_opener, 0, 30), list(range(30)))
+        self.assertTrue(self.server.requests[0].startswith('/a/changes/?'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -27,7 +27,7 @@ import sys
 
 from gerrit import (
     add_common_parse_args, create_url_opener_from_args, find_gerrit_name,
-    normalize_gerrit_name, query_change_lists, get_patch
+    normalize_gerrit_name, query_change_lists, get_patches
 )
 
 def _parse_args():
@@ -54,17 +54,21 @@ def main():
     # Query change lists
     url_opener = create_url_opener_from_args(args)
     change_lists = query_change_lists(
-        url_opener, args.gerrit, args.query, args.start, args.limits)
+        url_opener, args.gerrit, args.query, args.start, args.limits,
+        args.max_requests)
 
     # Download patch files
     num_changes = len(change_lists)
     num_changes_width = len(str(num_changes))
-    for i, change in enumerate(change_lists, start=1):
+    patch_files = get_patches(
+        url_opener, args.gerrit, [change['id'] for change in change_lists],
+        max_requests=args.max_requests)
+    for i, (change, patch_file) in enumerate(
+            zip(change_lists, patch_files), start=1):
         print('{:>{}}/{} | {} {}'.format(
             i, num_changes_width, num_changes, change['_number'],
             change['subject']))
 
-        patch_file = get_patch(url_opener, args.gerrit, change['id'])
         with open('{}.patch'.format(change['_number']), 'wb') as output_file:
             output_file.write(patch_file)
 
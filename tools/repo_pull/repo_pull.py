@@ -427,7 +427,7 @@ def _get_change_lists_from_args(args):
     """Query the change lists by args."""
     url_opener = create_url_opener_from_args(args)
     return query_change_lists(url_opener, args.gerrit, args.query, args.start,
-                              args.limits)
+                              args.limits, args.max_requests)
 
 
 def _get_local_branch_name_from_args(args):
@@ -24,16 +24,24 @@ import argparse
 import json
 import os
 import sys
+import threading
+import time
 
 try:
     from urllib.error import HTTPError  # PY3
 except ImportError:
     from urllib2 import HTTPError  # PY2
 
+try:
+    from http.client import HTTPException  # PY3
+except ImportError:
+    from httplib import HTTPException  # PY2
+
 from gerrit import (
-    abandon, add_common_parse_args, add_reviewers, create_url_opener_from_args,
-    delete, delete_reviewer, delete_topic, find_gerrit_name, normalize_gerrit_name,
-    query_change_lists, restore, set_hashtags, set_review, set_topic, submit
+    DEFAULT_RETRIES, ThreadPoolExecutor, abandon, add_common_parse_args,
+    add_reviewers, create_url_opener_from_args, delete, delete_reviewer,
+    delete_topic, find_gerrit_name, normalize_gerrit_name, query_change_lists,
+    restore, set_hashtags, set_review, set_topic, submit
 )
 
 
@@ -114,6 +122,16 @@ def _parse_args():
     parser.add_argument('--delete-reviewer', action='append', default=[],
                         help='Delete reviewer')
 
+    parser.add_argument('--rate', type=float, default=10,
+                        help='Max number of review requests per second '
+                             '(0 for no limit)')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help='Number of retries for a request failing with a '
+                             'transient error')
+    parser.add_argument('--journal',
+                        help='Record completed review requests to this file '
+                             'and skip the ones recorded by a previous run')
+
     return parser.parse_args()
 
 
@@ -155,7 +173,8 @@ def _print_error(change, res_code, res_body, res_json):
     print('Project:', project, file=sys.stderr)
     print('Change-Id:', change_id, file=sys.stderr)
     print('Subject:', subject, file=sys.stderr)
-    print('HTTP status code:', res_code, file=sys.stderr)
+    if res_code is not None:
+        print('HTTP status code:', res_code, file=sys.stderr)
     if res_json:
         print(_SEP, file=sys.stderr)
         json.dump(res_json, sys.stderr, indent=4,
@@ -167,17 +186,181 @@ def _print_error(change, res_code, res_body, res_json):
     print(_SEP_SPLIT, file=sys.stderr)
 
 
-def _do_task(change, func, *args, **kwargs):
-    """Process a task and report errors when necessary."""
+class ReviewTask(object):
+    """A review operation to be applied to every change list."""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, func, args=(), expected_http_code=200):
+        self.func = func
+        self.args = tuple(args)
+        self.expected_http_code = expected_http_code
 
-    res_code, res_body, res_json = func(*args)
+        # The key identifies the task in the journal, so that a task with
+        # different arguments is not mistaken for a completed one.
+        self.key = json.dumps([func.__name__, self.args], sort_keys=True)
 
-    if res_code != kwargs.get('expected_http_code', 200):
-        _print_error(change, res_code, res_body, res_json)
 
-        errors = kwargs.get('errors')
-        if errors is not None:
-            errors['num_errors'] += 1
+def _get_tasks_from_args(args):
+    """Collect the review tasks from args in the order to be applied."""
+
+    tasks = []
+    if args.label or args.message:
+        tasks.append(ReviewTask(set_review,
+                                (_get_labels_from_args(args), args.message)))
+    if args.add_hashtag or args.remove_hashtag:
+        tasks.append(ReviewTask(set_hashtags,
+                                (args.add_hashtag, args.remove_hashtag)))
+    if args.set_topic:
+        tasks.append(ReviewTask(set_topic, (args.set_topic,)))
+    if args.delete_topic:
+        tasks.append(ReviewTask(delete_topic, expected_http_code=204))
+    if args.submit:
+        tasks.append(ReviewTask(submit))
+    if args.abandon:
+        tasks.append(ReviewTask(abandon, (args.abandon,)))
+    if args.restore:
+        tasks.append(ReviewTask(restore))
+    if args.delete:
+        tasks.append(ReviewTask(delete))
+    if args.add_reviewer:
+        new_reviewers = [{'reviewer': name} for name in args.add_reviewer]
+        tasks.append(ReviewTask(add_reviewers, (new_reviewers,)))
+    for name in args.delete_reviewer:
+        tasks.append(ReviewTask(delete_reviewer, (name,),
+                                expected_http_code=204))
+    return tasks
+
+
+class RateLimiter(object):
+    """Spread the requests of all threads at most `rate` per second."""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, rate):
+        self._interval = 1.0 / rate if rate else 0.0
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Wait for the next request slot."""
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.time()
+            delay = self._next_time - now
+            self._next_time = max(self._next_time, now) + self._interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Journal(object):
+    """A JSON lines file which records the completed tasks.
+
+    Each line is a JSON object with the `change` ID and the `task` key.  Lines
+    are appended as soon as tasks complete, so that an interrupted run can be
+    resumed by skipping the recorded tasks.
+    """
+
+    def __init__(self, path):
+        self._completed = set()
+        self._lock = threading.Lock()
+
+        line = ''
+        if os.path.exists(path):
+            with open(path, 'r') as journal_file:
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line may be truncated by an interruption.
+                        continue
+                    self._completed.add((entry['change'], entry['task']))
+
+        self._file = open(path, 'a')
+        if line and not line.endswith('\n'):
+            # Terminate the truncated line before appending new entries.
+            self._file.write('\n')
+
+    def is_completed(self, change_id, task):
+        """Check whether a task has been completed by a previous run."""
+        return (change_id, task.key) in self._completed
+
+    def record(self, change_id, task):
+        """Record a completed task."""
+        line = json.dumps({'change': change_id, 'task': task.key})
+        with self._lock:
+            self._completed.add((change_id, task.key))
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        """Close the journal file."""
+        self._file.close()
+
+
+class ReviewExecutor(object):
+    """Apply review tasks to change lists with bounded concurrency.
+
+    Change lists are processed concurrently by `max_requests` threads, while
+    the tasks of a change list are applied in order.  Transient errors are
+    retried by `url_opener`, which knows whether a request is safe to resend.
+    """
+
+    def __init__(self, url_opener, gerrit, max_requests, rate=None,
+                 journal=None):
+        # pylint: disable=too-many-arguments
+        self._url_opener = url_opener
+        self._gerrit = gerrit
+        self._max_requests = max_requests
+        self._rate_limiter = RateLimiter(rate)
+        self._journal = journal
+        self._print_lock = threading.Lock()
+
+    def _do_task(self, change, task):
+        """Apply a task to a change list and report errors.
+
+        Returns whether the task succeeded.
+        """
+        self._rate_limiter.wait()
+        try:
+            res_code, res_body, res_json = task.func(
+                self._url_opener, self._gerrit, change['id'], *task.args)
+        except (HTTPException, IOError) as error:
+            # Connection errors which the URL opener gave up retrying.
+            res_code, res_body, res_json = (
+                None, str(error).encode('utf-8'), None)
+
+        if res_code == task.expected_http_code:
+            if self._journal:
+                self._journal.record(change['id'], task)
+            return True
+
+        with self._print_lock:
+            _print_error(change, res_code, res_body, res_json)
+        return False
+
+    def _do_tasks(self, change, tasks):
+        """Apply tasks to a change list and return the number of errors."""
+        num_errors = 0
+        for task in tasks:
+            if self._journal and self._journal.is_completed(change['id'], task):
+                continue
+            if not self._do_task(change, task):
+                num_errors += 1
+        return num_errors
+
+    def run(self, change_lists, tasks):
+        """Apply tasks to change lists and return the number of errors."""
+        executor = ThreadPoolExecutor(max(self._max_requests, 1))
+        futures = []
+        try:
+            for change in change_lists:
+                futures.append(executor.submit(self._do_tasks, change, tasks))
+            return sum(future.result() for future in futures)
+        finally:
+            # Don't start new change lists if interrupted.
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
 
 
 def main():
@@ -203,18 +386,16 @@ def main():
               file=sys.stderr)
         sys.exit(1)
 
-    # Convert label arguments
-    labels = _get_labels_from_args(args)
-
-    # Convert reviewer arguments
-    new_reviewers = [{'reviewer': name} for name in args.add_reviewer]
+    # Convert task arguments
+    tasks = _get_tasks_from_args(args)
 
     # Load authentication credentials
-    url_opener = create_url_opener_from_args(args)
+    url_opener = create_url_opener_from_args(args, args.retries)
 
     # Retrieve change lists
     change_lists = query_change_lists(
-        url_opener, args.gerrit, args.query, args.start, args.limits)
+        url_opener, args.gerrit, args.query, args.start, args.limits,
+        args.max_requests)
     if not change_lists:
         print('error: No matching change lists.', file=sys.stderr)
         sys.exit(1)
@@ -226,42 +407,22 @@ def main():
     _confirm('Do you want to continue?')
 
     # Post review votes
-    errors = {'num_errors': 0}
-    for change in change_lists:
-        if args.label or args.message:
-            _do_task(change, set_review, url_opener, args.gerrit, change['id'],
-                     labels, args.message, errors=errors)
-        if args.add_hashtag or args.remove_hashtag:
-            _do_task(change, set_hashtags, url_opener, args.gerrit,
-                     change['id'], args.add_hashtag, args.remove_hashtag,
-                     errors=errors)
-        if args.set_topic:
-            _do_task(change, set_topic, url_opener, args.gerrit, change['id'],
-                     args.set_topic, errors=errors)
-        if args.delete_topic:
-            _do_task(change, delete_topic, url_opener, args.gerrit,
-                     change['id'], expected_http_code=204, errors=errors)
-        if args.submit:
-            _do_task(change, submit, url_opener, args.gerrit, change['id'],
-                     errors=errors)
-        if args.abandon:
-            _do_task(change, abandon, url_opener, args.gerrit, change['id'],
-                     args.abandon, errors=errors)
-        if args.restore:
-            _do_task(change, restore, url_opener, args.gerrit, change['id'],
-                     errors=errors)
-        if args.delete:
-            _do_task(change, delete, url_opener, args.gerrit, change['id'],
-                     errors=errors)
-        if args.add_reviewer:
-            _do_task(change, add_reviewers, url_opener, args.gerrit,
-                     change['id'], new_reviewers, errors=errors)
-        for name in args.delete_reviewer:
-            _do_task(change, delete_reviewer, url_opener, args.gerrit,
-                     change['id'], name, expected_http_code=204, errors=errors)
-
-
-    if errors['num_errors']:
+    journal = Journal(args.journal) if args.journal else None
+    try:
+        executor = ReviewExecutor(url_opener, args.gerrit, args.max_requests,
+                                  args.rate, journal=journal)
+        num_errors = executor.run(change_lists, tasks)
+    except KeyboardInterrupt:
+        print('Interrupted', file=sys.stderr)
+        if journal:
+            print('Run the command again with `--journal {}` to resume'
+                  .format(args.journal), file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if journal:
+            journal.close()
+
+    if num_errors:
         sys.exit(1)
 
 
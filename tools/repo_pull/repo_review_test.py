@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+#
+# Copyright (C) 2026 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for the review executor of repo_review."""
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import gerrit
+import repo_review
+
+
+class FakeGerritHandler(BaseHTTPRequestHandler):
+    """Records review requests and fails them as `server.failures` says."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+
+        change_id = self.path.split('/')[3]
+        with self.server.lock:
+            self.server.requests.append((self.command, self.path))
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active,
+                                         self.server.active)
+            failures = self.server.failures.get(change_id, 0)
+            if failures:
+                self.server.failures[change_id] = failures - 1
+        time.sleep(0.01)
+        with self.server.lock:
+            self.server.active -= 1
+
+        if failures:
+            code, body = self.server.failure_status, b'internal error'
+        elif self.command == 'DELETE':
+            code, body = 204, b''
+        else:
+            code, body = 200, b")]}'\n{}"
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_PUT = do_DELETE = _handle
+
+
+class ReviewExecutorTest(unittest.TestCase):
+    """Tests ReviewExecutor against a fake Gerrit server."""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGerritHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.active = 0
+        self.server.max_active = 0
+        self.server.failures = {}
+        self.server.failure_status = 500
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+        self.gerrit = 'http://{}:{}'.format(*self.server.server_address)
+        self.url_opener = gerrit.KeepAliveURLOpener(retries=0)
+        self.change_lists = [
+            {'id': 'change{}'.format(i), 'change_id': 'I{}'.format(i),
+             'project': 'project', 'current_revision': 'sha1',
+             'revisions': {'sha1': {'commit': {'subject': 'subject'}}}}
+            for i in range(20)]
+        self.tasks = [
+            repo_review.ReviewTask(gerrit.set_review, ({'Code-Review': 2},
+                                                       'LGTM')),
+            repo_review.ReviewTask(gerrit.delete_topic,
+                                   expected_http_code=204),
+        ]
+
+    def run_executor(self, max_requests=4, rate=None, journal=None):
+        executor = repo_review.ReviewExecutor(
+            self.url_opener, self.gerrit, max_requests, rate, journal=journal)
+        with contextlib.redirect_stderr(io.StringIO()):
+            return executor.run(self.change_lists, self.tasks)
+
+    def requested_changes(self):
+        return sorted(set(path.split('/')[3]
+                          for _, path in self.server.requests))
+
+    def test_run(self):
+        self.assertEqual(self.run_executor(max_requests=4), 0)
+        self.assertEqual(len(self.server.requests), 40)
+        self.assertLessEqual(self.server.max_active, 4)
+        self.assertGreater(self.server.max_active, 1)
+
+        # The tasks of a change list are applied in order.
+        for change in self.change_lists:
+            methods = [method for method, path in self.server.requests
+                       if path.split('/')[3] == change['id']]
+            self.assertEqual(methods, ['POST', 'DELETE'])
+
+    def test_rate(self):
+        start = time.time()
+        self.assertEqual(self.run_executor(max_requests=8, rate=100), 0)
+        self.assertGreaterEqual(time.time() - start, 39 / 100.0)
+
+    def test_retry(self):
+        self.url_opener = gerrit.KeepAliveURLOpener(retries=2, backoff=0.01)
+        self.server.failures = {'change3': 2}
+        self.server.failure_status = 503
+        self.assertEqual(self.run_executor(), 0)
+        self.assertEqual(len(self.server.requests), 42)
+
+        # The server may have processed a POST request failing with 500.
+        self.server.requests = []
+        self.server.failures = {'change3': 1}
+        self.server.failure_status = 500
+        self.assertEqual(self.run_executor(), 1)
+        self.assertEqual(len(self.server.requests), 40)
+
+        # Client errors are not retried.
+        self.server.requests = []
+        self.server.failures = {'change3': 1}
+        self.server.failure_status = 409
+        self.assertEqual(self.run_executor(), 1)
+        self.assertEqual(len(self.server.requests), 40)
+
+    def test_connection_error(self):
+        # Connection errors are reported, while the other change lists are
+        # still reviewed.
+        self.gerrit = 'http://127.0.0.1:1'
+        self.assertEqual(self.run_executor(), 40)
+
+    def test_journal(self):
+        journal_path = os.path.join(self.temp_dir, 'journal')
+        self.server.failures = {'change3': 1, 'change7': 1}
+        journal = repo_review.Journal(journal_path)
+        self.assertEqual(self.run_executor(journal=journal), 2)
+        journal.close()
+
+        # Simulate an interruption while the journal was being written.
+        with open(journal_path, 'a') as journal_file:
+            journal_file.write('{"change": "chan')
+
+        # Only the failed tasks are applied again.
+        self.server.requests = []
+        journal = repo_review.Journal(journal_path)
+        self.assertEqual(self.run_executor(journal=journal), 0)
+        journal.close()
+        self.assertEqual(sorted(self.server.requests),
+                         [('POST', '/a/changes/change3/revisions/current/'
+                                   'review'),
+                          ('POST', '/a/changes/change7/revisions/current/'
+                                   'review')])
+
+        # Tasks with different arguments are not skipped.
+        self.server.requests = []
+        self.tasks = [repo_review.ReviewTask(gerrit.set_review,
+                                             ({'Code-Review': 1}, 'LGTM'))]
+        journal = repo_review.Journal(journal_path)
+        self.assertEqual(self.run_executor(journal=journal), 0)
+        journal.close()
+        self.assertEqual(self.requested_changes(),
+                         sorted(change['id'] for change in self.change_lists))
+
+        # All the tasks are recorded.
+        self.server.requests = []
+        journal = repo_review.Journal(journal_path)
+        self.assertEqual(self.run_executor(journal=journal), 0)
+        journal.close()
+        self.assertEqual(self.server.requests, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
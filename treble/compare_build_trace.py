@@ -14,6 +14,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
 import sys
 
 from read_build_trace_gz import Trace
@@ -49,6 +50,41 @@ def compare(target, target_name, ref, ref_name, ignore_text=None):
     return (sorted(additional_modules.items(), key=lambda x:x[1], reverse=True),
             additional_time)
 
+def compare_many(traces, names, ignore_text=None):
+    """Ranks modules by how much their build time changed across traces.
+
+    Module names are matched across traces after replacing each trace's
+    target name with the first one's, as compare() does for a pair.
+
+    Args:
+      traces: list of Trace classes, in chronological order.
+      names: list of str, the target name of each trace. An empty name
+             leaves the module names of its trace as they are.
+      ignore_text: str, modules containing this text are skipped.
+    Returns:
+      list of (module, durations, delta) sorted by delta, largest first.
+      durations has one entry per trace, None where the module was not
+      built; delta is the last duration minus the first one, counting
+      a missing module as 0.
+    """
+    durations = dict()
+    for i, (trace, name) in enumerate(zip(traces, names)):
+        for mod, duration in trace.duration.items():
+            if ignore_text and ignore_text in mod:
+                continue
+            if name and names[0]:
+                mod = mod.replace(name, names[0])
+            if mod not in durations:
+                durations[mod] = [None] * len(traces)
+            durations[mod][i] = duration
+
+    ranked = []
+    for mod, mod_durations in durations.items():
+        delta = (mod_durations[-1] or 0) - (mod_durations[0] or 0)
+        ranked.append((mod, mod_durations, delta))
+    ranked.sort(key=lambda x:x[2], reverse=True)
+    return ranked
+
 def usec_to_min(usec):
     min = usec // 60000000
     sec = usec % 60000000 // 1000000
@@ -56,7 +92,51 @@ def usec_to_min(usec):
     return (min, sec, msec)
 
 
+def format_duration(usec):
+    if usec is None:
+        return '-'
+    sign = '-' if usec < 0 else ''
+    min, sec, msec = usec_to_min(abs(usec))
+    return '{sign}{min}m {sec}s {msec}ms'.format(
+        sign=sign, min=min, sec=sec, msec=msec)
+
+
+def main_many(argv):
+    parser = argparse.ArgumentParser(
+        prog='compare_build_trace.py --many',
+        description='Ranks modules by their build time change from the '
+                    'first to the last of many build traces.')
+    parser.add_argument('traces', nargs='+', metavar='TRACE[:TARGET_NAME]',
+                        help='build.trace.gz files, oldest first, with the '
+                             'target name used in their module names')
+    parser.add_argument('--ignore', help='skip modules containing this text')
+    parser.add_argument('--top', type=int, default=50,
+                        help='number of modules to print from each end of '
+                             'the ranking, 0 for all (default: 50)')
+    args = parser.parse_args(argv)
+
+    traces = []
+    names = []
+    for arg in args.traces:
+        path, _, name = arg.partition(':')
+        traces.append(Trace(path))
+        names.append(name)
+
+    ranked = compare_many(traces, names, args.ignore)
+    if args.top and len(ranked) > args.top * 2:
+        ranked = ranked[:args.top] + ranked[-args.top:]
+    print('delta, ' + ', '.join(t.target for t in traces) + ', module')
+    for module, durations, delta in ranked:
+        print('{}, {}, {}'.format(
+            format_duration(delta),
+            ', '.join(format_duration(d) for d in durations), module))
+
+
 def main(argv):
+    if len(argv) > 1 and argv[1] == '--many':
+        main_many(argv[2:])
+        return
+
     # args: target_build.trace.gz target_name
     #       ref_build.trace.gz ref_name
     #       (ignore_text)
@@ -67,6 +147,8 @@ def main(argv):
         print("usage: compare_build_trace.py target_build.trace.gz target_name")
         print("                              ref_build.trace.gz ref_name")
         print("                              [ignore_text]")
+        print("       compare_build_trace.py --many "
+              "TRACE[:TARGET_NAME]... [--ignore TEXT] [--top N]")
         sys.exit(1)
 
     additional_modules, additional_time = compare(Trace(argv[1]), argv[2],
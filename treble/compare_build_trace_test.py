@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+import compare_build_trace
+from read_build_trace_gz import Trace
+from read_build_trace_gz_test import write_trace
+
+
+def module_events(durations):
+    # The durations are given in ms, and recorded in us.
+    return [{'name': name, 'ph': 'X', 'ts': 0, 'dur': dur * 1000}
+            for name, dur in durations.items()]
+
+
+def ms(*durations):
+    return [None if d is None else d * 1000 for d in durations]
+
+
+class CompareManyTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        # The module names include the target name of each build.
+        self.builds = [
+            ('old.trace.gz', 'aosp_x86', {
+                'libfoo aosp_x86': 100, 'libbar aosp_x86': 500,
+                'removed aosp_x86': 300, 'noise': 10}),
+            ('mid.trace.gz', 'aosp_arm', {
+                'libfoo aosp_arm': 150, 'libbar aosp_arm': 200,
+                'noise': 10}),
+            ('new.trace.gz', 'aosp_arm64', {
+                'libfoo aosp_arm64': 400, 'libbar aosp_arm64': 450,
+                'added aosp_arm64': 50, 'noise': 1000}),
+        ]
+        self.paths = []
+        for filename, _, durations in self.builds:
+            path = os.path.join(self.temp_dir.name, filename)
+            write_trace(path, module_events(durations))
+            self.paths.append(path)
+
+    def test_ranking(self):
+        traces = [Trace(path) for path in self.paths]
+        names = [name for _, name, _ in self.builds]
+        self.assertEqual(
+            compare_build_trace.compare_many(traces, names, 'noise'), [
+                ('libfoo aosp_x86', ms(100, 150, 400), 300000),
+                ('added aosp_x86', ms(None, None, 50), 50000),
+                ('libbar aosp_x86', ms(500, 200, 450), -50000),
+                ('removed aosp_x86', ms(300, None, None), -300000),
+            ])
+
+    def test_unnamed_traces(self):
+        traces = [Trace(path) for path in self.paths]
+        ranked = compare_build_trace.compare_many(traces, ['', '', ''])
+        self.assertEqual(ranked[0], ('noise', ms(10, 10, 1000), 990000))
+        self.assertIn(('libfoo aosp_arm64', ms(None, None, 400), 400000),
+                      ranked)
+        self.assertIn(('libfoo aosp_x86', ms(100, None, None), -100000),
+                      ranked)
+
+    def test_main_many(self):
+        args = ['{}:{}'.format(path, name)
+                for path, (_, name, _) in zip(self.paths, self.builds)]
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            compare_build_trace.main_many(args + ['--ignore', 'noise',
+                                                  '--top', '1'])
+        self.assertEqual(output.getvalue().splitlines(), [
+            'delta, old.trace, mid.trace, new.trace, module',
+            '0m 0s 300ms, 0m 0s 100ms, 0m 0s 150ms, 0m 0s 400ms, '
+            'libfoo aosp_x86',
+            '-0m 0s 300ms, 0m 0s 300ms, -, -, removed aosp_x86',
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -28,6 +28,59 @@ READ_DURATION = [
     'total',
 ]
 
+# Number of characters read from the trace at a time.
+READ_CHUNK_SIZE = 1 << 16
+
+
+def iter_trace_events(trace_file, chunk_size=READ_CHUNK_SIZE):
+    """Yields the events of a Chrome trace JSON array one at a time.
+
+    Only the event being decoded is held in memory, instead of the whole
+    array. A missing closing bracket, which the trace format allows, is
+    accepted.
+    """
+    decoder = json.JSONDecoder()
+    buf = trace_file.read(chunk_size)
+    pos = 0
+    eof = not buf
+    started = False
+    while True:
+        # Skip whitespace and separators, reading more when needed.
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                return
+            buf = trace_file.read(chunk_size)
+            pos = 0
+            eof = not buf
+            continue
+        if not started:
+            if buf[pos] != '[':
+                raise ValueError('trace is not a JSON array')
+            started = True
+            pos += 1
+            continue
+        if buf[pos] == ']':
+            return
+        try:
+            event, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                raise
+            # The event continues in the next chunk.
+            more = trace_file.read(chunk_size)
+            eof = not more
+            buf = buf[pos:] + more
+            pos = 0
+            continue
+        yield event
+        pos = end
+        if pos >= chunk_size:
+            buf = buf[pos:]
+            pos = 0
+
+
 class Trace:
     def __init__(self, trace_file):
         self.duration = dict()
@@ -35,24 +88,23 @@ class Trace:
         self.target = os.path.splitext(os.path.basename(trace_file))[0]
         if not os.path.isfile(trace_file):
             return
-        self._trace_file = gzip.open(trace_file, 'rt', encoding='utf-8')
-        self._trace_data = json.load(self._trace_file)
-        for t in self._trace_data:
-            if 'ph' not in t:
-                continue
-            if t['ph'] == 'X':
-                self.duration[t['name']] = t['dur']
-                continue
-            if t['ph'] == 'B':
-                self._queue[(t['pid'], t['pid'])].append((t['name'], t['ts']))
-                continue
-            if t['ph'] == 'E':
-                queue = self._queue[(t['pid'], t['pid'])]
-                if not queue:
-                    raise Exception('pid:{}, tid:{} not started'.format(t['pid'], t['pid']))
-                name, ts = queue.pop()
-                self.duration[name] = t['ts'] - ts
-                continue
+        with gzip.open(trace_file, 'rt', encoding='utf-8') as f:
+            for t in iter_trace_events(f):
+                self.add_event(t)
+
+    def add_event(self, t):
+        """Updates the durations with one trace event."""
+        ph = t.get('ph')
+        if ph == 'X':
+            self.duration[t['name']] = t['dur']
+        elif ph == 'B':
+            self._queue[(t['pid'], t['tid'])].append((t['name'], t['ts']))
+        elif ph == 'E':
+            queue = self._queue[(t['pid'], t['tid'])]
+            if not queue:
+                raise Exception('pid:{}, tid:{} not started'.format(t['pid'], t['tid']))
+            name, ts = queue.pop()
+            self.duration[name] = t['ts'] - ts
 
     def out_durations(self):
         out_str = self.target
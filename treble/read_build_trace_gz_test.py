@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2023 The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from read_build_trace_gz import Trace, iter_trace_events
+
+
+def write_trace(path, events, closed=True):
+    """Writes events as a gzip'd Chrome trace, one event per line."""
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write('[\n')
+        f.write(',\n'.join(json.dumps(event) for event in events))
+        if closed:
+            f.write('\n]\n')
+
+
+class IterTraceEventsTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.events = [
+            {'name': 'soong', 'ph': 'X', 'ts': 0, 'dur': 1000},
+            {'name': 'module é [with, brackets]', 'ph': 'B',
+             'pid': 1, 'tid': 2, 'ts': 10, 'args': {'list': [1, 2, 3]}},
+            {'name': 'module é [with, brackets]', 'ph': 'E',
+             'pid': 1, 'tid': 2, 'ts': 30},
+        ]
+
+    def read(self, closed=True, chunk_size=4):
+        path = os.path.join(self.temp_dir.name, 'build.trace.gz')
+        write_trace(path, self.events, closed)
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return list(iter_trace_events(f, chunk_size))
+
+    def test_split_events(self):
+        # Every event is split across several chunks, at every offset.
+        for chunk_size in range(1, 40):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self.read(chunk_size=chunk_size),
+                                 self.events)
+
+    def test_missing_closing_bracket(self):
+        self.assertEqual(self.read(closed=False), self.events)
+
+    def test_empty(self):
+        self.events = []
+        self.assertEqual(self.read(), [])
+        self.assertEqual(self.read(closed=False), [])
+
+    def test_not_array(self):
+        path = os.path.join(self.temp_dir.name, 'build.trace.gz')
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            f.write('{"name": "soong"}')
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            with self.assertRaises(ValueError):
+                list(iter_trace_events(f))
+
+    def test_truncated_event(self):
+        path = os.path.join(self.temp_dir.name, 'build.trace.gz')
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            f.write('[{"name": "soong", "ph": "X"')
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            with self.assertRaises(ValueError):
+                list(iter_trace_events(f, 4))
+
+
+class TraceTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def test_durations(self):
+        path = os.path.join(self.temp_dir.name, 'aosp_arm64.trace.gz')
+        write_trace(path, [
+            {'name': 'total', 'ph': 'X', 'ts': 0, 'dur': 500},
+            # Two threads of one process interleave their B/E events.
+            {'name': 'a', 'ph': 'B', 'pid': 1, 'tid': 1, 'ts': 10},
+            {'name': 'b', 'ph': 'B', 'pid': 1, 'tid': 2, 'ts': 20},
+            {'name': 'a', 'ph': 'E', 'pid': 1, 'tid': 1, 'ts': 110},
+            {'name': 'c', 'ph': 'B', 'pid': 1, 'tid': 1, 'ts': 120},
+            {'name': 'b', 'ph': 'E', 'pid': 1, 'tid': 2, 'ts': 220},
+            {'name': 'c', 'ph': 'E', 'pid': 1, 'tid': 1, 'ts': 125},
+            # The same tid in another process is another queue.
+            {'name': 'd', 'ph': 'B', 'pid': 2, 'tid': 1, 'ts': 0},
+            {'name': 'd', 'ph': 'E', 'pid': 2, 'tid': 1, 'ts': 7},
+            {'name': 'metadata', 'ph': 'M', 'pid': 1, 'tid': 1},
+        ])
+        trace = Trace(path)
+        self.assertEqual(trace.target, 'aosp_arm64.trace')
+        self.assertEqual(trace.duration,
+                         {'total': 500, 'a': 100, 'b': 200, 'c': 5, 'd': 7})
+
+    def test_end_without_begin(self):
+        path = os.path.join(self.temp_dir.name, 'build.trace.gz')
+        write_trace(path, [
+            {'name': 'a', 'ph': 'B', 'pid': 1, 'tid': 1, 'ts': 10},
+            {'name': 'a', 'ph': 'E', 'pid': 1, 'tid': 2, 'ts': 20},
+        ])
+        with self.assertRaisesRegex(Exception, 'pid:1, tid:2 not started'):
+            Trace(path)
+
+    def test_missing_file(self):
+        trace = Trace(os.path.join(self.temp_dir.name, 'missing.trace.gz'))
+        self.assertEqual(trace.duration, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
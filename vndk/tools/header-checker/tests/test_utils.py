@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+import_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+import_path = os.path.abspath(os.path.join(import_path, 'utils'))
+sys.path.insert(1, import_path)
+
+import utils
+from utils import (AbiDiffTask, run_abi_diffs, write_abi_diff_report)
+
+
+SCRIPT_DIR = os.path.abspath(os.path.dirname(__file__))
+STUB_DIR = os.path.join(SCRIPT_DIR, 'stub')
+
+
+class MockArch(object):
+    def __init__(self, arch_cpu_str):
+        self.arch_cpu_str = arch_cpu_str
+
+    def get_arch_cpu_str(self):
+        return self.arch_cpu_str
+
+
+class LsdumpPathsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.lsdump_paths_file_path = os.path.join(self.tmp_dir.name,
+                                                   'lsdump_paths.txt')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_lsdump_paths(self, lines):
+        with open(self.lsdump_paths_file_path, 'w') as f:
+            f.write(''.join(line + '\n' for line in lines))
+
+    def read_lsdump_paths(self):
+        return utils._read_lsdump_paths(
+            self.lsdump_paths_file_path,
+            [MockArch('arm64_armv8-a'), MockArch('arm_armv8-a')],
+            lambda tag, lib_name: True)
+
+    def test_read_lsdump_paths(self):
+        self.write_lsdump_paths([
+            'NDK: a/libc/android_arm64_armv8-a_shared/libc.so.lsdump',
+            'NDK: a/libc/android_arm_armv8-a_shared/012abc/libc.so.lsdump',
+            'APEX: a/libfoo/android_arm64_armv8-a_shared_apex10000/'
+            'libfoo.so.apex.lsdump',
+            'APEX: a/libfoo/android_arm64_armv8-a_shared_apex29/'
+            'libfoo.so.apex.lsdump',
+            '',
+        ])
+        lsdump_paths = self.read_lsdump_paths()
+        self.assertEqual(
+            lsdump_paths['libc']['arm64_armv8-a'],
+            {'NDK': 'a/libc/android_arm64_armv8-a_shared/libc.so.lsdump'})
+        self.assertEqual(
+            lsdump_paths['libc']['arm_armv8-a'],
+            {'NDK': 'a/libc/android_arm_armv8-a_shared/012abc/libc.so.lsdump'})
+        self.assertEqual(
+            lsdump_paths['libfoo']['arm64_armv8-a'],
+            {'APEX': 'a/libfoo/android_arm64_armv8-a_shared_apex10000/'
+                     'libfoo.so.apex.lsdump'})
+
+    def test_index_cache(self):
+        self.write_lsdump_paths([
+            'NDK: a/libc/android_arm64_armv8-a_shared/libc.so.lsdump',
+        ])
+        index = utils._load_lsdump_paths_index(self.lsdump_paths_file_path)
+        self.assertIs(
+            utils._load_lsdump_paths_index(self.lsdump_paths_file_path), index)
+
+        # The index is reloaded after the file is modified.
+        self.write_lsdump_paths([
+            'NDK: a/libc/android_arm64_armv8-a_shared/libc.so.lsdump',
+            'NDK: a/libm/android_arm64_armv8-a_shared/libm.so.lsdump',
+        ])
+        self.assertEqual(sorted(self.read_lsdump_paths()), ['libc', 'libm'])
+
+
+class ValidateDumpTest(unittest.TestCase):
+    def validate(self, content):
+        utils._validate_dump_buffer('lib.so.lsdump', content)
+
+    def test_relative_paths(self):
+        aosp_dir = utils.AOSP_DIR
+        self.validate(b'"path": "bionic/libc/include/stdio.h"\n')
+        # $ANDROID_BUILD_TOP is part of a longer path.
+        self.validate(f'"path": "out{aosp_dir}/a.h"\n'.encode('utf-8'))
+        self.validate(f'"path": "é{aosp_dir}/a.h"\n'.encode('utf-8'))
+
+    def test_absolute_paths(self):
+        aosp_dir = utils.AOSP_DIR
+        for content in [f'{aosp_dir}/a.h\n',
+                        f'{{\n"path": "{aosp_dir}/a.h"\n}}\n',
+                        f'"path": "«{aosp_dir}/a.h"\n']:
+            with self.assertRaisesRegex(ValueError, 'absolute path'):
+                self.validate(content.encode('utf-8'))
+
+        with self.assertRaisesRegex(ValueError, 'at line 2:\n"b": "'):
+            self.validate(f'"a": "a.h"\n"b": "{aosp_dir}/b.h"\n'
+                          .encode('utf-8'))
+
+
+class CopyReferenceDumpsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, path, content):
+        path = os.path.join(self.tmp_dir.name, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_copy_reference_dumps(self):
+        ref_dir = os.path.join(self.tmp_dir.name, 'ref')
+        arm64_dir = os.path.join(ref_dir, 'arm64')
+        arm_dir = os.path.join(ref_dir, 'arm')
+        unchanged_path = self.write_file('ref/arm64/libc.so.lsdump', 'libc\n')
+        self.write_file('ref/arm64/libm.so.lsdump', 'old libm\n')
+        dumps = [
+            (self.write_file('out/arm64/libc.so.lsdump', 'libc\n'), arm64_dir),
+            (self.write_file('out/arm/libc.so.lsdump', 'libc\n'), arm_dir),
+            (self.write_file('out/arm64/libm.so.lsdump', 'libm\n'), arm64_dir),
+            (self.write_file('out/arm/libm.so.lsdump', 'libm\n'), arm_dir),
+        ]
+        unchanged_stat = os.stat(unchanged_path)
+
+        ref_dump_paths = utils.copy_reference_dumps(dumps, jobs=2)
+        self.assertEqual(ref_dump_paths, [
+            os.path.join(arm64_dir, 'libc.so.lsdump'),
+            os.path.join(arm_dir, 'libc.so.lsdump'),
+            os.path.join(arm64_dir, 'libm.so.lsdump'),
+            os.path.join(arm_dir, 'libm.so.lsdump'),
+        ])
+        for path, expected in zip(ref_dump_paths,
+                                  ['libc\n', 'libc\n', 'libm\n', 'libm\n']):
+            with open(path, 'r') as f:
+                self.assertEqual(f.read(), expected)
+
+        # The unchanged dump is not rewritten.
+        self.assertEqual(os.stat(unchanged_path).st_ino,
+                         unchanged_stat.st_ino)
+        self.assertEqual(os.stat(unchanged_path).st_mtime_ns,
+                         unchanged_stat.st_mtime_ns)
+        # A new dump with the same content as another one is hard linked to
+        # it, while the changed dump is copied.
+        self.assertTrue(os.path.samefile(ref_dump_paths[1],
+                                         ref_dump_paths[0]))
+        self.assertTrue(os.path.samefile(ref_dump_paths[3],
+                                         ref_dump_paths[2]))
+        self.assertFalse(os.path.samefile(ref_dump_paths[2], dumps[2][0]))
+
+    def test_missing_dump(self):
+        ref_dir = os.path.join(self.tmp_dir.name, 'ref')
+        dumps = [(os.path.join(self.tmp_dir.name, 'libc.so.lsdump'), ref_dir)]
+        with self.assertRaises(FileNotFoundError):
+            utils.copy_reference_dumps(dumps, jobs=1)
+        self.assertFalse(os.path.exists(ref_dir))
+
+
+class RunAbiDiffsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = STUB_DIR + os.pathsep + self.path
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        self.tmp_dir.cleanup()
+
+    def write_dump(self, name, content):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_run_abi_diffs(self):
+        old_dump_path = self.write_dump('old.so.lsdump', 'abc\n')
+        tasks = []
+        expected_status = []
+        for i in range(20):
+            new_content, status = [('abc\n', 'COMPATIBLE'),
+                                   ('abc\ndef\n', 'EXTENSION'),
+                                   ('xyz\n', 'INCOMPATIBLE')][i % 3]
+            new_dump_path = self.write_dump(f'lib{i}.so.lsdump', new_content)
+            tasks.append(AbiDiffTask(f'lib{i}', 'arm64', old_dump_path,
+                                     new_dump_path))
+            expected_status.append([status])
+        tasks.append(AbiDiffTask('libmissing', 'arm64',
+                                 os.path.join(self.tmp_dir.name, 'missing'),
+                                 old_dump_path))
+        expected_status.append(['ERROR'])
+
+        results = run_abi_diffs(tasks, jobs=4)
+        self.assertEqual([result['lib_name'] for result in results],
+                         [task.lib_name for task in tasks])
+        self.assertEqual([result['status'] for result in results],
+                         expected_status)
+        self.assertIsNone(results[0]['abidiff'])
+        self.assertIn('compatibility_status: EXTENSION', results[1]['abidiff'])
+        self.assertEqual(results[2]['return_code'], 8)
+        self.assertEqual(results[2]['output'], 'lib2 arm64: INCOMPATIBLE\n')
+
+        report_path = os.path.join(self.tmp_dir.name, 'report.json')
+        write_abi_diff_report(results, report_path)
+        with open(report_path, 'r') as f:
+            report = json.load(f)
+        self.assertEqual(report['num_libs'], 21)
+        self.assertEqual(report['num_diffs'], 14)
+        self.assertEqual(report['num_errors'], 1)
+        self.assertEqual(report['status_counts'],
+                         {'COMPATIBLE': 7, 'ERROR': 1, 'EXTENSION': 7,
+                          'INCOMPATIBLE': 6})
+        self.assertEqual(report['results'], results)
+
+
+if __name__ == '__main__':
+    unittest.main()
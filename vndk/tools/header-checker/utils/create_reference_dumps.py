@@ -5,9 +5,10 @@ import os
 import time
 
 from utils import (
-    AOSP_DIR, SOURCE_ABI_DUMP_EXT_END, SO_EXT, BuildTarget, Arch,
-    copy_reference_dump, find_lib_lsdumps, get_build_vars,
-    make_libraries, make_targets, read_lsdump_paths)
+    AOSP_DIR, SOURCE_ABI_DUMP_EXT_END, SO_EXT, AbiDiffTask, BuildTarget, Arch,
+    copy_reference_dumps, find_lib_lsdumps, get_build_vars,
+    get_reference_dump_path, make_libraries, make_targets, read_lsdump_paths,
+    run_abi_diffs, strip_dump_name_ext, write_abi_diff_report)
 
 
 PRODUCTS_DEFAULT = ['aosp_arm', 'aosp_arm64', 'aosp_x86', 'aosp_x86_64']
@@ -77,35 +78,58 @@ def tag_to_dir_name(tag):
     raise ValueError(tag + ' is not a known tag.')
 
 
-def find_and_copy_lib_lsdumps(get_ref_dump_dir_stem, arch, libs,
-                              lsdump_paths):
+def find_lib_lsdump_copies(get_ref_dump_dir_stem, arch, libs, lsdump_paths):
+    """Return a list of (lsdump_path, reference_dump_dir) for an arch."""
     arch_lsdump_paths = find_lib_lsdumps(lsdump_paths, libs, arch)
-    num_created = 0
+    copies = []
     for tag, path in arch_lsdump_paths:
         ref_dump_dir_stem = get_ref_dump_dir_stem(tag_to_dir_name(tag),
                                                   arch.get_arch_str())
-        copy_reference_dump(
-            path, os.path.join(ref_dump_dir_stem, 'source-based'))
-        num_created += 1
-    return num_created
+        copies.append((path, os.path.join(ref_dump_dir_stem, 'source-based')))
+    return copies
 
 
 def create_source_abi_reference_dumps(args, get_ref_dump_dir_stem,
                                       lsdump_paths, arches):
-    num_libs_copied = 0
+    copies = []
     for arch in arches:
         assert arch.primary_arch != ''
         print(f'Creating dumps for arch: {arch.arch}, '
               f'primary arch: {arch.primary_arch}')
 
-        num_libs_copied += find_and_copy_lib_lsdumps(
+        copies += find_lib_lsdump_copies(
             get_ref_dump_dir_stem, arch, args.libs, lsdump_paths)
-    return num_libs_copied
+
+    # Copy the dumps of all arches together, so that identical dumps are hard
+    # linked to each other.
+    copy_reference_dumps(copies, args.jobs)
+    return len(copies)
+
+
+def diff_source_abi_reference_dumps(args, get_ref_dump_dir_stem,
+                                    lsdump_paths, arches):
+    """Compare the lsdumps with the reference dumps and return the results."""
+    tasks = []
+    for arch in arches:
+        print(f'Comparing dumps for arch: {arch.arch}, '
+              f'primary arch: {arch.primary_arch}')
+
+        for path, ref_dump_dir in find_lib_lsdump_copies(
+                get_ref_dump_dir_stem, arch, args.libs, lsdump_paths):
+            tasks.append(AbiDiffTask(
+                strip_dump_name_ext(os.path.basename(path)), arch.arch,
+                get_reference_dump_path(path, ref_dump_dir), path))
+    return run_abi_diffs(tasks, jobs=args.jobs)
 
 
 def create_source_abi_reference_dumps_for_all_products(args):
-    """Create reference ABI dumps for all specified products."""
+    """Create reference ABI dumps for all specified products.
+
+    If args.diff_report is specified, compare the built dumps with the
+    reference dumps and write the results to args.diff_report instead.
+    """
     num_processed = 0
+    diff_results = []
 
     for product in args.products:
         build_target = BuildTarget(product, args.release, args.build_variant)
@@ -160,8 +184,14 @@ def create_source_abi_reference_dumps_for_all_products(args):
             lsdump_paths = read_lsdump_paths(build_target, arches,
                                              lsdump_filter, build=False)
 
-            num_processed += create_source_abi_reference_dumps(
-                args, get_ref_dump_dir_stem, lsdump_paths, arches)
+            if args.diff_report:
+                results = diff_source_abi_reference_dumps(
+                    args, get_ref_dump_dir_stem, lsdump_paths, arches)
+                diff_results.extend(results)
+                num_processed += len(results)
+            else:
+                num_processed += create_source_abi_reference_dumps(
+                    args, get_ref_dump_dir_stem, lsdump_paths, arches)
         except KeyError as e:
             if args.libs or not args.ref_dump_dir:
                 raise RuntimeError('Please check the lib name, --lib-variant '
@@ -170,6 +200,12 @@ def create_source_abi_reference_dumps_for_all_products(args):
                                    'libraries.') from e
             raise
 
+    if args.diff_report:
+        report = write_abi_diff_report(diff_results, args.diff_report)
+        print(f'msg: {report["num_diffs"]} of {report["num_libs"]} dumps '
+              f'differ from the references, including '
+              f'{report["num_errors"]} errors. See {args.diff_report}')
+
     return num_processed
 
 
@@ -195,6 +231,13 @@ def _parse_args():
                         help='library variant to create references for.')
     parser.add_argument('--ref-dump-dir', '-ref-dump-dir',
                         help='directory to copy reference abi dumps into')
+    parser.add_argument('--jobs', '-j', type=int,
+                        help='number of processes to copy or compare dumps '
+                             '(default: number of CPUs)')
+    parser.add_argument('--diff-report',
+                        help='compare the dumps with the reference dumps and '
+                             'write a JSON report to this file, instead of '
+                             'updating the reference dumps')
     args = parser.parse_args()
 
     if args.libs:
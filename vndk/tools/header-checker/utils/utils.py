@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 
 import collections
+import hashlib
+import json
+import mmap
+import multiprocessing
 import os
 import re
 import shutil
@@ -87,7 +91,7 @@ class Arch(object):
         return self.arch + arch_variant + cpu_variant
 
 
-def _strip_dump_name_ext(filename):
+def strip_dump_name_ext(filename):
     """Remove .so*.lsdump from a file name."""
     for ext in KNOWN_ABI_DUMP_EXTS:
         if filename.endswith(ext) and len(filename) > len(ext):
@@ -95,33 +99,141 @@ def _strip_dump_name_ext(filename):
     raise ValueError(f'{filename} has an unknown file name extension.')
 
 
+def _is_path_char(content, end):
+    """Determine whether the UTF-8 character ending at content[end - 1] is a
+    common path character."""
+    start = end - 1
+    # Skip back over the continuation bytes of a multi-byte character.
+    while start > max(end - 4, 0) and 0x80 <= content[start] < 0xc0:
+        start -= 1
+    char = bytes(content[start:end]).decode('utf-8', 'replace')
+    return len(char) == 1 and (char.isalnum() or char in '.-_/')
+
+
+def _validate_dump_buffer(dump_path, content):
+    """Make sure that the dump content, a bytes-like object, contains relative
+    source paths."""
+    aosp_dir = AOSP_DIR.encode('utf-8')
+    start = 0
+    while True:
+        start = content.find(aosp_dir, start)
+        if start < 0:
+            break
+        # The substring is not preceded by a common path character.
+        if start == 0 or not _is_path_char(content, start):
+            line_start = content.rfind(b'\n', 0, start) + 1
+            line_end = content.find(b'\n', start)
+            line_end = len(content) if line_end < 0 else line_end + 1
+            line_number = content[:line_start].count(b'\n') + 1
+            line = content[line_start:line_end].decode('utf-8', 'replace')
+            raise ValueError(f'{dump_path} contains absolute path to '
+                             f'$ANDROID_BUILD_TOP at line '
+                             f'{line_number}:\n{line}')
+        start += len(aosp_dir)
+
+
+def _read_dump_digest(dump_path, validate, missing_ok=False):
+    """Return the SHA-256 digest of a dump.  If missing_ok is True, return None
+    if the dump does not exist.
+
+    The dump is mapped into memory, so that it is validated and hashed without
+    being copied into Python objects.
+    """
+    try:
+        f = open(dump_path, 'rb')
+    except FileNotFoundError:
+        if missing_ok:
+            return None
+        raise
+    with f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            if validate:
+                _validate_dump_buffer(dump_path, content)
+            return hashlib.sha256(content).hexdigest()
+
+
 def _validate_dump_content(dump_path):
     """Make sure that the dump contains relative source paths."""
-    with open(dump_path, 'r') as f:
-        for line_number, line in enumerate(f, 1):
-            start = 0
-            while True:
-                start = line.find(AOSP_DIR, start)
-                if start < 0:
-                    break
-                # The substring is not preceded by a common path character.
-                if start == 0 or not (line[start - 1].isalnum() or
-                                      line[start - 1] in '.-_/'):
-                    raise ValueError(f'{dump_path} contains absolute path to '
-                                     f'$ANDROID_BUILD_TOP at line '
-                                     f'{line_number}:\n{line}')
-                start += len(AOSP_DIR)
-
-
-def copy_reference_dump(lib_path, reference_dump_dir):
-    _validate_dump_content(lib_path)
-    ref_dump_name = (_strip_dump_name_ext(os.path.basename(lib_path)) +
+    _read_dump_digest(dump_path, validate=True)
+
+
+def get_reference_dump_path(lib_path, reference_dump_dir):
+    ref_dump_name = (strip_dump_name_ext(os.path.basename(lib_path)) +
                      SOURCE_ABI_DUMP_EXT)
-    ref_dump_path = os.path.join(reference_dump_dir, ref_dump_name)
-    os.makedirs(reference_dump_dir, exist_ok=True)
-    shutil.copyfile(lib_path, ref_dump_path)
-    print(f'Created abi dump at {ref_dump_path}')
-    return ref_dump_path
+    return os.path.join(reference_dump_dir, ref_dump_name)
+
+
+def _get_dump_digests(lib_path, ref_dump_path):
+    """Validate a dump and return the digests of it and the reference dump."""
+    return (_read_dump_digest(lib_path, validate=True),
+            _read_dump_digest(ref_dump_path, validate=False, missing_ok=True))
+
+
+def _install_file(src_path, dst_path, link=False):
+    """Copy or hard link a file, replacing dst_path atomically."""
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+    tmp_path = f'{dst_path}.{os.getpid()}.tmp'
+    try:
+        if link:
+            os.link(src_path, tmp_path)
+        else:
+            shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, dst_path)
+    finally:
+        if os.path.lexists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def copy_reference_dumps(dumps, jobs=None):
+    """Copy dumps to reference dump directories with a process pool.
+
+    dumps is a list of (lib_path, reference_dump_dir).  A reference dump is
+    not written if its content is the same as the dump.  A reference dump
+    which is the same as another reference dump, e.g., for another arch, is
+    hard linked to it.  This function returns the reference dump paths.
+    """
+    ref_dump_paths = [get_reference_dump_path(lib_path, reference_dump_dir)
+                      for lib_path, reference_dump_dir in dumps]
+    lib_paths = [lib_path for lib_path, _ in dumps]
+
+    with multiprocessing.Pool(jobs) as pool:
+        digests = pool.starmap(_get_dump_digests,
+                               zip(lib_paths, ref_dump_paths))
+
+        # Map the digests to the reference dumps that will have the content.
+        installed = {}
+        for ref_dump_path, (digest, ref_digest) in zip(ref_dump_paths,
+                                                       digests):
+            if digest == ref_digest:
+                installed.setdefault(digest, ref_dump_path)
+                print(f'Unchanged abi dump at {ref_dump_path}')
+
+        copies = []
+        links = []
+        for lib_path, ref_dump_path, (digest, ref_digest) in zip(
+                lib_paths, ref_dump_paths, digests):
+            if digest == ref_digest:
+                continue
+            if digest in installed:
+                links.append((installed[digest], ref_dump_path))
+            else:
+                installed[digest] = ref_dump_path
+                copies.append((lib_path, ref_dump_path))
+
+        pool.starmap(_install_file, copies)
+
+    for lib_path, ref_dump_path in copies:
+        print(f'Created abi dump at {ref_dump_path}')
+    for src_path, ref_dump_path in links:
+        try:
+            _install_file(src_path, ref_dump_path, link=True)
+        except OSError:
+            # The file system does not support hard links.
+            _install_file(src_path, ref_dump_path)
+        print(f'Created abi dump at {ref_dump_path}')
+    return ref_dump_paths
 
 
 def run_header_abi_dumper(input_path, output_path, cflags=tuple(),
@@ -219,6 +331,45 @@ def _get_module_variant_dir_name(tag, arch_cpu_str):
     raise ValueError(tag + ' is not a known tag.')
 
 
+# The parsed lsdump_paths.txt files, {path: (mtime_ns, size, entries)}.
+_lsdump_paths_index_cache = {}
+
+
+def _load_lsdump_paths_index(lsdump_paths_file_path):
+    """Parse lsdump_paths.txt into a list of (tag, path, libname, dirnames).
+
+    dirnames are the names of the parent and grandparent directories of the
+    lsdump.  The result is cached until lsdump_paths.txt is modified.
+    """
+    stat = os.stat(lsdump_paths_file_path)
+    cached = _lsdump_paths_index_cache.get(lsdump_paths_file_path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    entries = []
+    with open(lsdump_paths_file_path, 'r') as lsdump_paths_file:
+        for line in lsdump_paths_file:
+            if not line.strip():
+                continue
+            tag, path = (x.strip() for x in line.split(':', 1))
+            dir_path, filename = os.path.split(path)
+            libname = strip_dump_name_ext(filename)
+            # dir_path may contain soong config hash.
+            # For example, the following dir_paths are valid.
+            # android_x86_x86_64_shared/012abc/libc.so.lsdump
+            # android_x86_x86_64_shared/libc.so.lsdump
+            dirnames = []
+            dir_path, dirname = os.path.split(dir_path)
+            dirnames.append(dirname)
+            dirname = os.path.basename(dir_path)
+            dirnames.append(dirname)
+            entries.append((tag, path, libname, dirnames))
+
+    _lsdump_paths_index_cache[lsdump_paths_file_path] = (
+        stat.st_mtime_ns, stat.st_size, entries)
+    return entries
+
+
 def _read_lsdump_paths(lsdump_paths_file_path, arches, lsdump_filter):
     """Read lsdump paths from lsdump_paths.txt for each libname and variant.
 
@@ -237,38 +388,24 @@ def _read_lsdump_paths(lsdump_paths_file_path, arches, lsdump_filter):
     suffixes = collections.defaultdict(
         lambda: collections.defaultdict(dict))
 
-    with open(lsdump_paths_file_path, 'r') as lsdump_paths_file:
-        for line in lsdump_paths_file:
-            if not line.strip():
+    for tag, path, libname, dirnames in _load_lsdump_paths_index(
+            lsdump_paths_file_path):
+        if not lsdump_filter(tag, libname):
+            continue
+        for arch in arches:
+            arch_cpu = arch.get_arch_cpu_str()
+            prefix = _get_module_variant_dir_name(tag, arch_cpu)
+            variant = next((d for d in dirnames if d.startswith(prefix)),
+                           None)
+            if not variant:
                 continue
-            tag, path = (x.strip() for x in line.split(':', 1))
-            dir_path, filename = os.path.split(path)
-            libname = _strip_dump_name_ext(filename)
-            if not lsdump_filter(tag, libname):
-                continue
-            # dir_path may contain soong config hash.
-            # For example, the following dir_paths are valid.
-            # android_x86_x86_64_shared/012abc/libc.so.lsdump
-            # android_x86_x86_64_shared/libc.so.lsdump
-            dirnames = []
-            dir_path, dirname = os.path.split(dir_path)
-            dirnames.append(dirname)
-            dirname = os.path.basename(dir_path)
-            dirnames.append(dirname)
-            for arch in arches:
-                arch_cpu = arch.get_arch_cpu_str()
-                prefix = _get_module_variant_dir_name(tag, arch_cpu)
-                variant = next((d for d in dirnames if d.startswith(prefix)),
-                               None)
-                if not variant:
-                    continue
-                new_suffix = variant[len(prefix):]
-                old_suffix = suffixes[libname][arch_cpu].get(tag)
-                if (not old_suffix or
-                        _get_module_variant_sort_key(new_suffix) >
-                        _get_module_variant_sort_key(old_suffix)):
-                    lsdump_paths[libname][arch_cpu][tag] = path
-                    suffixes[libname][arch_cpu][tag] = new_suffix
+            new_suffix = variant[len(prefix):]
+            old_suffix = suffixes[libname][arch_cpu].get(tag)
+            if (not old_suffix or
+                    _get_module_variant_sort_key(new_suffix) >
+                    _get_module_variant_sort_key(old_suffix)):
+                lsdump_paths[libname][arch_cpu][tag] = path
+                suffixes[libname][arch_cpu][tag] = new_suffix
     return lsdump_paths
 
 
@@ -310,8 +447,8 @@ def find_lib_lsdumps(lsdump_paths, libs, arch):
     return [(tag, os.path.join(AOSP_DIR, path)) for tag, path in result]
 
 
-def run_abi_diff(old_dump_path, new_dump_path, output_path, arch_str, lib_name,
-                 flags):
+def _get_abi_diff_cmd(old_dump_path, new_dump_path, output_path, arch_str,
+                      lib_name, flags):
     abi_diff_cmd = ['header-abi-diff', '-new', new_dump_path, '-old',
                     old_dump_path, '-arch', arch_str, '-lib', lib_name,
                     '-o', output_path]
@@ -320,6 +457,13 @@ def run_abi_diff(old_dump_path, new_dump_path, output_path, arch_str, lib_name,
         abi_diff_cmd += ['-input-format-old', DEFAULT_FORMAT]
     if '-input-format-new' not in flags:
         abi_diff_cmd += ['-input-format-new', DEFAULT_FORMAT]
+    return abi_diff_cmd
+
+
+def run_abi_diff(old_dump_path, new_dump_path, output_path, arch_str, lib_name,
+                 flags):
+    abi_diff_cmd = _get_abi_diff_cmd(old_dump_path, new_dump_path, output_path,
+                                     arch_str, lib_name, flags)
     return subprocess.run(abi_diff_cmd).returncode
 
 
@@ -333,6 +477,97 @@ def run_and_read_abi_diff(old_dump_path, new_dump_path, arch_str, lib_name,
             return result, output_file.read()
 
 
+AbiDiffTask = collections.namedtuple(
+    'AbiDiffTask', ['lib_name', 'arch_str', 'old_dump_path', 'new_dump_path'])
+
+# The bits of the header-abi-diff exit status.
+ABI_DIFF_STATUS_BITS = (
+    (1, 'UNREFERENCED_CHANGES'),
+    (4, 'EXTENSION'),
+    (8, 'INCOMPATIBLE'),
+    (16, 'ELF_INCOMPATIBLE'),
+)
+
+
+def _decode_abi_diff_status(return_code):
+    if return_code is None:
+        return ['ERROR']
+    status = [name for bit, name in ABI_DIFF_STATUS_BITS if return_code & bit]
+    known_bits = sum(bit for bit, _ in ABI_DIFF_STATUS_BITS)
+    if return_code & ~known_bits:
+        status.append('ERROR')
+    return status or ['COMPATIBLE']
+
+
+def _run_abi_diff_task(task, output_dir, flags):
+    """Run header-abi-diff for an AbiDiffTask and return the result as a
+    JSON-serializable dictionary."""
+    result = task._asdict()
+    if not os.path.exists(task.old_dump_path):
+        result.update(return_code=None, status=['ERROR'], abidiff=None,
+                      output=f'{task.old_dump_path} does not exist.')
+        return result
+
+    output_path = os.path.join(output_dir, task.arch_str,
+                               task.lib_name + '.abidiff')
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    abi_diff_cmd = _get_abi_diff_cmd(task.old_dump_path, task.new_dump_path,
+                                     output_path, task.arch_str, task.lib_name,
+                                     flags)
+    proc = subprocess.run(abi_diff_cmd, stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT)
+    abidiff = None
+    if proc.returncode and os.path.exists(output_path):
+        with open(output_path, 'r') as output_file:
+            abidiff = output_file.read()
+    result.update(return_code=proc.returncode,
+                  status=_decode_abi_diff_status(proc.returncode),
+                  abidiff=abidiff,
+                  output=proc.stdout.decode('utf-8', 'replace'))
+    return result
+
+
+def run_abi_diffs(tasks, flags=tuple(), jobs=None):
+    """Run header-abi-diff for a list of AbiDiffTask with a process pool.
+
+    This function returns a list of dictionaries in the order of tasks.  Each
+    of them contains the fields of the task, the return code, the decoded
+    compatibility status, the abidiff content if the return code is not 0,
+    and the output of header-abi-diff.
+    """
+    if not tasks:
+        return []
+    with tempfile.TemporaryDirectory() as tmp:
+        # A library may be diffed for several tags of the same arch, so each
+        # task has its own output directory.
+        output_dirs = [os.path.join(tmp, str(i)) for i in range(len(tasks))]
+        with multiprocessing.Pool(jobs) as pool:
+            return pool.starmap(
+                _run_abi_diff_task,
+                zip(tasks, output_dirs, [tuple(flags)] * len(tasks)))
+
+
+def write_abi_diff_report(results, report_path):
+    """Write the results of run_abi_diffs to a JSON file."""
+    status_counts = collections.Counter(
+        name for result in results for name in result['status'])
+    report = {
+        'num_libs': len(results),
+        # A library whose dumps could not be compared is not known to be
+        # compatible, so errors are counted as differences too.
+        'num_diffs': sum(1 for result in results
+                         if result['status'] != ['COMPATIBLE']),
+        'num_errors': sum(1 for result in results
+                          if 'ERROR' in result['status']),
+        'status_counts': dict(sorted(status_counts.items())),
+        'results': results,
+    }
+    with open(report_path, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+        report_file.write('\n')
+    return report
+
+
 def get_build_vars(names, build_target):
     """ Get build system variable for the launched target."""
     env = os.environ.copy()